@@ -0,0 +1,147 @@
+# combo.py - Chords: keys pressed together within a short window
+#
+# A combo such as J+K -> Esc is resolved before PS2ToUSB.update_key sees the
+# keys. A key that could start or extend a combo is held back, and only while
+# a combo is still possible: when the combo completes its action is pressed
+# instead, when it can't complete any more (timeout, another key, release)
+# the held keys are passed on in the order they were pressed.
+#
+# Every key that takes part in some combo gets one bit. At load time all
+# subsets of every combo are precompiled into two lookups keyed by bitmask
+# (complete combos and proper prefixes), so a keystroke costs a bit OR and a
+# set/dict membership test on a small int, not a scan over the combos, and
+# allocates nothing.
+
+from array import array
+import time
+
+MAX_COMBO_KEYS = 30  # Bits in a small int
+
+
+class ComboEngine:
+    def __init__(self, combos, lut, emit, window_ms=30):
+        """
+        combos: {(key, key, ...): KeyAction}, keys as in KEY_MAP
+        lut:    KEY_LUT, to look up the held keys' own actions
+        emit:   emit(action, pressed), where resolved key events go
+        """
+        self.lut = lut
+        self.emit = emit
+        self.window_us = window_ms * 1000
+        self.bits = [0] * 512      # LUT index -> combo bit (0: not a combo key)
+        self.fires = {}            # Complete combo mask -> action
+        self.prefixes = set()      # Masks that a longer combo still extends
+        n_keys = 0
+        longest = 0
+        for keys, action in combos.items():
+            mask = 0
+            for scancode, extended in keys:
+                i = scancode | (extended << 8)
+                if not self.bits[i]:
+                    if n_keys == MAX_COMBO_KEYS:
+                        raise ValueError("Too many combo keys")
+                    self.bits[i] = 1 << n_keys
+                    n_keys += 1
+                mask |= self.bits[i]
+            self.fires[mask] = action
+            longest = max(longest, len(keys))
+            # Every proper, non-empty subset can still grow into this combo
+            sub = (mask - 1) & mask
+            while sub:
+                self.prefixes.add(sub)
+                sub = (sub - 1) & mask
+        # Keys held back, in press order (LUT indices)
+        self.held = array('H', [0] * max(longest, 1))
+        self.n_held = 0
+        self.pending = 0           # Bits of the held keys
+        self.start = 0             # ticks_us of the first held press
+        self.down = 0              # Combo keys passed on and still down
+        self.active = 0            # Keys of the fired combo still down
+        self.active_action = None
+        # Statistics
+        self.fired = 0             # Combos triggered
+        self.flushed = 0           # Held keys passed on as themselves
+        self.last_delay_us = 0     # Hold-back of the latest resolution
+        self.max_delay_us = 0
+
+    def process(self, idx, pressed):
+        """Feed a key event (LUT index). True if it was consumed here."""
+        bit = self.bits[idx]
+        if not bit:
+            if pressed and self.pending:
+                self._resolve()  # Held keys go out before this one
+            return False
+        if not pressed:
+            return self._release(bit)
+        if bit & self.active:
+            return True   # Typematic repeat of a combo key
+        if bit & self.down:
+            return False  # Typematic repeat of a key passed on
+        if bit & self.pending:
+            return True
+        mask = self.pending | bit
+        if mask not in self.prefixes and mask not in self.fires:
+            if self.pending:
+                # No combo left for the held keys plus this one
+                self._resolve()
+                return self.process(idx, pressed)
+            self.down |= bit
+            return False
+        if not self.pending:
+            self.start = time.ticks_us()
+        self._hold(idx, bit)
+        if mask not in self.prefixes:
+            self._resolve()
+        return True
+
+    def _hold(self, idx, bit):
+        self.held[self.n_held] = idx
+        self.n_held += 1
+        self.pending |= bit
+
+    def _release(self, bit):
+        if bit & self.active:
+            self.active &= ~bit
+            if self.active_action is not None:
+                # First key up releases the combo
+                self.emit(self.active_action, False)
+                self.active_action = None
+            return True
+        if bit & self.pending:
+            # Tapped before the combo could complete
+            self._resolve()
+            return self._release(bit)
+        self.down &= ~bit
+        return False
+
+    def _resolve(self):
+        # The combo can't grow any more: fire it, or pass the held keys on
+        delay = time.ticks_diff(time.ticks_us(), self.start)
+        self.last_delay_us = delay
+        if delay > self.max_delay_us:
+            self.max_delay_us = delay
+        action = self.fires.get(self.pending)
+        if action is not None:
+            self.active = self.pending
+            self.active_action = action
+            self.fired += 1
+            self.emit(action, True)
+        else:
+            self.down |= self.pending
+            for i in range(self.n_held):
+                self.emit(self.lut[self.held[i]], True)
+            self.flushed += self.n_held
+        self.pending = 0
+        self.n_held = 0
+
+    def tick(self):
+        """Call periodically: resolves the held keys once the window is over"""
+        if self.pending and time.ticks_diff(time.ticks_us(), self.start) >= self.window_us:
+            self._resolve()
+
+    def reset(self):
+        self.pending = 0
+        self.n_held = 0
+        self.down = 0
+        self.active = 0
+        self.active_action = None
@@ -0,0 +1,176 @@
+# display.py - SSD1306 status display, updated off the keystroke path
+#
+# Drawing goes into a framebuf in RAM and marks, per 8-pixel page, the span
+# of columns it touched. show() pushes only those spans over I2C, in small
+# chunks with a yield to the event loop after each one, so a redraw never
+# holds up key handling for longer than one chunk (~0.8 ms for 32 bytes at
+# 400 kHz; a full 1 KB frame in one go would take ~23 ms).
+#
+# StatusDisplay keeps text lines and redraws at most once per period, so any
+# number of state changes in between (locks, key rate, errors) cost one
+# redraw of only the characters that changed.
+
+import framebuf
+import time
+import uasyncio as asyncio
+
+_NONE = 0xFF  # Page without dirty columns
+
+_INIT = (
+    0xAE,               # Display off
+    0x20, 0x00,         # Horizontal addressing
+    0x40,               # Start line 0
+    0xA1,               # Segment remap (column 127 = SEG0)
+    0xC8,               # COM scan direction remapped
+    0xD3, 0x00,         # No display offset
+    0xD5, 0x80,         # Clock divide
+    0xD9, 0xF1,         # Pre-charge
+    0xDB, 0x30,         # VCOMH deselect level
+    0x81, 0x7F,         # Contrast
+    0xA4,               # Display follows RAM
+    0xA6,               # Not inverted
+    0x8D, 0x14,         # Charge pump on
+)
+
+
+class SSD1306:
+    def __init__(self, i2c, width=128, height=64, addr=0x3C):
+        self.i2c = i2c
+        self.addr = addr
+        self.width = width
+        self.height = height
+        self.pages = height // 8
+        self.buffer = bytearray(self.pages * width)
+        self.mv = memoryview(self.buffer)
+        self.fb = framebuf.FrameBuffer(self.buffer, width, height, framebuf.MONO_VLSB)
+        # Dirty column span per page
+        self.x0 = bytearray([_NONE] * self.pages)
+        self.x1 = bytearray(self.pages)
+        self._cmd = bytearray((0x00, 0x21, 0, 0, 0x22, 0, 0))  # Column + page window
+        self.bytes_sent = 0
+        self.chunks_sent = 0
+        self._command(_INIT + (0xA8, height - 1, 0xDA, 0x12 if height == 64 else 0x02, 0xAF))
+        self.mark(0, 0, width - 1, height - 1)  # RAM content is unknown after reset
+
+    def _command(self, cmds):
+        self.i2c.writeto(self.addr, bytes((0x00,) + tuple(cmds)))
+
+    def mark(self, x0, y0, x1, y1):
+        """Flag a rectangle (inclusive) as changed"""
+        if x0 < 0: x0 = 0
+        if x1 >= self.width: x1 = self.width - 1
+        if y0 < 0: y0 = 0
+        if y1 >= self.height: y1 = self.height - 1
+        if x0 > x1 or y0 > y1:
+            return
+        for p in range(y0 >> 3, (y1 >> 3) + 1):
+            if self.x0[p] == _NONE or x0 < self.x0[p]: self.x0[p] = x0
+            if x1 > self.x1[p]: self.x1[p] = x1
+
+    def dirty(self):
+        for p in range(self.pages):
+            if self.x0[p] != _NONE: return True
+        return False
+
+    # Drawing: framebuf calls that also mark what they touch
+
+    def fill(self, c):
+        self.fb.fill(c)
+        self.mark(0, 0, self.width - 1, self.height - 1)
+
+    def fill_rect(self, x, y, w, h, c):
+        self.fb.fill_rect(x, y, w, h, c)
+        self.mark(x, y, x + w - 1, y + h - 1)
+
+    def text(self, s, x, y, c=1):
+        self.fb.text(s, x, y, c)
+        self.mark(x, y, x + 8 * len(s) - 1, y + 7)
+
+    async def show(self, chunk=32, busy=None, max_defer_ms=200):
+        """
+        Push the dirty spans, at most chunk bytes per I2C write, yielding in
+        between. While busy() is true (keys being typed) the next chunk waits,
+        but for no more than max_defer_ms in total.
+        """
+        deferred = 0
+        w = self.width
+        for p in range(self.pages):
+            x = self.x0[p]
+            if x == _NONE:
+                continue
+            end = self.x1[p] + 1
+            # Cleared before pushing: drawing during the push marks it again
+            self.x0[p] = _NONE
+            self.x1[p] = 0
+            while x < end:
+                while busy is not None and deferred < max_defer_ms and busy():
+                    await asyncio.sleep_ms(5)
+                    deferred += 5
+                n = end - x if end - x < chunk else chunk
+                cmd = self._cmd
+                cmd[2] = x
+                cmd[3] = x + n - 1
+                cmd[5] = p
+                cmd[6] = p
+                self.i2c.writeto(self.addr, cmd)
+                o = p * w + x
+                self.i2c.writevto(self.addr, (b'\x40', self.mv[o:o + n]))
+                self.bytes_sent += n
+                self.chunks_sent += 1
+                x += n
+                await asyncio.sleep_ms(0)
+
+    def power(self, on):
+        self._command((0xAF if on else 0xAE,))
+
+
+class StatusDisplay:
+    """Text lines (8 px font) on an SSD1306, redrawn at most every period_ms"""
+
+    def __init__(self, oled, period_ms=100):
+        self.oled = oled
+        self.period_ms = period_ms
+        self.cols = oled.width // 8
+        self.lines = [""] * (oled.height // 8)
+        self.changed = 0  # Bitmask of rows
+        self.old = [""] * len(self.lines)
+        self.redraws = 0
+        self.redraw_us = 0  # Duration of the latest redraw (render + push)
+
+    def set(self, row, text):
+        text = text[:self.cols]
+        if text != self.lines[row]:
+            self.lines[row] = text
+            self.changed |= 1 << row
+
+    def _render(self, row):
+        # Only the columns from the first to the last differing character
+        new, old = self.lines[row], self.old[row]
+        n = max(len(new), len(old))
+        first = 0
+        while first < n and first < len(new) and first < len(old) and new[first] == old[first]:
+            first += 1
+        last = n - 1
+        while last > first and last < len(new) and last < len(old) and new[last] == old[last]:
+            last -= 1
+        if first > last:
+            return
+        y = row * 8
+        self.oled.fill_rect(first * 8, y, (last - first + 1) * 8, 8, 0)
+        self.oled.text(new[first:last + 1], first * 8, y)
+        self.old[row] = new
+
+    async def run(self, busy=None):
+        while True:
+            await asyncio.sleep_ms(self.period_ms)
+            if not self.changed and not self.oled.dirty():
+                continue
+            t = time.ticks_us()
+            changed = self.changed
+            self.changed = 0
+            for row in range(len(self.lines)):
+                if changed & (1 << row):
+                    self._render(row)
+            await self.oled.show(busy=busy)
+            self.redraws += 1
+            self.redraw_us = time.ticks_diff(time.ticks_us(), t)
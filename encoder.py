@@ -0,0 +1,148 @@
+# encoder.py - EC11 rotary encoder decoded by a PIO state machine
+#
+# ec11_reader follows the quadrature signal in hardware: every edge of A is
+# one step, and the level of B at that moment gives the direction. The
+# running count lives in the X register and is pushed to the RX FIFO only
+# when it changes, so the CPU does nothing while the knob is still and no
+# pin IRQ ever interrupts PS/2 decoding. Contact bounce on A produces
+# alternating +1/-1 steps that cancel out; bounce on B alone is not counted.
+# A count that changes while the FIFO is full (bounce, a stalled consumer)
+# stays pending in the program, which keeps checking the FIFO level and
+# pushes it as soon as there is room, so the last word in the FIFO is
+# always the current count and the CPU never has to reach into X.
+#
+# The program needs 31 of a PIO block's 32 instruction slots and ps2_reader
+# already takes 19 on PIO0, so the encoder runs on PIO1 (state machines 4-7).
+
+from machine import Pin, mem32
+import rp2
+
+ENCODER_FREQ = 1_000_000  # 1 us per instruction: a step is seen within ~10 us
+
+# The count is pushed as its low 30 bits, so words stay small ints (no
+# heap); poll() adds up the differences
+_COUNT_BITS = 30
+_COUNT_MASK = (1 << _COUNT_BITS) - 1
+_COUNT_HALF = 1 << (_COUNT_BITS - 1)
+
+# PIO SMx_EXECCTRL: STATUS_SEL in bit 4 (1 = RX FIFO level), STATUS_N in
+# bits 3:0. mov(y, status) reads all ones while the level is below N.
+_PIO_BASE = (0x50200000, 0x50300000)
+_EXECCTRL = 0x0cc
+_SM_STRIDE = 0x18
+_STATUS_RX_NOT_FULL = 0x10 | 8   # 8 deep RX FIFO
+
+@rp2.asm_pio(
+    in_shiftdir=rp2.PIO.SHIFT_LEFT,
+    out_shiftdir=rp2.PIO.SHIFT_RIGHT,
+    fifo_join=rp2.PIO.JOIN_RX,        # 8 deep RX FIFO
+)
+def ec11_reader():
+    # jmp_pin: A
+    # in_base (pin 0): B
+    # Push the count at start, then wait for A to leave its current level
+    jmp(pin, "high_pend")
+
+    wrap_target()
+    # A low, count not yet pushed: push it if the FIFO has room
+    label("low_pend")
+    mov(y, status)
+    jmp(not_y, "low_full")
+    in_(x, 30)
+    push(noblock)
+    label("low")
+    jmp(pin, "rise")
+    jmp("low")
+    label("low_full")
+    jmp(pin, "rise")
+    jmp("low_pend")
+
+    label("cw_rise")
+    mov(x, invert(x))         # X + 1 as ~(~X - 1)
+    jmp(x_dec, "cw_rise_2")
+    label("cw_rise_2")
+    mov(x, invert(x))
+    jmp("high_pend")
+    label("cw_fall")
+    mov(x, invert(x))
+    jmp(x_dec, "cw_fall_2")
+    label("cw_fall_2")
+    mov(x, invert(x))
+    jmp("low_pend")
+
+    # Rising edge of A: B low means clockwise
+    label("rise")
+    mov(osr, pins)
+    out(y, 1)
+    jmp(not_y, "cw_rise")
+    jmp(x_dec, "high_pend")   # X - 1 (lands on high_pend either way)
+
+    # A high, count not yet pushed. Once pushed, high loops on A and falls
+    # through high_full (A is low by then) into the falling edge.
+    label("high_pend")
+    mov(y, status)
+    jmp(not_y, "high_full")
+    in_(x, 30)
+    push(noblock)
+    label("high")
+    jmp(pin, "high")
+    label("high_full")
+    jmp(pin, "high_pend")
+
+    # Falling edge of A: B high means clockwise
+    label("fall")
+    mov(osr, pins)
+    out(y, 1)
+    jmp(y_dec, "cw_fall")
+    jmp(x_dec, "low_pend")    # X - 1 (lands on low_pend either way)
+    wrap()
+
+
+class Encoder:
+    """
+    EC11 on pin_a/pin_b (any two GPIOs). poll() returns the detents turned
+    since the last call, clockwise positive. steps_per_detent is 2 for the
+    common EC11 with one full quadrature cycle per detent.
+    """
+
+    def __init__(self, pin_a, pin_b, sm_id=4, steps_per_detent=2):
+        self.a = Pin(pin_a, Pin.IN, Pin.PULL_UP)
+        self.b = Pin(pin_b, Pin.IN, Pin.PULL_UP)
+        self.steps_per_detent = steps_per_detent
+        self.sm = rp2.StateMachine(sm_id)
+        self._execctrl = _PIO_BASE[sm_id >> 2] + _EXECCTRL + _SM_STRIDE * (sm_id & 3)
+        self.count = 0               # Steps since start, clockwise positive
+        self.base = 0                # Count at the last detent
+        self.detents = 0             # Total, clockwise positive
+        self._start_sm()
+
+    def _start_sm(self):
+        self.sm.init(ec11_reader, freq=ENCODER_FREQ, in_base=self.b, jmp_pin=self.a)
+        # init() rewrites EXECCTRL, so the status source goes in afterwards
+        mem32[self._execctrl] = (mem32[self._execctrl] & ~0x1F) | _STATUS_RX_NOT_FULL
+        self.raw = -1                # Last word from the FIFO
+        self.sm.active(1)
+
+    def poll(self):
+        """Detents since the last call; only reads the FIFO if the count moved"""
+        sm = self.sm
+        if not sm.rx_fifo():
+            return 0
+        while sm.rx_fifo():
+            raw = sm.get()
+            if self.raw < 0:
+                self.raw = raw       # Pushed at start: the baseline
+        # Signed difference of two 30-bit counts
+        self.count += ((raw - self.raw + _COUNT_HALF) & _COUNT_MASK) - _COUNT_HALF
+        self.raw = raw
+        # Whole detents only: a half-turned knob that springs back counts nothing
+        n = 0
+        per = self.steps_per_detent
+        while self.count - self.base >= per:
+            self.base += per
+            n += 1
+        while self.base - self.count >= per:
+            self.base -= per
+            n -= 1
+        self.detents += n
+        return n
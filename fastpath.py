@@ -0,0 +1,181 @@
+# fastpath.py - Native and viper compiled variants of the per-keystroke code
+#
+# The bytecode interpreter spends most of a keystroke dispatching opcodes
+# and looking names up. @micropython.native compiles a function to Thumb
+# machine code with the same semantics, @micropython.viper goes further
+# and works on machine ints and raw pointers (ptr8) where annotated. The
+# functions below are drop-in replacements for the plain methods:
+#
+#   decode_frame      PS2Keyboard._decode_frame (viper: returns the byte, or
+#                     -1 - the STAT_* index of the error instead of None)
+#   handle_frame      PS2Keyboard.handle_frame
+#   process_scancode  PS2Keyboard._process_scancode
+#   handle_events     PS2ToUSB.handle_events (unknown keys, combos and
+#                     errors still go through handle_ps2 / key_error)
+#   build_report      PS2ToUSB._build_report (viper)
+#
+# install() puts them on the classes. main.py does that on MicroPython
+# when NATIVE is set; the plain methods stay the reference and are what
+# runs on the PC, where tools/host.py makes the decorators no-ops and the
+# viper casts plain builtins so this module behaves the same under CPython.
+# tools/fastpath_check.py compares both versions, `bench.native()` on the
+# Pico times them.
+
+import micropython
+from micropython import const
+import time
+from ps2_pio import _UNSPREAD, _ODD_PARITY
+from keymap import KEY_LUT
+
+# Copies of the ps2_pio/main constants: viper only folds const() values
+# of its own module into machine ints (fastpath_check catches drift)
+_START_BIT = const(0x2)
+_STOP_BIT = const(0x200000)
+_TIMEOUT_WORD = const(0x3FFFFF)
+_EV_EXTENDED = const(0x100)
+_EV_PRESSED = const(0x200)
+_BAT_OK = const(0xAA)
+_BAT_FAIL = const(0xFC)
+_REPORT_KEYS = const(6)
+_ROLLOVER = const(0x01)
+
+# decode_frame errors: -1 - STAT_TIMEOUT, STAT_START_ERR, ...
+_ERR_START = const(-2)
+_ERR_STOP = const(-3)
+_ERR_PARITY = const(-4)
+_ERR_TIMEOUT = const(-5)
+
+
+@micropython.viper
+def decode_frame(frame: int) -> int:
+    """Data byte of a 22-bit frame word, or -1 - STAT_* index on error"""
+    if frame == _TIMEOUT_WORD:
+        return _ERR_TIMEOUT
+    if frame & _START_BIT:
+        return _ERR_START
+    if (frame & _STOP_BIT) == 0:
+        return _ERR_STOP
+    unspread = ptr8(_UNSPREAD)
+    b = unspread[(frame >> 3) & 0x7F] | (unspread[(frame >> 11) & 0x7F] << 4)
+    if ptr8(_ODD_PARITY)[b] == (frame >> 19) & 1:
+        return _ERR_PARITY
+    return b
+
+
+@micropython.native
+def handle_frame(self, frame):
+    if self.recorder is not None:
+        self.recorder.record(frame)
+    sc = decode_frame(frame)
+    if sc < 0:
+        self.stats[-1 - sc] += 1
+        self.bad_frames += 1
+        if self.bad_frames >= self.resync_after:
+            self.resync()
+        return
+    self.bad_frames = 0
+    self.stats[0] += 1   # STAT_FRAMES
+    process_scancode(self, sc)
+
+
+@micropython.native
+def process_scancode(self, sc):
+    if sc >= _BAT_OK:
+        if sc == _BAT_OK or sc == _BAT_FAIL:
+            self.bat = sc
+            self.bat_ms = time.ticks_ms()
+            self.extended = False
+            self.break_code = False
+            self.pause_state = 0
+            self.bat_flag.set()
+            return
+        # Pause/Break: E1 14 77 E1 F0 14 F0 77
+        if sc == 0xE1:
+            self.pause_state = 1
+            return
+    state = self.pause_state
+    if state:
+        if state == 1:
+            self.pause_state = 2 if sc == 0x14 else 3 if sc == 0xF0 else 0
+        elif state == 2:
+            if sc == 0x77:
+                self._emit(0x77 | _EV_EXTENDED | _EV_PRESSED)
+            self.pause_state = 0
+        elif state == 3:
+            self.pause_state = 4 if sc == 0x14 else 0
+        elif state == 4:
+            self.pause_state = 5 if sc == 0xF0 else 0
+        else:
+            if sc == 0x77:
+                self._emit(0x77 | _EV_EXTENDED)
+            self.pause_state = 0
+        return
+
+    if sc == 0xE0:
+        self.extended = True
+        return
+    if sc == 0xF0:
+        self.break_code = True
+        return
+
+    ev = sc
+    if not self.break_code:
+        ev |= _EV_PRESSED
+    if self.extended:
+        if sc == 0x12:
+            # E0 12: PrintScreen's fake shift, ignored
+            self.extended = False
+            self.break_code = False
+            return
+        ev |= _EV_EXTENDED
+    self.break_code = False
+    self.extended = False
+    self._emit(ev)
+
+
+@micropython.native
+def handle_events(self, buf, n):
+    lut = KEY_LUT
+    combos = self.combos
+    for i in range(n):
+        ev = buf[i]
+        action = lut[ev & 0x1FF]   # scancode | extended << 8
+        if not action or combos is not None:
+            self.handle_ps2(ev & 0xFF, (ev & _EV_PRESSED) != 0, (ev & _EV_EXTENDED) != 0)
+            continue
+        try:
+            self.update_key(action, (ev & _EV_PRESSED) != 0)
+        except Exception as e:
+            self.key_error(e)
+
+
+@micropython.viper
+def build_report(self, r):
+    p = ptr8(r)
+    n = int(self.n_down)
+    if n > _REPORT_KEYS:
+        p[0] = 0
+        for i in range(2, 2 + _REPORT_KEYS):
+            p[i] = _ROLLOVER
+        return
+    p[0] = int(self.mods)
+    down = ptr8(self.down)
+    for i in range(_REPORT_KEYS):
+        if i < n:
+            p[2 + i] = down[i]
+        else:
+            p[2 + i] = 0
+
+
+def install(kb_class, usb_class=None, events=True):
+    """
+    Replace the plain methods of a PS2Keyboard and a PS2ToUSB class (and
+    so of their instances). events=False keeps the plain handle_events,
+    e.g. for handle_ps2's DEBUG logging.
+    """
+    kb_class.handle_frame = handle_frame
+    kb_class._process_scancode = process_scancode
+    if usb_class is not None:
+        usb_class._build_report = build_report
+        if events:
+            usb_class.handle_events = handle_events
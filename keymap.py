@@ -1,19 +1,27 @@
 from ps2_constants import PS2
-from usb_constants import USB
+from usb_constants import USB, CONSUMER, SYSTEM, PAGE_KEYBOARD, PAGE_CONSUMER, PAGE_DESKTOP, PAGE_TEXT
 
 # --- KEY ACTION DEFINITION ---
 class KeyAction:
-    def __init__(self, codes, toggle=False):
+    def __init__(self, codes, toggle=False, page=PAGE_KEYBOARD):
         self.codes = codes if isinstance(codes, list) else [codes]
         self.toggle = toggle
+        self.page = page  # HID usage page: media/system keys go to media.py
 
-# Use K for normal key, T for toggle key, M for multi-key (macro)
+# Use K for normal key, T for toggle key, M for multi-key (macro),
+# C for consumer control (media) key, SYS for system control key,
+# S for a string typed on the host's layout (HOST_LAYOUT in main.py)
 def K(code): return KeyAction(code, toggle=False)
 def T(code): return KeyAction(code, toggle=True)
 def M(*codes): return KeyAction(list(codes), toggle=False)
+def C(code): return KeyAction(code, page=PAGE_CONSUMER)
+def SYS(code): return KeyAction(code, page=PAGE_DESKTOP)
+def S(text): return KeyAction(text, page=PAGE_TEXT)
 
 # Example for macro (A -> CTRL+ALT+T (open terminal)):
 #   PS2.T: M(USB.L_CTRL, USB.L_ALT, USB.T)
+# Example for typing text (F12 -> signature, on a Hungarian host layout):
+#   PS2.F12: S("Üdvözlettel,\nKovács Péter\n")
 #
 # To use USB F13-F24 see README.
 
@@ -142,4 +150,59 @@ KEY_MAP = {
 
     # ISO
     PS2.ISO_SLASH: K(USB.ISO_SLASH),
+
+    # Multimedia
+    PS2.MEDIA_NEXT: C(CONSUMER.MEDIA_NEXT),
+    PS2.MEDIA_PREV: C(CONSUMER.MEDIA_PREV),
+    PS2.MEDIA_STOP: C(CONSUMER.MEDIA_STOP),
+    PS2.MEDIA_PLAY: C(CONSUMER.MEDIA_PLAY),
+    PS2.MUTE: C(CONSUMER.MUTE),
+    PS2.VOL_UP: C(CONSUMER.VOL_UP),
+    PS2.VOL_DOWN: C(CONSUMER.VOL_DOWN),
+    PS2.MEDIA_SELECT: C(CONSUMER.MEDIA_SELECT),
+    PS2.MAIL: C(CONSUMER.MAIL),
+    PS2.CALC: C(CONSUMER.CALC),
+    PS2.MY_COMPUTER: C(CONSUMER.MY_COMPUTER),
+    PS2.WWW_SEARCH: C(CONSUMER.WWW_SEARCH),
+    PS2.WWW_HOME: C(CONSUMER.WWW_HOME),
+    PS2.WWW_BACK: C(CONSUMER.WWW_BACK),
+    PS2.WWW_FORWARD: C(CONSUMER.WWW_FORWARD),
+    PS2.WWW_STOP: C(CONSUMER.WWW_STOP),
+    PS2.WWW_REFRESH: C(CONSUMER.WWW_REFRESH),
+    PS2.WWW_FAVORITES: C(CONSUMER.WWW_FAVORITES),
+
+    # ACPI
+    PS2.POWER: SYS(SYSTEM.POWER),
+    PS2.SLEEP: SYS(SYSTEM.SLEEP),
+    PS2.WAKE: SYS(SYSTEM.WAKE),
+}
+
+# --- COMBOS ---
+# Keys pressed together within COMBO_WINDOW_MS send the combo's action
+# instead of their own (see combo.py). Keys that can start a combo are
+# delayed by up to the window, so keep combos to keys where that doesn't
+# hurt. Example (J+K -> ESC):
+#   (PS2.J, PS2.K): K(USB.ESC),
+COMBO_WINDOW_MS = 30
+
+COMBOS = {
 }
+
+# --- ROTARY ENCODER ---
+# Sent as a tap per detent of the EC11 knob (encoder.py, ENCODER = True in
+# main.py). E.g. K(USB.UP)/K(USB.DOWN) for menu navigation or
+# K(USB.PGUP)/K(USB.PGDN) for scrolling. Swap them if the direction is wrong.
+ENCODER_CW = C(CONSUMER.VOL_UP)
+ENCODER_CCW = C(CONSUMER.VOL_DOWN)
+
+# --- FLAT LOOKUP TABLE ---
+# KEY_MAP is keyed by (scancode, extended) tuples, so looking a key up means
+# building a tuple per keystroke. KEY_LUT is indexed by scancode | extended << 8
+# instead, which keeps the keystroke path allocation-free.
+def build_lut(key_map):
+    lut = [None] * 512
+    for (scancode, extended), action in key_map.items():
+        lut[scancode | (extended << 8)] = action
+    return lut
+
+KEY_LUT = build_lut(KEY_MAP)
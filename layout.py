@@ -0,0 +1,274 @@
+# layout.py - Typing text on the host's keyboard layout
+#
+# A USB keyboard sends key positions, and the host's layout decides which
+# character each one produces. To type a string the converter needs the
+# reverse: for every character the key, the modifiers and, on layouts with
+# dead keys (Hungarian á, ő, ...), the dead key to press first.
+#
+# Layout compiles a definition below into that reverse lookup once: code
+# points sorted in an array('H') and one packed array('I') entry per code
+# point (keycode | modifiers << 8 | dead key << 16 | caps << 24), found by
+# binary search. About 5 bytes per character and no allocation per lookup.
+#
+# Typist turns a string into the shortest report sequence: characters that
+# need the same modifiers are typed with the modifiers held throughout and
+# each key replacing the previous one in the next report; a release report
+# is only sent when the same key repeats or the modifiers change. Every
+# report takes one USB poll interval, so reports per character is what
+# limits the typing speed.
+
+from array import array
+import time
+import uasyncio as asyncio
+from usb.device.keyboard import LEDCode
+from usb_constants import USB
+
+SHIFT = 0x02   # Left Shift
+ALTGR = 0x40   # Right Alt
+
+# Modifiers per level of a key definition
+_LEVELS = (0, SHIFT, ALTGR, ALTGR | SHIFT)
+
+_CAPS = 1 << 24   # Entry flag: Caps Lock turns this letter's case around
+
+# --- LAYOUT DEFINITIONS ---
+# Per key: the characters without modifiers, with Shift, with AltGr and with
+# AltGr+Shift ("" where the level types nothing). A dead key is written as
+# its spacing character and listed in the dead table with the characters it
+# composes ("base composed" pairs); typing it alone is dead key + space.
+
+_COMMON = (
+    (USB.SPACE, " ", " "),
+    (USB.ENTER, "\n"),
+    (USB.TAB, "\t"),
+)
+
+US_KEYS = _COMMON + (
+    (USB.GRAVE, "`", "~"),
+    (USB.N1, "1", "!"), (USB.N2, "2", "@"), (USB.N3, "3", "#"), (USB.N4, "4", "$"),
+    (USB.N5, "5", "%"), (USB.N6, "6", "^"), (USB.N7, "7", "&"), (USB.N8, "8", "*"),
+    (USB.N9, "9", "("), (USB.N0, "0", ")"), (USB.MINUS, "-", "_"), (USB.EQUAL, "=", "+"),
+    (USB.Q, "q", "Q"), (USB.W, "w", "W"), (USB.E, "e", "E"), (USB.R, "r", "R"),
+    (USB.T, "t", "T"), (USB.Y, "y", "Y"), (USB.U, "u", "U"), (USB.I, "i", "I"),
+    (USB.O, "o", "O"), (USB.P, "p", "P"), (USB.L_BRACKET, "[", "{"), (USB.R_BRACKET, "]", "}"),
+    (USB.BACKSLASH, "\\", "|"),
+    (USB.A, "a", "A"), (USB.S, "s", "S"), (USB.D, "d", "D"), (USB.F, "f", "F"),
+    (USB.G, "g", "G"), (USB.H, "h", "H"), (USB.J, "j", "J"), (USB.K, "k", "K"),
+    (USB.L, "l", "L"), (USB.SEMICOLON, ";", ":"), (USB.QUOTE, "'", '"'),
+    (USB.Z, "z", "Z"), (USB.X, "x", "X"), (USB.C, "c", "C"), (USB.V, "v", "V"),
+    (USB.B, "b", "B"), (USB.N, "n", "N"), (USB.M, "m", "M"), (USB.COMMA, ",", "<"),
+    (USB.DOT, ".", ">"), (USB.SLASH, "/", "?"),
+)
+US_DEAD = {}
+
+# Hungarian (Windows, QWERTZ, ISO)
+HU_KEYS = _COMMON + (
+    (USB.GRAVE, "0", "§"),
+    (USB.N1, "1", "'", "~"), (USB.N2, "2", '"', "ˇ"), (USB.N3, "3", "+", "^"),
+    (USB.N4, "4", "!", "˘"), (USB.N5, "5", "%", "°"), (USB.N6, "6", "/", "˛"),
+    (USB.N7, "7", "=", "`"), (USB.N8, "8", "(", "˙"), (USB.N9, "9", ")", "´"),
+    (USB.N0, "ö", "Ö", "˝"), (USB.MINUS, "ü", "Ü", "¨"), (USB.EQUAL, "ó", "Ó", "¸"),
+    (USB.Q, "q", "Q", "\\"), (USB.W, "w", "W", "|"), (USB.E, "e", "E", "Ä"),
+    (USB.R, "r", "R"), (USB.T, "t", "T"), (USB.Y, "z", "Z"), (USB.U, "u", "U", "€"),
+    (USB.I, "i", "I", "Í"), (USB.O, "o", "O"), (USB.P, "p", "P"),
+    (USB.L_BRACKET, "ő", "Ő", "÷"), (USB.R_BRACKET, "ú", "Ú", "×"),
+    (USB.BACKSLASH, "ű", "Ű", "¤"),
+    (USB.A, "a", "A", "ä"), (USB.S, "s", "S", "đ"), (USB.D, "d", "D", "Đ"),
+    (USB.F, "f", "F", "["), (USB.G, "g", "G", "]"), (USB.H, "h", "H"),
+    (USB.J, "j", "J", "í"), (USB.K, "k", "K", "ł"), (USB.L, "l", "L", "Ł"),
+    (USB.SEMICOLON, "é", "É", "$"), (USB.QUOTE, "á", "Á", "ß"),
+    (USB.ISO_SLASH, "í", "Í", "<"), (USB.Z, "y", "Y", ">"), (USB.X, "x", "X", "#"),
+    (USB.C, "c", "C", "&"), (USB.V, "v", "V", "@"), (USB.B, "b", "B", "{"),
+    (USB.N, "n", "N", "}"), (USB.M, "m", "M"), (USB.COMMA, ",", "?", ";"),
+    (USB.DOT, ".", ":", ">"), (USB.SLASH, "-", "_", "*"),
+)
+HU_DEAD = {
+    "~": "aã nñ oõ AÃ NÑ OÕ",
+    "ˇ": "cč dď eě nň rř sš tť zž CČ DĎ EĚ NŇ RŘ SŠ TŤ ZŽ",
+    "^": "aâ eê iî oô uû AÂ EÊ IÎ OÔ UÛ",
+    "˘": "aă gğ AĂ GĞ",
+    "°": "uů UŮ",
+    "˛": "aą eę AĄ EĘ",
+    "`": "aà eè iì oò uù AÀ EÈ IÌ OÒ UÙ",
+    "˙": "zż ZŻ",
+    "´": "aá cć eé ií lĺ nń oó rŕ sś uú yý zź AÁ CĆ EÉ IÍ LĹ NŃ OÓ RŔ SŚ UÚ YÝ ZŹ",
+    "˝": "oő uű OŐ UŰ",
+    "¨": "aä eë oö uü yÿ AÄ EË OÖ UÜ",
+    "¸": "cç sş tţ CÇ SŞ TŢ",
+}
+
+LAYOUTS = {
+    "us": (US_KEYS, US_DEAD),
+    "hu": (HU_KEYS, HU_DEAD),
+}
+
+
+class Layout:
+    def __init__(self, keys, dead=None):
+        """Compile a layout definition (see US_KEYS) into the reverse lookup"""
+        dead = dead or {}
+        best = {}      # Code point -> (cost, order, entry)
+        dead_keys = []  # Packed keycode | modifiers << 8 of each dead key
+        dead_chars = []
+        n = 0
+
+        def offer(ch, cost, entry):
+            nonlocal n
+            cp = ord(ch)
+            n += 1
+            if cp > 0xFFFF or (cp in best and best[cp][:2] <= (cost, n)):
+                return
+            best[cp] = (cost, n, entry)
+
+        for key in keys:
+            code = key[0]
+            for level in range(len(key) - 1):
+                ch = key[level + 1]
+                if not ch:
+                    continue
+                mods = _LEVELS[level]
+                stroke = code | mods << 8
+                cost = bin(mods).count("1")
+                if ch in dead:
+                    # Dead key: alone it takes a space after it
+                    dead_keys.append(stroke)
+                    dead_chars.append(ch)
+                    d = len(dead_keys) << 16
+                    offer(ch, cost + 2, d | USB.SPACE)
+                    continue
+                flags = 0
+                if level < 2 and ch.lower() != ch.upper():
+                    flags = _CAPS   # A letter: Caps Lock swaps the levels
+                offer(ch, cost, stroke | flags)
+
+        # Composed characters: the dead key, then the base character's stroke
+        for d, ch in enumerate(dead_chars):
+            for pair in dead[ch].split():
+                base = best.get(ord(pair[0]))
+                if base is not None and not base[2] >> 16 & 0xFF:
+                    offer(pair[1], base[0] + 2, (d + 1) << 16 | base[2] & 0x100FFFF)
+
+        points = sorted(best)
+        self.points = array('H', points)
+        self.entries = array('I', [best[cp][2] for cp in points])
+        self.dead_keys = array('H', [0] + dead_keys)
+
+    def lookup(self, cp):
+        """Packed entry for code point cp, or -1 if the layout can't type it"""
+        points = self.points
+        lo, hi = 0, len(points)
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if points[mid] < cp:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(points) and points[lo] == cp:
+            return self.entries[lo]
+        return -1
+
+    def strokes(self, ch, caps=False):
+        """(modifiers, keycode) pairs that type ch, dead key first"""
+        e = self.lookup(ord(ch))
+        if e < 0:
+            return ()
+        mods = e >> 8 & 0xFF
+        if caps and e & _CAPS:
+            mods ^= SHIFT
+        stroke = (mods, e & 0xFF)
+        d = e >> 16 & 0xFF
+        if d:
+            s = self.dead_keys[d]
+            return ((s >> 8, s & 0xFF), stroke)
+        return (stroke,)
+
+
+def reports(layout, text, caps=False, missing=None):
+    """
+    The minimal report sequence for text as (modifiers, keycode) pairs,
+    ending with everything released. Characters the layout can't type are
+    skipped (and appended to missing, if given).
+    """
+    cur_mods = cur_key = 0
+    for ch in text:
+        strokes = layout.strokes(ch, caps)
+        if not strokes and missing is not None:
+            missing.append(ch)
+        for mods, key in strokes:
+            if mods != cur_mods or key == cur_key:
+                # Modifier change or repeated key: release the key first
+                yield mods, 0
+            yield mods, key
+            cur_mods, cur_key = mods, key
+    if cur_mods or cur_key:
+        yield 0, 0
+
+
+class Typist:
+    """
+    Types strings through a PS2ToUSB keyboard. The physical key state is put
+    back when done. chars_per_s / reports_per_s are from the last type().
+    Typing stops (aborted += 1) if the host closes the interface.
+    """
+
+    def __init__(self, kb, layout):
+        self.kb = kb
+        self.layout = layout
+        self.lock = asyncio.Lock()
+        # Built here, copied into kb's report buffers only when sent
+        self._report = bytearray(8)
+        self.chars = 0
+        self.reports = 0
+        self.missing = 0
+        self.aborted = 0
+        self.chars_per_s = 0
+        self.reports_per_s = 0
+
+    async def _send(self, r):
+        """
+        Send r the way flush_keys does: through kb's ping/pong buffers, so
+        the last one sent is what flush_keys compares the next against.
+        False if the interface is closed.
+        """
+        kb = self.kb
+        while True:
+            if not kb.is_open():
+                return False  # Host gone or not configured yet
+            # Copied on every try: flush_keys may have used the free buffer
+            # while we waited
+            buf, sent = kb._key_reports
+            buf[:] = r
+            if kb.send_report(buf):
+                break
+            await asyncio.sleep_ms(1)  # Endpoint busy
+        kb._key_reports[0] = sent
+        kb._key_reports[1] = buf
+        self.reports += 1
+        await asyncio.sleep_ms(0)      # Let PS/2 polling run between reports
+        return True
+
+    async def type(self, text):
+        async with self.lock:
+            caps = bool(self.kb.leds & LEDCode.CAPS_LOCK)
+            missing = []
+            t = time.ticks_us()
+            n = self.reports
+            r = self._report
+            for mods, key in reports(self.layout, text, caps, missing):
+                r[0] = mods
+                r[2] = key
+                for i in range(3, 8):
+                    r[i] = 0   # Left over from a _build_report
+                if not await self._send(r):
+                    self.aborted += 1
+                    return
+            # Keys held on the physical keyboard go back down
+            self.kb._build_report(r)
+            if not await self._send(r):
+                self.aborted += 1
+                return
+            us = max(time.ticks_diff(time.ticks_us(), t), 1)
+            self.missing += len(missing)
+            self.chars = len(text) - len(missing)
+            self.chars_per_s = self.chars * 1_000_000 // us
+            self.reports_per_s = (self.reports - n) * 1_000_000 // us
@@ -3,16 +3,31 @@
 
 import uasyncio as asyncio
 import usb.device
-from usb.device.keyboard import KeyboardInterface
-from ps2_pio import PS2Keyboard
+from usb.device.keyboard import KeyboardInterface, LEDCode
+from ps2_pio import PS2Keyboard, EV_EXTENDED, EV_PRESSED, STAT_FRAMES, BAT_OK
 from machine import Pin
+from array import array
 import time
 import sys
+import gc
 import neopixel
 
 # --- DEBUG LOGGING ---
 DEBUG = False
 
+# --- MEMORY / GC ---
+# In zero-alloc mode the PS/2 -> USB report path allocates nothing per
+# keystroke, and garbage from everything else is collected while idle
+# instead of whenever the heap happens to fill up mid-typing.
+ZERO_ALLOC = True
+GC_IDLE_MS = 250        # Collect after this long without key activity
+GC_THRESHOLD = 16384    # Bytes allocated before an automatic collection
+
+# Run frame decoding, scancode parsing, the key map lookup and report
+# building as native/viper machine code (fastpath.py). MicroPython only,
+# the plain methods are used on the PC and with this off.
+NATIVE = True
+
 # --- STATUS LED CONTROLLER ---
 class StatusController:
     def __init__(self):
@@ -20,6 +35,7 @@ class StatusController:
         self.np = neopixel.NeoPixel(Pin(16), 1)
         self.state = "INIT" # INIT, READY, USB_ERR, PS2_ERR
         self.last_act = 0
+        self.beat = 0  # ticks_ms of the latest round, for the supervisor
         
     def trigger_activity(self):
         self.last_act = time.ticks_ms()
@@ -33,6 +49,10 @@ class StatusController:
         
     async def run(self):
         while True:
+            if idle():
+                self.np[0] = (0, 0, 0); self.np.write()
+                await GOVERNOR.park()
+            self.beat = time.ticks_ms()
             try:
                 if self.state == "INIT":
                     # Flash Yellow
@@ -64,32 +84,135 @@ class StatusController:
                         self.np[0] = (0, 5, 0)   # Dim Green
                     self.np.write()
                     await asyncio.sleep(0.05)
-            except:
+            except Exception:
                 await asyncio.sleep(1)
 
 STATUS = StatusController()
 
-def log(msg, error=False):
-    print(msg)
-    if DEBUG or error:
-        try:
-            with open("log.txt", "a") as f:
-                f.write(f"{time.ticks_ms()}: {msg}\n")
-        except:
-            pass
+# --- LOG STORE ---
+# Errors (everything with DEBUG) go into a fixed-size record store on flash
+# (store.py): lines are batched in RAM and written while the keyboard is
+# idle, and the oldest are dropped when it is full. Read them with
+# store.dump(). Opened by main(), until then log() only prints.
+LOG_PATH = "store.bin"
+LOG_BLOCKS = 4   # 4 KB blocks
+LOG = None
 
-# Clear log on startup
-if DEBUG:
+def open_log():
+    global LOG
     try:
-        with open("log.txt", "w") as f:
-            f.write("--- STARTUP ---\n")
-    except:
-        pass
+        from store import RecordStore, FileDevice
+        LOG = RecordStore(FileDevice(LOG_PATH, LOG_BLOCKS))
+    except Exception as e:
+        print(f"Log store unavailable: {e}")
+        return
+    if DEBUG: LOG.log("--- STARTUP ---")
+    asyncio.create_task(LOG.run(
+        idle=lambda: time.ticks_diff(time.ticks_ms(), STATUS.last_act) > GC_IDLE_MS))
+
+def log(msg, error=False):
+    print(msg)
+    if LOG and (DEBUG or error):
+        LOG.log(f"{time.ticks_ms()}: {msg}")
 
 # --- CONFIGURATION ---
 PS2_CLK_PIN = 0
 PS2_DATA_PIN = 1
 
+# Interrupt IN endpoint polling interval: how often the host picks up a
+# report. 1 ms is the minimum at full speed (micropython-lib default: 8 ms).
+USB_INTERVAL_MS = 1
+
+# Answer Scroll Lock LED changes with a tap of PROBE_KEY sent through the
+# event ring (by core 1 with DUAL_CORE, the ring's only producer then), so
+# tools/latency.py can time the round trip on the PC
+LATENCY_PROBE = False
+PROBE_KEY = (0x08, True)  # Unused E0 code, mapped to F24 while probing
+
+# Expose the runtime counters (telemetry.py) as a vendor HID feature report
+# for tools/stats.py
+TELEMETRY = True
+
+# Media (volume, playback, browser) and power keys go out through a second
+# HID interface (media.py). Without it they are ignored.
+MEDIA_KEYS = True
+
+# Decoded key events wait in a ring of this size for the USB task. While it
+# is full, frames stay in the PIO FIFO instead of being dropped.
+EVENT_RING_SIZE = 64
+
+# Decode PS/2 on core 1 so USB sends, LED writes and logging on core 0
+# can't delay it. Key events cross over through the same lock-free ring.
+DUAL_CORE = False
+
+# Record every raw PS/2 frame with its timing to TRACE_PATH, for bug reports
+# and replay (ps2_trace.py, tools/replay.py). Written to flash while idle.
+TRACE_CAPTURE = False
+TRACE_PATH = "trace.ps2t"
+
+# 128x64 SSD1306 status display on I2C (display.py): state, lock LEDs,
+# PS/2 frame rate and line errors. Redraws are pushed in small chunks and
+# held back while keys are being typed.
+DISPLAY = False
+DISPLAY_I2C = 0
+DISPLAY_SDA_PIN = 4
+DISPLAY_SCL_PIN = 5
+DISPLAY_I2C_FREQ = 400_000
+DISPLAY_PERIOD_MS = 100   # Redraw at most this often
+DISPLAY_BUSY_MS = 50      # Defer pushes until keys have been idle this long
+
+# EC11 rotary encoder decoded by PIO (encoder.py), sending ENCODER_CW /
+# ENCODER_CCW from keymap.py per detent. Runs on PIO1, next to ps2_reader.
+ENCODER = False
+ENCODER_A_PIN = 2
+ENCODER_B_PIN = 3
+ENCODER_SM = 4
+ENCODER_POLL_MS = 5
+
+# Tasks run under supervisor.py: a crashed PS/2 reader or event pump is
+# restarted at once (held keys are released first), with backoff if it
+# keeps crashing. With WATCHDOG_MS set, the hardware watchdog is fed only
+# while the reader, the pump and the status LED task are alive, so a hung
+# loop resets the board. Off by default: with the watchdog running, stopping
+# main.py from the REPL or Thonny resets the board after WATCHDOG_MS.
+WATCHDOG_MS = 0     # e.g. 2000
+STALL_MS = 250      # Restart a task whose liveness check fails this long
+
+# Keyboard layout of the host, for S("...") actions in keymap.py
+# (layout.py: "us" or "hu"). The strings must match what the host types.
+HOST_LAYOUT = "us"
+
+# Keymaps pushed from the PC (tools/push.py) through a vendor HID interface
+# (remap.py), applied between two key events without a reset. The last one
+# pushed is saved to REMAP_PATH and replaces keymap.py's at startup.
+REMAP = False
+REMAP_PATH = "keymap.bin"
+
+# Boot: PS/2 capture starts at once and keys typed before the host has
+# configured the USB device wait in the event ring (EVENT_RING_SIZE events)
+# and are replayed when it has. A keyboard powered up with the board
+# reports its self-test (BAT) 500-750 ms after reset; READY also waits for
+# that, unless keys have come in already, and only until BAT_WAIT_MS after
+# reset, as one that was already powered sends none. Reset -> ready times
+# are in telemetry.
+BAT_WAIT_MS = 1000
+
+# Idle governor (power.py): after IDLE_MS without key activity the clock
+# drops to IDLE_FREQ and the polling tasks (PS/2 read loop, combos,
+# encoder, status LED) stop until the next falling edge on PS/2 CLK, which
+# restores full speed well before that first frame is complete. When the
+# host suspends USB the converter goes idle at once; with USB_REMOTE_WAKEUP
+# a keypress then wakes the PC. Residency and wake latency are in telemetry.
+POWER_SAVE = False
+IDLE_MS = 5000
+IDLE_FREQ = 48_000_000    # USB has its own 48 MHz PLL and is not affected
+USB_REMOTE_WAKEUP = True
+GOVERNOR = None
+
+def idle():
+    # True while the governor has parked the polling tasks
+    return GOVERNOR is not None and GOVERNOR.idle
+
 # --- PS/2 CONSTANTS ---
 from ps2_constants import PS2
 
@@ -97,110 +220,460 @@ from ps2_constants import PS2
 from usb_constants import USB
 
 # --- KEY ACTION DEFINITION AND MAPPINGS ---
-from keymap import KEY_MAP
+from keymap import KEY_LUT, COMBOS, COMBO_WINDOW_MS, K, ENCODER_CW, ENCODER_CCW
+from usb_constants import PAGE_KEYBOARD, PAGE_TEXT
+from usb_interval import set_interval
+from telemetry import COUNTERS, T_UNKNOWN, T_REPORTS, T_SEND_FAIL, T_USB_ERR, T_GC_RUNS, T_RESTARTS
+from telemetry import T_USB_MS, T_BAT_MS, T_READY_MS, T_REPLAYED
+from supervisor import Supervisor
 
 # --- LOGIC ---
 
+MAX_DOWN = 16     # Non-modifier keys tracked at once (6 fit in a report)
+REPORT_KEYS = 6   # Key array size of the boot keyboard report
+ROLLOVER = 0x01   # HID ErrorRollOver usage
+
 class PS2ToUSB(KeyboardInterface):
     def __init__(self):
         super().__init__()
-        self.pressed_keys = set()
-        self.last_sent_keys = []
+        # Preallocated key state: modifier bitmask plus keycodes in press
+        # order, so update_key/flush_keys never touch the heap
+        self.mods = 0
+        self.down = bytearray(MAX_DOWN)
+        self.n_down = 0
         self.error_state = False
+        self.media = None  # media.MediaInterface for consumer/system keys
+        self.probe_kb = None  # PS2Keyboard to inject LATENCY_PROBE taps into
+        self.typist = None  # layout.Typist for S("...") actions
+        self.leds = 0
+        self.opened = asyncio.ThreadSafeFlag()  # Set when the host configures the device
+        self.pump_beat = 0  # ticks_ms of event_pump's latest batch, for the supervisor
+        self.combos = None
+        if COMBOS:
+            from combo import ComboEngine
+            self.combos = ComboEngine(COMBOS, KEY_LUT, self.update_key, COMBO_WINDOW_MS)
+
+    def desc_cfg(self, desc, itf_num, ep_num, strs):
+        start = desc.o
+        super().desc_cfg(desc, itf_num, ep_num, strs)
+        set_interval(desc, start, USB_INTERVAL_MS)
+
+    def on_open(self):
+        super().on_open()
+        self.opened.set()
+
+    def on_led_update(self, led_mask):
+        # LATENCY_PROBE: tools/latency.py toggles Scroll Lock
+        if self.probe_kb and (led_mask ^ self.leds) & LEDCode.SCROLL_LOCK:
+            ev = PROBE_KEY[0] | EV_EXTENDED
+            self.probe_kb.inject(ev | EV_PRESSED)
+            self.probe_kb.inject(ev)
+        self.leds = led_mask
+
+    def _find(self, code):
+        for i in range(self.n_down):
+            if self.down[i] == code: return i
+        return -1
+
+    def _press(self, code):
+        if code < 0:
+            if self.mods & -code: return False
+            self.mods |= -code
+            return True
+        if self.n_down >= MAX_DOWN or self._find(code) >= 0: return False
+        self.down[self.n_down] = code
+        self.n_down += 1
+        return True
+
+    def _release(self, code):
+        if code < 0:
+            if not self.mods & -code: return False
+            self.mods &= ~-code
+            return True
+        i = self._find(code)
+        if i < 0: return False
+        self.n_down -= 1
+        while i < self.n_down:
+            self.down[i] = self.down[i + 1]
+            i += 1
+        return True
+
+    def _is_down(self, code):
+        if code < 0: return bool(self.mods & -code)
+        return self._find(code) >= 0
+
+    def handle_ps2(self, scancode, pressed, extended):
+        # PS/2 callback: map the scancode and update the USB key state
+        if DEBUG and (scancode == 0x1F or scancode == 0x27):
+            # Debug Windows Keys specifically
+            log(f"WIN KEY: {hex(scancode)} Ext:{extended} Pressed:{pressed}", error=True)
+
+        action = KEY_LUT[scancode | (extended << 8)]
+        if action:
+            try:
+                if self.combos is None or not self.combos.process(scancode | (extended << 8), pressed):
+                    self.update_key(action, pressed)
+            except Exception as e:
+                self.key_error(e)
+        else:
+            COUNTERS[T_UNKNOWN] += 1
+            log(f"Unknown: {hex(scancode)} Ext:{extended}", error=True)
+            STATUS.trigger_error("PS2_ERR")
+
+    def set_keymap(self, lut, combos, window_ms):
+        # Swap in another keymap (remap.py). KEY_LUT is replaced in place,
+        # so everything holding it (fastpath, the combo engine) sees the
+        # new one; release held keys first, or their release finds a
+        # different action
+        KEY_LUT[:] = lut
+        self.combos = None
+        if combos:
+            from combo import ComboEngine
+            self.combos = ComboEngine(combos, KEY_LUT, self.update_key, window_ms)
+        if self.typist is None:
+            self.typist = load_typist(self, lut + list(combos.values()))
+
+    def key_error(self, e):
+        log(f"Update Key Error: {e}", error=True)
+        STATUS.set_state("USB_ERR")
+
+    def handle_events(self, buf, n):
+        # Packed events from PS2Keyboard.events() / read_events(). Known
+        # keys go straight to update_key: scancode | EV_EXTENDED is the
+        # KEY_LUT index. Unknown keys, combos and DEBUG take handle_ps2.
+        lut = KEY_LUT
+        combos = self.combos
+        for i in range(n):
+            ev = buf[i]
+            action = lut[ev & 0x1FF]
+            if DEBUG or not action or combos is not None:
+                self.handle_ps2(ev & 0xFF, bool(ev & EV_PRESSED), bool(ev & EV_EXTENDED))
+                continue
+            try:
+                self.update_key(action, bool(ev & EV_PRESSED))
+            except Exception as e:
+                self.key_error(e)
 
     def update_key(self, action, pressed):
         if action is None: return
         STATUS.trigger_activity()
+        if action.page != PAGE_KEYBOARD:
+            if action.page == PAGE_TEXT:
+                if pressed and self.typist: asyncio.create_task(self.typist.type(action.codes[0]))
+            elif self.media: self.media.update(action, pressed)
+            return
         
         changed = False
         for code in action.codes:
             if action.toggle:
                 if pressed:
-                    if code in self.pressed_keys: self.pressed_keys.discard(code)
-                    else: self.pressed_keys.add(code)
+                    if not self._release(code): self._press(code)
                     changed = True
+            elif pressed:
+                if self._press(code): changed = True
             else:
-                if pressed:
-                    if code not in self.pressed_keys:
-                        self.pressed_keys.add(code)
-                        changed = True
-                else:
-                    if code in self.pressed_keys:
-                        self.pressed_keys.discard(code)
-                        changed = True
+                if self._release(code): changed = True
         
         if changed: self.flush_keys()
 
+    def _build_report(self, r):
+        # Same layout as KeyboardInterface.send_keys, built from the key state
+        if self.n_down > REPORT_KEYS:
+            r[0] = 0
+            for i in range(2, 2 + REPORT_KEYS): r[i] = ROLLOVER
+            return
+        r[0] = self.mods
+        for i in range(REPORT_KEYS):
+            r[2 + i] = self.down[i] if i < self.n_down else 0
+
     def flush_keys(self):
         if not self.is_open(): return
+        if self.media: self.media.flush()  # A media report dropped earlier
         try:
-            keys_list = list(self.pressed_keys)
-            keys_list.sort()
-            if keys_list != self.last_sent_keys:
-                # print(f"Sending: {keys_list}")
-                self.send_keys(keys_list)
-                self.last_sent_keys = keys_list
+            # Ping/pong buffers of KeyboardInterface: r is free, s was sent last
+            r, s = self._key_reports
+            self._build_report(r)
+            if r != s:
+                if self.send_report(r):
+                    self._key_reports[0] = s
+                    self._key_reports[1] = r
+                    COUNTERS[T_REPORTS] += 1
+                else:
+                    COUNTERS[T_SEND_FAIL] += 1
                 self.error_state = False
                 if STATUS.state == "USB_ERR": STATUS.set_state("READY")
         except Exception as e:
+            COUNTERS[T_USB_ERR] += 1
             log(f"USB Error: {e}", error=True)
             STATUS.set_state("USB_ERR")
-            self.pressed_keys.clear()
-            self.last_sent_keys = []
-            try: self.send_keys([])
-            except: pass
+            self.release_all()
             self.error_state = True
 
+    def release_all(self):
+        # Forget every held key and tell the host
+        self.mods = 0
+        self.n_down = 0
+        if self.combos: self.combos.reset()
+        try: self.send_keys([])
+        except: pass
+        if self.media:
+            try: self.media.release_all()
+            except: pass
+
+async def event_pump(ps2_kb, usb_kb):
+    # Feed decoded PS/2 events into the USB path, everything that piled up
+    # since the last wakeup in one go
+    buf = array('I', [0] * EVENT_RING_SIZE)
+    events = ps2_kb.events()
+    while True:
+        n = await events.batch(buf)
+        usb_kb.handle_events(buf, n)
+        usb_kb.pump_beat = time.ticks_ms()
+
+def pump_alive(ps2_kb, usb_kb):
+    # Stuck = events waiting and no batch handled lately. An empty ring is
+    # an idle pump; a busy one keeps beating while the reader refills it.
+    return (not ps2_kb.ring.pending()
+            or time.ticks_diff(time.ticks_ms(), usb_kb.pump_beat) < 50)
+
+async def combo_task(usb_kb):
+    # Ends the hold-back of combo keys once COMBO_WINDOW_MS is over, so a
+    # lone combo key is late by at most the window plus one tick
+    while True:
+        if idle(): await GOVERNOR.park()
+        try:
+            if usb_kb.combos: usb_kb.combos.tick()
+        except Exception as e:
+            log(f"Update Key Error: {e}", error=True)
+            STATUS.set_state("USB_ERR")
+        await asyncio.sleep_ms(1)
+
+async def apply_keymap(usb_kb, lut, combos, window_ms):
+    # remap.py: swap while no key is down (keys still held after a second
+    # are released), and from a task, so between two batches of the pump
+    t = time.ticks_ms()
+    while usb_kb.n_down or usb_kb.mods:
+        if time.ticks_diff(time.ticks_ms(), t) > 1000:
+            usb_kb.release_all()
+            break
+        await asyncio.sleep_ms(1)
+    usb_kb.set_keymap(lut, combos, window_ms)
+
+def load_typist(usb_kb, actions):
+    # A Typist for S("...") actions, None if there are none
+    if not any(a and a.page == PAGE_TEXT for a in actions):
+        return None
+    from layout import Layout, Typist, LAYOUTS
+    t = time.ticks_ms()
+    typist = Typist(usb_kb, Layout(*LAYOUTS[HOST_LAYOUT]))
+    log(f"Layout {HOST_LAYOUT}: {len(typist.layout.points)} characters, "
+        f"compiled in {time.ticks_diff(time.ticks_ms(), t)} ms")
+    return typist
+
+async def encoder_task(enc, usb_kb):
+    # The state machine counts on its own; this only looks at the FIFO
+    while True:
+        if idle(): await GOVERNOR.park()
+        await asyncio.sleep_ms(ENCODER_POLL_MS)
+        try:
+            n = enc.poll()
+            while n:
+                action = ENCODER_CW if n > 0 else ENCODER_CCW
+                usb_kb.update_key(action, True)
+                usb_kb.update_key(action, False)
+                n += -1 if n > 0 else 1
+        except Exception as e:
+            log(f"Encoder Error: {e}", error=True)
+            STATUS.set_state("USB_ERR")
+
+async def gc_task():
+    # Collect garbage only while no keys are active, so collections never
+    # land in the middle of typing
+    gc.threshold(GC_THRESHOLD)
+    baseline = gc.mem_alloc()
+    while True:
+        if idle(): await GOVERNOR.park()
+        await asyncio.sleep_ms(GC_IDLE_MS)
+        if time.ticks_diff(time.ticks_ms(), STATUS.last_act) < GC_IDLE_MS: continue
+        if gc.mem_alloc() > baseline:
+            gc.collect()
+            COUNTERS[T_GC_RUNS] += 1
+            baseline = gc.mem_alloc()
+
+async def display_task(status, ps2_kb, usb_kb):
+    # Copy converter state into the display lines twice a second; status.run
+    # coalesces the changes into one redraw
+    frames = ps2_kb.stats[STAT_FRAMES]
+    t = time.ticks_ms()
+    while True:
+        if idle(): await GOVERNOR.park()
+        await asyncio.sleep_ms(500)
+        now = time.ticks_ms()
+        n = ps2_kb.stats[STAT_FRAMES]
+        rate = (n - frames) * 1000 // max(time.ticks_diff(now, t), 1)
+        frames, t = n, now
+        leds = usb_kb.leds
+        status.set(0, "PS2>USB " + STATUS.state)
+        status.set(1, ("NUM " if leds & LEDCode.NUM_LOCK else "--- ") +
+                      ("CAPS " if leds & LEDCode.CAPS_LOCK else "---- ") +
+                      ("SCRL" if leds & LEDCode.SCROLL_LOCK else "----"))
+        status.set(2, f"{rate:4} frames/s")
+        status.set(3, f"line errors {sum(ps2_kb.stats) - n}")
+        status.set(4, f"reports {COUNTERS[T_REPORTS]}")
+
+async def core1_task(kb):
+    # Stands in for the core 1 reader under the supervisor: ends with an
+    # error when the thread stops, and stops the thread when cancelled
+    while kb.core1_alive:
+        await asyncio.sleep_ms(1)  # Previous thread still on its way out
+    kb.start_core1()
+    try:
+        while True:
+            await asyncio.sleep_ms(100)
+            if not kb.core1_alive:
+                raise RuntimeError("core 1 reader stopped")
+    finally:
+        kb.stop_core1()
+
+async def boot(ps2_kb, usb_kb):
+    # Reset -> READY without fixed delays: wait for the host to configure
+    # the device and for the keyboard's self-test, then replay the keys
+    # typed meanwhile. ticks_ms counts from reset on the RP2040.
+    if not usb_kb.is_open():
+        await usb_kb.opened.wait()
+    COUNTERS[T_USB_MS] = time.ticks_ms()
+    log(f"USB Keyboard Ready after {COUNTERS[T_USB_MS]} ms")
+    wait = BAT_WAIT_MS - time.ticks_ms()
+    if not ps2_kb.bat and not ps2_kb.ring.pending() and wait > 0:
+        try:
+            await asyncio.wait_for_ms(ps2_kb.bat_flag.wait(), wait)
+        except asyncio.TimeoutError:
+            pass  # Keyboard powered before the board: no self-test to see
+    if ps2_kb.bat == BAT_OK:
+        COUNTERS[T_BAT_MS] = ps2_kb.bat_ms
+        log(f"Keyboard self-test passed after {ps2_kb.bat_ms} ms")
+    elif ps2_kb.bat:
+        log("Keyboard self-test failed", error=True)
+        STATUS.trigger_error("PS2_ERR")
+    buf = array('I', [0] * EVENT_RING_SIZE)
+    n = ps2_kb.read_events(buf)
+    while n:
+        # Each report waits for the one before it, so no key is merged away
+        usb_kb.handle_events(buf, n)
+        COUNTERS[T_REPLAYED] += n
+        n = ps2_kb.read_events(buf)
+    COUNTERS[T_READY_MS] = time.ticks_ms()
+    if STATUS.state == "INIT": STATUS.set_state("READY")
+    log(f"Ready after {COUNTERS[T_READY_MS]} ms, {COUNTERS[T_REPLAYED]} key events replayed")
+
 async def main():
+    global GOVERNOR
     log("Starting PS/2 to USB HID Bridge...")
-    asyncio.create_task(STATUS.run())
-    
+    if NATIVE and sys.implementation.name == "micropython":
+        import fastpath
+        fastpath.install(PS2Keyboard, PS2ToUSB, events=not DEBUG)
+        log("Native hot path enabled")
+    sup = Supervisor(WATCHDOG_MS, log=log, stall_ms=STALL_MS)
+    sup.add("status", STATUS.run,
+            lambda: idle() or time.ticks_diff(time.ticks_ms(), STATUS.beat) < 1000)
+    sup_task = asyncio.create_task(sup.run())
+
     usb_kb = None
     try:
+        # PS/2 capture first: what is typed from here on waits in the event
+        # ring until the host is ready (see boot())
+        log("Initializing PS/2...")
+        ps2_kb = PS2Keyboard(clk_pin=PS2_CLK_PIN, data_pin=PS2_DATA_PIN,
+                             buffer=EVENT_RING_SIZE)
+        # Reader: polls the PIO FIFO every millisecond (core 1: every
+        # CORE1_POLL_US)
+        sup.add("ps2", (lambda: core1_task(ps2_kb)) if DUAL_CORE else ps2_kb.read_loop,
+                lambda: idle() or time.ticks_diff(time.ticks_ms(), ps2_kb.last_poll) < 50)
+        if ZERO_ALLOC: asyncio.create_task(gc_task())
+        open_log()
+
         usb_kb = PS2ToUSB()
-        usb.device.get().init(usb_kb, builtin_driver=True)
-    
+        interfaces = [usb_kb]
+        if MEDIA_KEYS:
+            from media import MediaInterface
+            usb_kb.media = MediaInterface(USB_INTERVAL_MS)
+            interfaces.append(usb_kb.media)
+        telemetry = None
+        if TELEMETRY:
+            from telemetry import TelemetryInterface, lag_monitor
+            telemetry = TelemetryInterface()
+            interfaces.append(telemetry)
+        usb_kb.typist = load_typist(usb_kb, KEY_LUT + list(COMBOS.values()))
+        if REMAP:
+            import remap
+            try:
+                pushed = remap.load(REMAP_PATH)
+                if pushed:
+                    usb_kb.set_keymap(*pushed)
+                    log(f"Keymap loaded from {REMAP_PATH}")
+            except Exception as e:
+                log(f"Keymap Error: {e}, using keymap.py", error=True)
+            remapper = remap.RemapInterface(lambda *pushed: apply_keymap(usb_kb, *pushed),
+                                            REMAP_PATH, log)
+            interfaces.append(remapper)
+            asyncio.create_task(remapper.run())
+        usb.device.get().init(*interfaces, builtin_driver=True,
+                              remote_wakeup=POWER_SAVE and USB_REMOTE_WAKEUP)
+
+        def on_restart():
+            # Whatever a dead task was holding must not stay down on the host
+            COUNTERS[T_RESTARTS] += 1
+            usb_kb.release_all()
+        sup.on_restart = on_restart
+        if usb_kb.combos or REMAP:
+            sup.add("combo", lambda: combo_task(usb_kb), critical=False)
+
+        if POWER_SAVE:
+            from power import Governor
+            GOVERNOR = Governor(ps2_kb, lambda: STATUS.state != "READY" or
+                                time.ticks_diff(time.ticks_ms(), STATUS.last_act) < IDLE_MS,
+                                IDLE_FREQ, USB_REMOTE_WAKEUP, log)
+            ps2_kb.governor = GOVERNOR
+            sup.add("power", GOVERNOR.run, critical=False)
+            log(f"Idle governor: {IDLE_FREQ // 1_000_000} MHz after {IDLE_MS} ms")
+        if telemetry:
+            telemetry.kb = ps2_kb
+            asyncio.create_task(lag_monitor(governor=GOVERNOR))
+        if LATENCY_PROBE:
+            KEY_LUT[PROBE_KEY[0] | (PROBE_KEY[1] << 8)] = K(USB.F24)
+            usb_kb.probe_kb = ps2_kb
+            log("Latency probe enabled (Scroll Lock LED -> F24 tap)")
+        if TRACE_CAPTURE:
+            from ps2_trace import TraceRecorder
+            ps2_kb.recorder = TraceRecorder(TRACE_PATH)
+            asyncio.create_task(ps2_kb.recorder.run(
+                idle=lambda: time.ticks_diff(time.ticks_ms(), STATUS.last_act) > GC_IDLE_MS))
+            log(f"Capturing PS/2 trace to {TRACE_PATH}")
+        if DISPLAY:
+            from machine import I2C
+            from display import SSD1306, StatusDisplay
+            i2c = I2C(DISPLAY_I2C, sda=Pin(DISPLAY_SDA_PIN), scl=Pin(DISPLAY_SCL_PIN),
+                      freq=DISPLAY_I2C_FREQ)
+            status = StatusDisplay(SSD1306(i2c), DISPLAY_PERIOD_MS)
+            asyncio.create_task(status.run(
+                busy=lambda: time.ticks_diff(time.ticks_ms(), STATUS.last_act) < DISPLAY_BUSY_MS))
+            asyncio.create_task(display_task(status, ps2_kb, usb_kb))
+            log("Status display enabled")
+        if ENCODER:
+            from encoder import Encoder
+            enc = Encoder(ENCODER_A_PIN, ENCODER_B_PIN, ENCODER_SM)
+            if GOVERNOR: GOVERNOR.add_pin(enc.a)
+            asyncio.create_task(encoder_task(enc, usb_kb))
+            log(f"EC11 encoder on A={ENCODER_A_PIN}, B={ENCODER_B_PIN}")
+
         log("Waiting for USB enumeration...")
-        while not usb_kb.is_open():
-            await asyncio.sleep(1)
-            # log(".", end="") # Don't spam log file
-        log("\nUSB Keyboard Ready")
-        STATUS.set_state("READY")
-        
-        def ps2_callback(scancode, pressed, extended):
-            # print(f"PS2: {hex(scancode)} {pressed}")
-            key_tuple = (scancode, extended)
-            
-            # Debug Windows Keys specifically
-            if scancode in [0x1F, 0x27]:
-                log(f"WIN KEY: {hex(scancode)} Ext:{extended} Pressed:{pressed}", error=True)
-
-            action = KEY_MAP.get(key_tuple)
-            if action:
-                try:
-                    usb_kb.update_key(action, pressed)
-                except Exception as e:
-                    log(f"Update Key Error: {e}", error=True)
-                    STATUS.set_state("USB_ERR")
-            else:
-                log(f"Unknown: {hex(scancode)} Ext:{extended}", error=True)
-                STATUS.trigger_error("PS2_ERR")
+        await boot(ps2_kb, usb_kb)
+        # Pump: keeps the event ring drained from now on
+        sup.add("pump", lambda: event_pump(ps2_kb, usb_kb), lambda: pump_alive(ps2_kb, usb_kb))
 
-        log("Initializing PS/2...")
-        ps2_kb = PS2Keyboard(clk_pin=PS2_CLK_PIN, data_pin=PS2_DATA_PIN, callback=ps2_callback)
-        ps2_task = asyncio.create_task(ps2_kb.read_loop())
-        
         log("Main loop running")
-        while True:
-            if ps2_task.done():
-                log("PS/2 Loop Died! Restarting...", error=True)
-                try:
-                    exc = ps2_task.exception()
-                    if exc: log(f"PS/2 Crash: {exc}", error=True)
-                except: pass
-                ps2_task = asyncio.create_task(ps2_kb.read_loop())
-            await asyncio.sleep(1)
-            
+        await sup_task
+
     except Exception as e:
         log(f"Main Error: {e}", error=True)
         STATUS.set_state("USB_ERR")
@@ -213,16 +686,18 @@ async def main():
         raise e
 
 if __name__ == "__main__":
-    log("Waiting 1 second before starting USB... Press Ctrl+C to stop.")
-    time.sleep(1)
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
         log("Stopped by user")
+        if LOG: LOG.flush()
     except Exception as e:
         log(f"CRITICAL ERROR: {e}", error=True)
         import sys
         sys.print_exception(e)
+        if LOG:
+            try: LOG.flush()
+            except: pass
         # Blink error code
         led = Pin(Pin.board.LED, Pin.OUT) if hasattr(Pin, 'board') else Pin(25, Pin.OUT)
         while True:
@@ -0,0 +1,117 @@
+# media.py - Consumer Control (media keys) and System Control HID interface
+#
+# A second HID interface next to the keyboard, with two reports:
+#   ID 1: Consumer Control, one 16-bit usage (volume, playback, browser keys)
+#   ID 2: System Control, one 8-bit usage (power, sleep, wake)
+# One usage per report is enough for keys that are pressed one at a time.
+# A report only goes out when its usage changes, from preallocated buffers.
+# consumer/system are what the host has: a report that couldn't be sent
+# (interface closed, endpoint busy) is sent again by flush(), which the
+# next media key, release_all and PS2ToUSB.flush_keys call.
+
+from usb.device.hid import HIDInterface
+from usb_constants import PAGE_CONSUMER, PAGE_DESKTOP
+from usb_interval import set_interval
+
+_REPORT_CONSUMER = 1
+_REPORT_SYSTEM = 2
+
+# fmt: off
+_MEDIA_REPORT_DESC = (
+    b'\x05\x0C'         # Usage Page (Consumer),
+    b'\x09\x01'         # Usage (Consumer Control),
+    b'\xA1\x01'         # Collection (Application),
+        b'\x85\x01'         # Report ID (1),
+        b'\x15\x00'         # Logical Minimum (0),
+        b'\x26\xFF\x03'     # Logical Maximum (1023),
+        b'\x19\x00'         # Usage Minimum (0),
+        b'\x2A\xFF\x03'     # Usage Maximum (1023),
+        b'\x75\x10'         # Report Size (16),
+        b'\x95\x01'         # Report Count (1),
+        b'\x81\x00'         # Input (Data, Array, Absolute),
+    b'\xC0'             # End Collection,
+    b'\x05\x01'         # Usage Page (Generic Desktop),
+    b'\x09\x80'         # Usage (System Control),
+    b'\xA1\x01'         # Collection (Application),
+        b'\x85\x02'         # Report ID (2),
+        b'\x15\x00'         # Logical Minimum (0),
+        b'\x26\xFF\x00'     # Logical Maximum (255),
+        b'\x19\x00'         # Usage Minimum (0),
+        b'\x29\xFF'         # Usage Maximum (255),
+        b'\x75\x08'         # Report Size (8),
+        b'\x95\x01'         # Report Count (1),
+        b'\x81\x00'         # Input (Data, Array, Absolute),
+    b'\xC0'             # End Collection
+)
+# fmt: on
+
+
+class MediaInterface(HIDInterface):
+    def __init__(self, interval_ms=None):
+        super().__init__(_MEDIA_REPORT_DESC, interface_str="MicroPython Media Keys")
+        self.interval_ms = interval_ms  # None: keep the HIDInterface default
+        self.consumer = 0  # Usage down on the host (last report sent)
+        self.system = 0
+        self._consumer = 0  # Usage wanted, differs while a report is unsent
+        self._system = 0
+        # Ping/pong report buffers, as in KeyboardInterface
+        self._consumer_reports = [bytearray((_REPORT_CONSUMER, 0, 0)),
+                                  bytearray((_REPORT_CONSUMER, 0, 0))]
+        self._system_reports = [bytearray((_REPORT_SYSTEM, 0)), bytearray((_REPORT_SYSTEM, 0))]
+
+    def desc_cfg(self, desc, itf_num, ep_num, strs):
+        start = desc.o
+        super().desc_cfg(desc, itf_num, ep_num, strs)
+        if self.interval_ms: set_interval(desc, start, self.interval_ms)
+
+    def update(self, action, pressed):
+        """Press or release a consumer/system action (KeyAction with a page)"""
+        code = action.codes[0]
+        if action.page == PAGE_CONSUMER:
+            self.set_consumer(self._next(self._consumer, code, pressed))
+        elif action.page == PAGE_DESKTOP:
+            self.set_system(self._next(self._system, code, pressed))
+        self.flush()  # The other report, if it is still unsent
+
+    def _next(self, current, code, pressed):
+        if pressed:
+            return code
+        # Releasing a key that a later one already replaced changes nothing
+        return 0 if current == code else current
+
+    def set_consumer(self, usage):
+        self._consumer = usage
+        if usage == self.consumer:
+            return
+        r = self._consumer_reports[0]
+        r[1] = usage & 0xFF
+        r[2] = usage >> 8
+        if self._send(self._consumer_reports):
+            self.consumer = usage
+
+    def set_system(self, usage):
+        self._system = usage
+        if usage == self.system:
+            return
+        self._system_reports[0][1] = usage
+        if self._send(self._system_reports):
+            self.system = usage
+
+    def flush(self):
+        """Send again what a dropped report left different on the host"""
+        if self._consumer != self.consumer:
+            self.set_consumer(self._consumer)
+        if self._system != self.system:
+            self.set_system(self._system)
+
+    def _send(self, reports):
+        # Swap buffers once a report is queued, so the next one can't modify
+        # it mid-send
+        if self.is_open() and self.send_report(reports[0]):
+            reports[0], reports[1] = reports[1], reports[0]
+            return True
+        return False
+
+    def release_all(self):
+        self.set_consumer(0)
+        self.set_system(0)
@@ -0,0 +1,183 @@
+# power.py - Idle governor: lower clock and parked polling while no keys are typed
+#
+# Once busy() turns false (main.py: no key activity for IDLE_MS), or as
+# soon as the host suspends the bus, the governor drops machine.freq to
+# idle_freq and sets idle; the polling tasks (read_loop, combo and encoder
+# polling, the status LED) see the flag and park on the awake event instead
+# of waking up every millisecond. The PIO clock dividers are scaled with the system clock, so
+# ps2_reader keeps its 2 MHz and captures frames the same way throughout.
+#
+# Waking: a falling edge on the PS/2 CLK pin (or any pin given to add_pin)
+# raises a hard IRQ, which only timestamps it and schedules _wake. That
+# restores full speed, typically long before the 11 clock pulses of the
+# first frame are over, and releases the parked tasks. The pin IRQs are
+# only armed while idle: while typing, PS/2 is decoded by PIO alone.
+#
+# USB suspend: the host suspending the bus sends the converter idle at
+# once. With remote_wakeup (announced in the configuration descriptor, see
+# main.USB_REMOTE_WAKEUP) a keypress while suspended signals resume on the
+# bus, so the keyboard wakes the PC.
+#
+# wake_us is edge -> full speed, frame_us edge -> first frame decoded,
+# late counts wakes where a frame was complete before full speed was back.
+# idle_ms and wakes give the residency (also in telemetry).
+
+import machine
+from machine import Pin, mem32
+import micropython
+import time
+import uasyncio as asyncio
+from ps2_pio import STAT_FRAMES, FRAME_TIMEOUT_US
+from telemetry import COUNTERS, T_IDLE_MS, T_WAKES, T_WAKE_US, T_WAKE_FRAME_US
+
+# RP2040 registers
+_PIO_BASE = (0x50200000, 0x50300000)
+_SM0_CLKDIV = 0x0C8
+_SM_STRIDE = 0x18
+_USBCTRL_REGS = 0x50110000
+_SIE_CTRL = 0x4C
+_SIE_STATUS = 0x50
+_REG_SET = 0x2000          # Atomic bit set alias
+_SIE_RESUME = 1 << 12      # SIE_CTRL: device initiated resume (remote wakeup)
+_SIE_SUSPENDED = 1 << 4    # SIE_STATUS: bus suspended by the host
+
+# A frame that began just before the IRQ was armed is complete after this
+_FRAME_MS = FRAME_TIMEOUT_US // 1000 + 1
+
+
+def scale_pio_clocks(old_hz, new_hz):
+    """Keep every PIO state machine at its frequency across a clock change"""
+    for base in _PIO_BASE:
+        for sm in range(4):
+            a = base + _SM0_CLKDIV + sm * _SM_STRIDE
+            div = mem32[a] >> 8 & 0xFFFFFF   # 16.8 fixed point
+            if div < 0x100:
+                div += 0x1000000             # INT 0 means 65536
+            # Rounded, so going idle and back gives the same register value
+            div = (div * new_hz + old_hz // 2) // old_hz
+            div = min(max(div, 0x100), 0x1000000)
+            mem32[a] = (div & 0xFFFFFF) << 8  # 65536 goes back to INT 0
+
+
+def set_freq(hz):
+    """machine.freq(hz) with the PIO dividers following, never overclocking PIO"""
+    old = machine.freq()
+    if hz == old:
+        return
+    if hz > old:
+        scale_pio_clocks(old, hz)
+        machine.freq(hz)
+    else:
+        machine.freq(hz)
+        scale_pio_clocks(old, hz)
+
+
+class Governor:
+    """
+    busy() is True while the converter must stay at full speed (keys
+    active recently, state not READY). Run run() as a task.
+    """
+
+    def __init__(self, kb, busy, idle_freq=48_000_000, remote_wakeup=False, log=print):
+        self.kb = kb
+        self.busy = busy
+        self.idle_freq = idle_freq
+        self.full_freq = machine.freq()
+        self.remote_wakeup = remote_wakeup
+        self.log = log
+        self.pins = [kb.clk]
+        self.idle = False
+        self.awake = asyncio.Event()
+        self.awake.set()
+        self._flag = asyncio.ThreadSafeFlag()
+        self._pending = False
+        self._edge_us = 0
+        self._frames = 0
+        self._wake_cb = self._wake     # Bound once: schedule() from a hard IRQ can't allocate
+        self.wake_us = 0
+        self.frame_us = 0
+        self.late = 0
+        self.remote_wakes = 0
+
+    def add_pin(self, pin):
+        """Also wake on falling edges of pin (e.g. the encoder's A)"""
+        self.pins.append(pin)
+
+    def _arm(self, handler):
+        for p in self.pins:
+            p.irq(handler, Pin.IRQ_FALLING, hard=True)
+
+    def suspended(self):
+        return bool(mem32[_USBCTRL_REGS + _SIE_STATUS] & _SIE_SUSPENDED)
+
+    async def park(self):
+        """Wait while idle; polling tasks call this when they see idle"""
+        while self.idle:
+            await self.awake.wait()
+
+    def _on_edge(self, pin):
+        # Hard IRQ: timestamp only, the clock change runs scheduled
+        if self.idle and not self._pending:
+            self._pending = True
+            self._edge_us = time.ticks_us()
+            micropython.schedule(self._wake_cb, 0)
+
+    def _wake(self, _):
+        self._pending = False
+        if not self.idle:
+            return
+        self._frames = self.kb.stats[STAT_FRAMES]
+        if self.kb.sm.rx_fifo():
+            self.late += 1
+        set_freq(self.full_freq)
+        self.idle = False
+        self.wake_us = time.ticks_diff(time.ticks_us(), self._edge_us)
+        if self.remote_wakeup and self.suspended():
+            mem32[_USBCTRL_REGS + _SIE_CTRL + _REG_SET] = _SIE_RESUME
+            self.remote_wakes += 1
+        self._flag.set()
+
+    async def _sleep(self):
+        t = time.ticks_ms()
+        self.idle = True
+        self.awake.clear()
+        set_freq(self.idle_freq)
+        self._arm(self._on_edge)
+        # Edges before the IRQ was armed went unseen, but their frame shows
+        # up in the FIFO (read_loop is parked and leaves it there; core 1
+        # moves it on into the ring)
+        kb = self.kb
+        await asyncio.sleep_ms(_FRAME_MS)
+        if self.idle and (kb.sm.rx_fifo() or kb.ring.pending() or not kb.clk.value()):
+            self._edge_us = time.ticks_us()
+            self._wake(0)
+        await self._flag.wait()
+        self._arm(None)
+        self.awake.set()
+        COUNTERS[T_IDLE_MS] += time.ticks_diff(time.ticks_ms(), t)
+        COUNTERS[T_WAKES] += 1
+        COUNTERS[T_WAKE_US] = self.wake_us
+        # Edge -> first frame decoded by read_loop
+        stats = self.kb.stats
+        for _ in range(4 * _FRAME_MS):
+            if stats[STAT_FRAMES] != self._frames:
+                self.frame_us = time.ticks_diff(time.ticks_us(), self._edge_us)
+                COUNTERS[T_WAKE_FRAME_US] = self.frame_us
+                break
+            await asyncio.sleep_ms(1)
+
+    async def run(self, period_ms=100):
+        kb = self.kb
+        while True:
+            await asyncio.sleep_ms(period_ms)
+            if not self.suspended() and (self.busy() or kb.ring.pending() or not kb.clk.value()):
+                continue
+            try:
+                await self._sleep()
+            except Exception as e:
+                # Never leave the converter parked or slow
+                self.log(f"Governor Error: {e}", error=True)
+                self._arm(None)
+                self._edge_us = time.ticks_us()
+                self._wake(0)
+                self.awake.set()
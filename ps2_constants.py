@@ -122,3 +122,28 @@ class PS2:
 
     # ISO
     ISO_SLASH = (0x61, False)
+
+    # Multimedia (Extended)
+    MEDIA_NEXT = (0x4D, True)
+    MEDIA_PREV = (0x15, True)
+    MEDIA_STOP = (0x3B, True)
+    MEDIA_PLAY = (0x34, True)
+    MUTE = (0x23, True)
+    VOL_UP = (0x32, True)
+    VOL_DOWN = (0x21, True)
+    MEDIA_SELECT = (0x50, True)
+    MAIL = (0x48, True)
+    CALC = (0x2B, True)
+    MY_COMPUTER = (0x40, True)
+    WWW_SEARCH = (0x10, True)
+    WWW_HOME = (0x3A, True)
+    WWW_BACK = (0x38, True)
+    WWW_FORWARD = (0x30, True)
+    WWW_STOP = (0x28, True)
+    WWW_REFRESH = (0x20, True)
+    WWW_FAVORITES = (0x18, True)
+
+    # ACPI (Extended)
+    POWER = (0x37, True)
+    SLEEP = (0x3F, True)
+    WAKE = (0x5E, True)
@@ -1,24 +1,100 @@
 # ps2_pio.py - PS/2 Keyboard decoder using PIO on Raspberry Pi Pico (MicroPython)
 
-from machine import Pin
+from machine import Pin, mem32
+from array import array
 import rp2
+import time
 import uasyncio as asyncio
+from ring import EventRing
 
 # PS/2 protocol basics:
 # - Clock: device-driven, 10-16 kHz
 # - Data valid on falling clock edges
 # - Frame: 1 start bit (0), 8 data bits (LSB first), 1 parity bit (odd), 1 stop bit (1)
 
+# DATA bit positions in a frame word after the 10-bit FIFO shift (see _decode_frame)
+_START_BIT = 1 << 1
+_STOP_BIT = 1 << 21
+
+# 1 if the byte has an odd number of set bits (precomputed: bin().count() allocates)
+_ODD_PARITY = bytes(bin(i).count('1') & 1 for i in range(256))
+
+# Bits 0, 2, 4, 6 of the index packed into a nibble
+_UNSPREAD = bytes((i & 1) | (i >> 1 & 2) | (i >> 2 & 4) | (i >> 3 & 8) for i in range(128))
+
+# A frame whose clock stops mid-way (glitch, hot-plug, missed edge) is
+# abandoned after this long and reported as a timeout word. ps2_reader
+# builds the budget itself (2^11 - 1 polling loops of 2 cycles, see there):
+# the RX join leaves it no TX FIFO to load one from.
+FRAME_TIMEOUT_US = 2047
+PIO_FREQ = 2_000_000
+
+# ps2_reader pushes an all-ones word on timeout. Real frames can never look
+# like this: CLK (the low bit of every pair) is always 0 when sampled.
+_TIMEOUT_WORD = (1 << 22) - 1
+
+# Line statistics, indices into PS2Keyboard.stats
+STAT_FRAMES = 0      # Frames decoded successfully
+STAT_START_ERR = 1   # Start bit was 1
+STAT_STOP_ERR = 2    # Stop bit was 0
+STAT_PARITY_ERR = 3  # Odd parity check failed
+STAT_TIMEOUT = 4     # Frame abandoned by the PIO timeout
+STAT_RESYNC = 5      # State machine restarted after consecutive bad frames
+STAT_OVERRUN = 6     # RX FIFO was full when a frame completed (bits lost)
+STAT_NAMES = ("frames", "start_err", "stop_err", "parity_err", "timeout", "resync", "overrun")
+
+# Packed key events (see PS2Keyboard.events): scancode in bits 7:0, flags,
+# and the low 20 bits of ticks_ms when the event was decoded in bits 29:10,
+# so an event stays a small int (no heap) on MicroPython
+EV_EXTENDED = 0x100
+EV_PRESSED = 0x200
+EV_TIME_SHIFT = 10
+EV_TIME_MASK = 0xFFFFF  # Wraps every ~17 minutes
+
+def ev_age_ms(ev):
+    """Milliseconds since a packed event was decoded"""
+    return (time.ticks_ms() - (ev >> EV_TIME_SHIFT)) & EV_TIME_MASK
+
+# Basic assurance test result, sent by the keyboard after power-up or a
+# reset (about 500-750 ms). Neither is a Set 2 scancode.
+BAT_OK = 0xAA
+BAT_FAIL = 0xFC
+
+# Core 1 FIFO polling period (a frame takes ~1 ms, the FIFO holds 8)
+CORE1_POLL_US = 200
+
+# PIO FDEBUG register (RXSTALL in bits 3:0, write 1 to clear)
+_PIO_BASE = (0x50200000, 0x50300000)
+_FDEBUG = 0x008
+
+def encode_frame(byte, parity_error=False):
+    """Inverse of PS2Keyboard._decode_frame (replay and benchmarks)"""
+    parity = _ODD_PARITY[byte] ^ 1 ^ parity_error
+    frame = _STOP_BIT | (parity << 19)
+    for i in range(8):
+        frame |= ((byte >> i) & 1) << (2 * i + 3)
+    return frame
+
 @rp2.asm_pio(
     in_shiftdir=rp2.PIO.SHIFT_RIGHT,  # LSB first
+    out_shiftdir=rp2.PIO.SHIFT_RIGHT, # Budget setup below
     autopush=True,
     push_thresh=22,                   # Push after 22 bits (11 × 2 pins)
+    fifo_join=rp2.PIO.JOIN_RX,        # 8 deep RX FIFO
 )
 def ps2_reader():
     # PIO program to read PS/2 keyboard data
     # in_base (pin 0): CLK
     # in_base+1 (pin 1): DATA
+    # jmp_pin: CLK
+    # Frame timeout budget (polling loop iterations), built once in OSR:
+    # all ones shifted right by 21 leaves 2^11 - 1 (FRAME_TIMEOUT_US at
+    # PIO_FREQ). There is no TX FIFO to pull it from with JOIN_RX.
+    mov(osr, invert(null))
+    out(null, 21)
+
     wrap_target()
+    label("frame")
     
     # Wait for idle state (CLK=1, DATA=1) to ensure clean frame start
     wait(1, pin, 0)           # Wait for CLK high
@@ -30,21 +106,63 @@ def ps2_reader():
     # Read first bit (start bit)
     in_(pins, 2)
     
-    # Read remaining 10 bits
+    # Read remaining 10 bits, polling CLK so a stalled frame can time out.
+    # Every polling iteration (2 cycles) spends one unit of the Y budget.
+    mov(y, osr)
     set(x, 9)
     
-    label("bitloop")
-    wait(1, pin, 0)           # Wait for CLK high
-    wait(0, pin, 0)           # Wait for CLK low (falling edge)
-    in_(pins, 2)
-    jmp(x_dec, "bitloop")
+    label("wait_high")
+    jmp(pin, "wait_low")      # CLK high -> wait for the falling edge
+    jmp(y_dec, "wait_high")
+    jmp("timeout")
+    label("still_high")
+    jmp(y_dec, "wait_low")
+    jmp("timeout")
+    label("wait_low")
+    jmp(pin, "still_high")    # CLK still high
+    in_(pins, 2)              # CLK low (falling edge): sample
+    jmp(x_dec, "wait_high")
     
     # After 11 reads × 2 bits = 22 bits, autopush triggers
     wrap()
 
+    # Drop the partial frame and push the timeout marker instead
+    label("timeout")
+    mov(isr, invert(null))
+    push(noblock)
+    jmp("frame")
+
+
+class EventStream:
+    """
+    Consumer side of PS2Keyboard.events(). `async for ev in stream` yields
+    one packed event at a time, `n = await stream.batch(buf)` waits for at
+    least one and then moves every pending event into buf.
+    """
+
+    def __init__(self, kb):
+        self.kb = kb
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            ev = self.kb.ring.pop()
+            if ev >= 0:
+                return ev
+            await self.kb.flag.wait()
+
+    async def batch(self, buf):
+        while True:
+            n = self.kb.read_events(buf)
+            if n:
+                return n
+            await self.kb.flag.wait()
+
 
 class PS2Keyboard:
-    def __init__(self, clk_pin: int, data_pin: int, callback=None):
+    def __init__(self, clk_pin: int, data_pin: int, sm_id=0, resync_after=3, buffer=64):
         print(f"Initializing PS2 keyboard with CLK={clk_pin}, DATA={data_pin}")
         self.clk = Pin(clk_pin, Pin.IN, Pin.PULL_UP)
         self.data = Pin(data_pin, Pin.IN, Pin.PULL_UP)
@@ -65,77 +183,124 @@ class PS2Keyboard:
             print(f"ERROR: DATA pin must be CLK + 1. You have CLK={clk_pin}, DATA={data_pin}")
             raise ValueError("Invalid pin configuration")
         
-        self.sm = rp2.StateMachine(
-            0,
-            ps2_reader,
-            freq=2_000_000,
-            in_base=self.clk,     # Base is CLK, so pin 0=CLK, pin 1=DATA
-        )
-        
-        self.sm.active(1)
+        self.sm_id = sm_id
+        self.sm = rp2.StateMachine(sm_id)
+        self._start_sm()
+
+        # Line statistics (see STAT_*), preallocated so counting never allocates
+        self.stats = array('I', [0] * len(STAT_NAMES))
+        self.bad_frames = 0  # Consecutive bad frames
+        self.resync_after = resync_after
+        self._fdebug = _PIO_BASE[sm_id >> 2] + _FDEBUG
+        self._rxstall = 1 << (sm_id & 3)
         
         # Parser states
         self.extended = False
         self.break_code = False
         self.pause_state = 0  # 0=Idle, 1=E1 seen, etc.
 
-        # Callback: callback(scancode, pressed, extended)
-        self.callback = callback
-        
-        self.queue = []
+        # Latest self-test result (BAT_OK/BAT_FAIL, 0: none yet) and its
+        # ticks_ms; bat_flag is set when one arrives (possibly on core 1)
+        self.bat = 0
+        self.bat_ms = 0
+        self.bat_flag = asyncio.ThreadSafeFlag()
+
+        # Decoded events wait here for the consumer (events()), packed into
+        # ints in a preallocated ring. The flag wakes the consumer, once per
+        # poll() rather than per event, and may be set from core 1.
+        self.ring = EventRing(buffer)
+        self.flag = asyncio.ThreadSafeFlag()
+        # inject() while core 1 decodes: core 1 moves these into ring, so
+        # it stays the ring's only producer
+        self.injected = EventRing(4)
+        self._stream = EventStream(self)
+
+        # Raw frame capture (ps2_trace.TraceRecorder)
+        self.recorder = None
+
+        # power.Governor: read_loop parks while it is idle
+        self.governor = None
+
+        # Dual-core mode (start_core1)
+        self.core1_run = False
+        self.core1_alive = False
+        self.last_poll = time.ticks_ms()
+
+    def _start_sm(self):
+        # (Re)initialising puts the program back at its first instruction
+        # with empty shift registers and FIFOs; the program rebuilds its
+        # frame timeout budget from there
+        self.sm.init(
+            ps2_reader,
+            freq=PIO_FREQ,
+            in_base=self.clk,     # Base is CLK, so pin 0=CLK, pin 1=DATA
+            jmp_pin=self.clk,
+        )
+        self.sm.active(1)
+
+    def resync(self):
+        """Restart frame capture after losing bit alignment"""
+        self.sm.active(0)
+        self._start_sm()
+        self.extended = False
+        self.break_code = False
+        self.pause_state = 0
+        self.bad_frames = 0
+        self.stats[STAT_RESYNC] += 1
 
     def _decode_frame(self, frame: int):
-        # PIO reads 2 pins × 11 times = 22 bits total
-        # With SHIFT_RIGHT, bits shift right into ISR.
-        # The first bit read (Start) is shifted to the right-most position (LSB)
-        # of the valid data.
-        # 22 bits valid. They are at bits 31:10 of the 32-bit word.
-        # Bit 10 is the first bit read (Start).
-        # Bit 31 is the last bit read (Stop).
-        
-        bits = []
-        for i in range(11):
-            # Extract from LSB (Start) to MSB (Stop)
-            # Start is at bit 10. Next is 12, etc.
-            shift = 10 + (i * 2)
-            pair = (frame >> shift) & 0b11
-            
-            # Pin 0 is CLK, Pin 1 is DATA. We want DATA (bit 1 of pair).
-            data_bit = (pair >> 1) & 1
-            bits.append(data_bit)
-            
-        # Now bits[0] is Start, bits[1..8] is Data, bits[9] is Parity, bits[10] is Stop
-        start = bits[0]
-        stop = bits[10]
-        
-        if start != 0 or stop != 1:
-            # print(f"Frame error: start={start}, stop={stop}")
+        # PIO reads 2 pins × 11 times = 22 bits total, autopushed into bits
+        # 31:10 of the FIFO word. read_loop fetches it with sm.get(None, 10),
+        # so the frame arrives pre-shifted as a 22-bit small int (a full
+        # 32-bit word would be a heap-allocated long on MicroPython).
+        # Pair i (i=0 Start ... i=10 Stop) sits at bits 2i+1:2i,
+        # pin 0 (CLK) in the low bit and pin 1 (DATA) in the high bit.
+        # Bits are tested in place so decoding never allocates.
+        if frame == _TIMEOUT_WORD:
+            self.stats[STAT_TIMEOUT] += 1
             return None
-            
-        data_byte = 0
-        for i in range(8):
-            data_byte |= (bits[i+1] << i)
-            
-        parity = bits[9]
-        
+        if frame & _START_BIT:
+            self.stats[STAT_START_ERR] += 1
+            return None
+        if not frame & _STOP_BIT:
+            self.stats[STAT_STOP_ERR] += 1
+            return None
+
+        # Data bits D0..D7 sit on every other bit from bit 3: gather them
+        # a nibble at a time through a table instead of bit by bit
+        data_byte = _UNSPREAD[(frame >> 3) & 0x7F] | (_UNSPREAD[(frame >> 11) & 0x7F] << 4)
+
         # Odd parity check
-        ones = bin(data_byte).count('1')
-        if (ones + parity) % 2 != 1:
-            # print(f"Parity error")
+        if _ODD_PARITY[data_byte] == (frame >> 19) & 1:
+            self.stats[STAT_PARITY_ERR] += 1
             return None
-            
+
         return data_byte
 
     def _process_scancode(self, sc):
         """
         Handle PS/2 make/break and extended sequences.
-        Calls user callback when a full event is decoded.
+        Emits an event when a full key press/release is decoded.
         """
-        # Handle Pause/Break (E1 sequence)
-        # Sequence: E1 14 77 E1 F0 14 F0 77
-        if sc == 0xE1:
-            self.pause_state = 1
-            return
+        if sc >= BAT_OK:
+            # Key codes stop at 0x83: one compare for them, the rest are
+            # prefixes and self-test results
+            if sc == BAT_OK or sc == BAT_FAIL:
+                # Self-test result: the keyboard was (re)powered, anything
+                # half-parsed before it is stale
+                self.bat = sc
+                self.bat_ms = time.ticks_ms()
+                self.extended = False
+                self.break_code = False
+                self.pause_state = 0
+                self.bat_flag.set()
+                return
+
+            # Handle Pause/Break (E1 sequence)
+            # Sequence: E1 14 77 E1 F0 14 F0 77
+            if sc == 0xE1:
+                self.pause_state = 1
+                return
             
         if self.pause_state > 0:
             # Processing E1 sequence
@@ -146,7 +311,7 @@ class PS2Keyboard:
             elif self.pause_state == 2:
                 if sc == 0x77:
                     # First 77 -> Trigger Press
-                    if self.callback: self.callback(0x77, True, True)
+                    self._emit(0x77 | EV_EXTENDED | EV_PRESSED)
                     self.pause_state = 0
                 else: self.pause_state = 0
             elif self.pause_state == 3:
@@ -158,7 +323,7 @@ class PS2Keyboard:
             elif self.pause_state == 5:
                 if sc == 0x77:
                     # Second 77 -> Trigger Release
-                    if self.callback: self.callback(0x77, False, True)
+                    self._emit(0x77 | EV_EXTENDED)
                 self.pause_state = 0
             return
 
@@ -171,45 +336,137 @@ class PS2Keyboard:
             return
         
         # We have a complete scancode
-        pressed = not self.break_code
         extended = self.extended
+        ev = sc if self.break_code else sc | EV_PRESSED
         
         # Special handling for Print Screen
         # Make: E0 12 E0 7C
         # Break: E0 F0 7C E0 F0 12
         # We can just treat E0 12 as a fake shift (ignored) and E0 7C as the actual key
-        if extended and sc == 0x12:
-            # This is part of PrintScreen make/break, ignore it
-            self.extended = False
-            self.break_code = False
-            return
-            
-        if extended and sc == 0x7C:
-            # This is the actual PrintScreen code
-            pass
+        if extended:
+            if sc == 0x12:
+                # This is part of PrintScreen make/break, ignore it
+                self.extended = False
+                self.break_code = False
+                return
+            ev |= EV_EXTENDED
 
         # Reset state for next scancode
         self.break_code = False
         self.extended = False
         
-        # Call the user's callback
-        if self.callback:
-            self.callback(sc, pressed, extended)
-        
-        # Also queue it for polling
-        self.queue.append((sc, pressed, extended))
+        self._emit(ev)
+
+    def _emit(self, ev):
+        # Stamp and queue only: the consumer is woken by whoever fed the
+        # parser (poll, inject)
+        self.ring.push(ev | (time.ticks_ms() & EV_TIME_MASK) << EV_TIME_SHIFT)
+
+    def inject(self, ev):
+        """
+        Queue a key event (scancode | EV_* flags) as if it had been decoded.
+        With start_core1 it is handed to core 1, which emits it on its next
+        poll.
+        """
+        if self.core1_run:
+            self.injected.push(ev)
+        else:
+            self._emit(ev)
+            self.flag.set()
+
+    def poll(self):
+        """
+        Drain the PIO FIFO and process every pending frame. A frame yields
+        at most one event, so while the event ring is full frames are left
+        in the FIFO: a consumer that falls behind backs up into the PIO
+        (and shows as overruns) instead of silently losing decoded keys.
+        """
+        self.last_poll = time.ticks_ms()  # Liveness for the supervisor
+        if mem32[self._fdebug] & self._rxstall:
+            # FIFO was full and the state machine stalled: frames were lost
+            mem32[self._fdebug] = self._rxstall
+            self.stats[STAT_OVERRUN] += 1
+        # Room is counted once: the consumer can only add to it meanwhile
+        room = free = self.ring.size - self.ring.pending()
+        injected = self.injected
+        while room and injected.pending():
+            self._emit(injected.pop())
+            room -= 1
+        sm = self.sm
+        while room and sm.rx_fifo():  # Checked every frame: resync() empties it
+            self.handle_frame(sm.get(None, 10))
+            room -= 1
+        if room != free:
+            self.flag.set()  # One wakeup for the whole batch
+
+    def handle_frame(self, frame):
+        """Process one frame word as fetched from the FIFO (or a trace)"""
+        if self.recorder is not None:
+            self.recorder.record(frame)
+        sc = self._decode_frame(frame)
+        if sc is None:
+            self.bad_frames += 1
+            if self.bad_frames >= self.resync_after:
+                self.resync()
+            return
+        self.bad_frames = 0
+        self.stats[STAT_FRAMES] += 1
+        self._process_scancode(sc)
+
+    def _core1_loop(self):
+        self.core1_alive = True
+        try:
+            while self.core1_run:
+                self.poll()
+                if self.governor is not None and self.governor.idle:
+                    time.sleep_ms(1)  # Frames wait in the FIFO until the wake
+                else:
+                    time.sleep_us(CORE1_POLL_US)
+        finally:
+            self.core1_alive = False
+
+    def start_core1(self):
+        """
+        Drain, decode and parse on core 1 instead of read_loop. Events reach
+        events() on core 0 the same way: the ring is single-producer/
+        single-consumer and the flag is safe to set from another thread.
+        """
+        import _thread
+        self.core1_run = True
+        _thread.start_new_thread(self._core1_loop, ())
+
+    def stop_core1(self):
+        self.core1_run = False
 
     async def read_loop(self):
         """Async loop that reads from PIO FIFO and processes scancodes"""
         print("PS/2 read_loop started")
         while True:
-            if self.sm.rx_fifo():
-                raw = self.sm.get()
-                sc = self._decode_frame(raw)
-                if sc is not None:
-                    self._process_scancode(sc)
+            if self.governor is not None and self.governor.idle:
+                await self.governor.park()  # Woken by a CLK edge
+            self.poll()
             await asyncio.sleep_ms(1)
-    
-    def get_event(self):
-        """Poll for events (alternative to callback)"""
-        return self.queue.pop(0) if self.queue else None
+
+    def events(self):
+        """
+        The decoded key events as packed ints (EV_*, ev_age_ms):
+
+            async for ev in kb.events():
+                scancode, pressed = ev & 0xFF, ev & EV_PRESSED
+
+        Needs read_loop (or start_core1) running to produce them. There is
+        one stream per keyboard, for a single consumer.
+        """
+        return self._stream
+
+    def read_events(self, buf):
+        """Move up to len(buf) pending events into buf without waiting, returns the count"""
+        ring = self.ring
+        n = 0
+        while n < len(buf):
+            ev = ring.pop()
+            if ev < 0:
+                break
+            buf[n] = ev
+            n += 1
+        return n
@@ -0,0 +1,146 @@
+# ps2_trace.py - Raw PS/2 frame capture and deterministic replay
+#
+# Trace file: 8 byte header (b"PS2T", version, 3 reserved bytes), then one
+# 6 byte record per frame: the 22-bit frame word exactly as PS2Keyboard got
+# it from the PIO FIFO (after the 10-bit shift, timeout markers and bad
+# frames included) and the ticks_us since the previous frame, both 24-bit
+# little endian. Gaps of 16.7 s and more are clamped.
+
+from array import array
+import time
+import uasyncio as asyncio
+
+MAGIC = b"PS2T"
+VERSION = 1
+HEADER_LEN = 8
+RECORD_LEN = 6
+MAX_DELTA = 0xFFFFFF
+
+
+class TraceRecorder:
+    """
+    Captures frames into preallocated RAM and writes them out from run(),
+    so record() (called for every frame, possibly on core 1) never touches
+    the filesystem or the heap. Producer/consumer indices work like
+    ring.EventRing.
+    """
+
+    def __init__(self, path, size=256, max_records=50_000):
+        self.frames = array('I', [0] * size)
+        self.deltas = array('I', [0] * size)
+        self.size = size
+        self.wrap = 2 * size - 1
+        self.idx = array('I', [0, 0])  # [head (record), tail (flush)]
+        self.out = bytearray(size * RECORD_LEN)
+        self.last_us = time.ticks_us()
+        self.recorded = 0     # Records accepted
+        self.written = 0      # Records on flash
+        self.dropped = 0      # Buffer full or max_records reached
+        self.max_records = max_records
+        self.f = open(path, "wb")
+        self.f.write(MAGIC + bytes((VERSION, 0, 0, 0)))
+
+    def record(self, frame):
+        now = time.ticks_us()
+        head = self.idx[0]
+        if ((head - self.idx[1]) & self.wrap) == self.size or self.recorded >= self.max_records:
+            self.dropped += 1
+            return
+        delta = time.ticks_diff(now, self.last_us)
+        self.last_us = now
+        i = head % self.size
+        self.frames[i] = frame
+        self.deltas[i] = 0 if delta < 0 else delta if delta < MAX_DELTA else MAX_DELTA
+        self.idx[0] = (head + 1) & self.wrap
+        self.recorded += 1
+
+    def pending(self):
+        return (self.idx[0] - self.idx[1]) & self.wrap
+
+    def flush(self):
+        """Write every pending record to the file"""
+        n = self.pending()
+        if not n:
+            return 0
+        tail = self.idx[1]
+        out = self.out
+        o = 0
+        for k in range(n):
+            i = (tail + k) % self.size
+            frame = self.frames[i]
+            delta = self.deltas[i]
+            out[o] = frame & 0xFF
+            out[o + 1] = (frame >> 8) & 0xFF
+            out[o + 2] = frame >> 16
+            out[o + 3] = delta & 0xFF
+            out[o + 4] = (delta >> 8) & 0xFF
+            out[o + 5] = delta >> 16
+            o += RECORD_LEN
+        self.idx[1] = (tail + n) & self.wrap
+        self.f.write(memoryview(out)[:o])
+        self.f.flush()
+        self.written += n
+        return n
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+    async def run(self, idle=None, period_ms=50):
+        """Flush while idle() says the keyboard is quiet, or when 3/4 full"""
+        while True:
+            await asyncio.sleep_ms(period_ms)
+            n = self.pending()
+            if n and (n * 4 >= self.size * 3 or idle is None or idle()):
+                self.flush()
+
+
+def read_trace(path):
+    """Yield (frame, delta_us) for every record of a trace file"""
+    with open(path, "rb") as f:
+        header = f.read(HEADER_LEN)
+        if header[:4] != MAGIC or header[4] != VERSION:
+            raise ValueError("Not a PS/2 trace file")
+        while True:
+            r = f.read(RECORD_LEN)
+            if len(r) < RECORD_LEN:
+                return
+            yield r[0] | r[1] << 8 | r[2] << 16, r[3] | r[4] << 8 | r[5] << 16
+
+
+def write_trace(path, records):
+    """Write (frame, delta_us) pairs, e.g. synthetic or edited traces"""
+    with open(path, "wb") as f:
+        f.write(MAGIC + bytes((VERSION, 0, 0, 0)))
+        for frame, delta in records:
+            delta = min(delta, MAX_DELTA)
+            f.write(bytes((frame & 0xFF, (frame >> 8) & 0xFF, frame >> 16,
+                           delta & 0xFF, (delta >> 8) & 0xFF, delta >> 16)))
+
+
+def replay(kb, path, speed=1, on_events=None):
+    """
+    Feed a trace through kb.handle_frame. speed=1 keeps the recorded timing,
+    2 is twice as fast, 0 as fast as possible. Replay blocks, so the decoded
+    events are handed to on_events(buf, n) after every frame (e.g.
+    PS2ToUSB.handle_events) instead of piling up for kb.events().
+    Returns (frames, elapsed_us, worst lateness in us).
+    """
+    buf = array('I', [0] * 4)
+    frames = 0
+    late = 0
+    start = time.ticks_us()
+    due = 0  # us after start
+    for frame, delta in read_trace(path):
+        if speed:
+            due += int(delta / speed)
+            wait = due - time.ticks_diff(time.ticks_us(), start)
+            if wait > 0:
+                time.sleep_us(wait)
+            elif -wait > late:
+                late = -wait
+        kb.handle_frame(frame)
+        if on_events is not None:
+            on_events(buf, kb.read_events(buf))
+        frames += 1
+    return frames, time.ticks_diff(time.ticks_us(), start), late
@@ -0,0 +1,284 @@
+# remap.py - Keymaps pushed from the PC over USB, applied without a reset
+#
+# tools/push.py compiles a keymap file (KEY_MAP, COMBOS, COMBO_WINDOW_MS as
+# in keymap.py) into a blob and uploads it through RemapInterface, a vendor
+# HID interface like telemetry.py's: SET_REPORT(Feature) carries the
+# chunks, GET_REPORT(Feature) returns the upload status. Both go over the
+# control endpoint, so an upload never holds up the key reports.
+#
+# Chunk report (REPORT_LEN bytes, zero padded):
+#   0     command: CMD_BEGIN, CMD_DATA, CMD_END or CMD_ABORT
+#   1     0
+#   2-3   sequence number of the chunk (u16, DATA)
+#   4-5   payload length (u16)
+#   6-9   CRC32 of the payload (u32)
+#   10-   payload: BEGIN has the blob length (u32) and CRC32 (u32)
+#
+# A chunk with a bad CRC or out of sequence is dropped and flagged in the
+# status; the tool reads next_seq back and resends from there. END checks
+# the whole blob's CRC and wakes run(), which decodes it and calls apply()
+# from the event loop: between two handle_events calls, never in the middle
+# of one. main.PS2ToUSB.set_keymap does the swap.
+#
+# The last blob applied is saved and load() returns it at startup, so a
+# pushed keymap survives a reset; delete the file to go back to keymap.py.
+#
+# Blob (little endian): header b"KM", FORMAT, 0, window_ms, then the counts
+# of actions, keys and combos (u16 each); actions as page (u8), toggle (u8),
+# n (u16) and n codes (i16), or n bytes of UTF-8 for PAGE_TEXT; keys as LUT
+# index (scancode | extended << 8) and action number (u16 each); combos as
+# n (u8), n LUT indices and the action number.
+
+from binascii import crc32
+import struct
+import time
+import uasyncio as asyncio
+from usb.device.hid import HIDInterface
+from keymap import KeyAction
+from usb_constants import PAGE_TEXT
+
+FORMAT = 1
+VERSION = 1          # Of the status report
+REPORT_LEN = 256
+HEADER_LEN = 10
+CHUNK = REPORT_LEN - HEADER_LEN
+MAX_BLOB = 32768
+
+CMD_BEGIN = ord('B')
+CMD_DATA = ord('D')
+CMD_END = ord('E')
+CMD_ABORT = ord('A')
+
+# Upload states
+IDLE = 0
+RECEIVING = 1
+APPLYING = 2
+APPLIED = 3
+FAILED = 4
+STATE_NAMES = ("idle", "receiving", "applying", "applied", "failed")
+
+# Errors (the latest, cleared by BEGIN)
+E_NONE = 0
+E_CRC = 1        # Chunk CRC mismatch, resend from next_seq
+E_SEQ = 2        # Chunk out of sequence, resend from next_seq
+E_SIZE = 3       # Blob larger than MAX_BLOB, or more data than announced
+E_BLOB_CRC = 4   # Whole blob CRC mismatch at END
+E_FORMAT = 5     # Blob didn't decode
+E_STATE = 6      # DATA/END without BEGIN
+ERROR_NAMES = ("none", "chunk crc", "sequence", "size", "blob crc", "format", "state")
+
+# Status: b'R', VERSION, state, error, next_seq (u16), chunk errors (u16),
+# bytes received (u32), apply_us (u32): END -> keymap swapped
+STATUS_LEN = 16
+_STATUS = "<BBBBHHII"
+
+_HEADER = "<2sBBHHHH"
+_HEADER_SIZE = 12
+
+_STAGE_SETUP = 1
+_REQ_TYPE_CLASS_IN = 0xA1
+_REQ_GET_REPORT = 0x01
+_REPORT_TYPE_FEATURE = 0x03
+
+# fmt: off
+_REMAP_REPORT_DESC = (
+    b'\x06\x00\xFF'     # Usage Page (Vendor Defined 0xFF00),
+    b'\x09\x10'         # Usage (0x10),
+    b'\xA1\x01'         # Collection (Application),
+        b'\x09\x11'         # Usage (0x11),
+        b'\x15\x00'         # Logical Minimum (0),
+        b'\x26\xFF\x00'     # Logical Maximum (255),
+        b'\x75\x08'         # Report Size (8),
+        b'\x96' + struct.pack('<H', REPORT_LEN) +  # Report Count (chunk bytes),
+        b'\xB1\x02'         # Feature (Data, Variable, Absolute),
+    b'\xC0'             # End Collection
+)
+# fmt: on
+
+
+def encode(key_map, combos=None, window_ms=30):
+    """Compile KEY_MAP / COMBOS dicts into a blob (tools/push.py)"""
+    actions = []
+    numbers = {}
+
+    def number(action):
+        if id(action) not in numbers:
+            numbers[id(action)] = len(actions)
+            actions.append(action)
+        return numbers[id(action)]
+
+    combos = combos or {}
+    keys = [((sc | ext << 8), number(a)) for (sc, ext), a in key_map.items() if a is not None]
+    chords = [([sc | ext << 8 for sc, ext in ks], number(a)) for ks, a in combos.items()]
+    out = [struct.pack(_HEADER, b"KM", FORMAT, 0, window_ms, len(actions), len(keys), len(chords))]
+    for a in actions:
+        if a.page == PAGE_TEXT:
+            text = a.codes[0].encode("utf-8")
+            out.append(struct.pack("<BBH", a.page, 0, len(text)) + text)
+        else:
+            out.append(struct.pack("<BBH%dh" % len(a.codes), a.page, a.toggle, len(a.codes), *a.codes))
+    for i, n in keys:
+        out.append(struct.pack("<HH", i, n))
+    for ks, n in chords:
+        out.append(struct.pack("<B%dHH" % len(ks), len(ks), *ks, n))
+    return b"".join(out)
+
+
+def decode(blob):
+    """(lut, combos, window_ms) from a blob, raises if it is malformed"""
+    magic, fmt, _, window_ms, n_actions, n_keys, n_combos = struct.unpack_from(_HEADER, blob, 0)
+    if magic != b"KM" or fmt != FORMAT:
+        raise ValueError("not a keymap blob")
+    o = _HEADER_SIZE
+    actions = []
+    for _ in range(n_actions):
+        page, toggle, n = struct.unpack_from("<BBH", blob, o)
+        o += 4
+        if page == PAGE_TEXT:
+            codes = str(blob[o:o + n], "utf-8")
+            o += n
+        else:
+            codes = list(struct.unpack_from("<%dh" % n, blob, o))
+            o += 2 * n
+        actions.append(KeyAction(codes, bool(toggle), page))
+    lut = [None] * 512
+    for _ in range(n_keys):
+        i, n = struct.unpack_from("<HH", blob, o)
+        o += 4
+        lut[i & 0x1FF] = actions[n]
+    combos = {}
+    for _ in range(n_combos):
+        k = blob[o]
+        ks = struct.unpack_from("<%dHH" % k, blob, o + 1)
+        o += 1 + 2 * k + 2
+        combos[tuple((i & 0xFF, bool(i >> 8)) for i in ks[:k])] = actions[ks[k]]
+    if o != len(blob):
+        raise ValueError("trailing bytes")
+    return lut, combos, window_ms
+
+
+def load(path):
+    """(lut, combos, window_ms) of the blob saved at path, None if there is none"""
+    try:
+        with open(path, "rb") as f:
+            return decode(f.read())
+    except OSError:
+        return None
+
+
+def chunk(cmd, seq=0, payload=b""):
+    """One chunk report (tools/push.py)"""
+    r = bytearray(REPORT_LEN)
+    struct.pack_into("<BBHHI", r, 0, cmd, 0, seq, len(payload), crc32(payload))
+    r[HEADER_LEN:HEADER_LEN + len(payload)] = payload
+    return r
+
+
+class RemapInterface(HIDInterface):
+    """
+    Receives keymap blobs; run() awaits apply(lut, combos, window_ms) for
+    each complete one and then saves the blob to path (see load()).
+    """
+
+    def __init__(self, apply, path=None, log=print):
+        super().__init__(_REMAP_REPORT_DESC, set_report_buf=bytearray(REPORT_LEN),
+                         interface_str="PS/2 Converter Keymap")
+        self.apply = apply
+        self.path = path
+        self.log = log
+        self.state = IDLE
+        self.error = E_NONE
+        self.next_seq = 0
+        self.chunk_errors = 0
+        self.received = 0
+        self.apply_us = 0
+        self._buf = None
+        self._size = 0
+        self._crc = 0
+        self._end_us = 0
+        self._flag = asyncio.ThreadSafeFlag()
+        self.status = bytearray(STATUS_LEN)
+
+    def on_set_report(self, report_data, report_id, report_type):
+        # Runs from the USB stack, between any two bytecodes of the tasks:
+        # only copies into the buffer, run() does the rest
+        if report_type != _REPORT_TYPE_FEATURE or len(report_data) < HEADER_LEN:
+            return
+        cmd, _, seq, n, crc = struct.unpack_from("<BBHHI", report_data, 0)
+        payload = memoryview(report_data)[HEADER_LEN:HEADER_LEN + n]
+        if len(payload) != n or crc32(payload) != crc:
+            self.error = E_CRC
+            self.chunk_errors += 1
+            return
+        if cmd == CMD_BEGIN:
+            size, self._crc = struct.unpack_from("<II", payload, 0)
+            self.error = E_NONE
+            self.next_seq = 0
+            self.received = 0
+            if size > MAX_BLOB:
+                self.error = E_SIZE
+                self.state = FAILED
+                return
+            self._size = size
+            self._buf = bytearray(size)
+            self.state = RECEIVING
+        elif cmd == CMD_ABORT:
+            self._buf = None
+            self.state = IDLE
+        elif self.state != RECEIVING:
+            self.error = E_STATE
+        elif cmd == CMD_DATA:
+            if seq != self.next_seq:
+                self.error = E_SEQ
+                self.chunk_errors += 1
+            elif self.received + n > self._size:
+                self.error = E_SIZE
+                self.state = FAILED
+            else:
+                self._buf[self.received:self.received + n] = payload
+                self.received += n
+                self.next_seq = (seq + 1) & 0xFFFF
+        elif cmd == CMD_END:
+            if self.received != self._size or crc32(self._buf) != self._crc:
+                self.error = E_BLOB_CRC
+                self.state = FAILED
+                return
+            self._end_us = time.ticks_us()
+            self.state = APPLYING
+            self._flag.set()
+
+    def fill(self):
+        struct.pack_into(_STATUS, self.status, 0, ord('R'), VERSION, self.state, self.error,
+                         self.next_seq, self.chunk_errors, self.received, self.apply_us)
+        return self.status
+
+    def on_interface_control_xfer(self, stage, request):
+        bmRequestType, bRequest, wValue, _, _ = request
+        if (stage == _STAGE_SETUP and bmRequestType == _REQ_TYPE_CLASS_IN
+                and bRequest == _REQ_GET_REPORT and wValue >> 8 == _REPORT_TYPE_FEATURE):
+            return self.fill()
+        return super().on_interface_control_xfer(stage, request)
+
+    async def run(self):
+        while True:
+            await self._flag.wait()
+            if self.state != APPLYING:
+                continue
+            blob, self._buf = bytes(self._buf), None
+            try:
+                keymap = decode(blob)
+            except Exception as e:
+                self.log(f"Keymap Error: {e}", error=True)
+                self.error = E_FORMAT
+                self.state = FAILED
+                continue
+            await self.apply(*keymap)
+            self.apply_us = time.ticks_diff(time.ticks_us(), self._end_us)
+            self.state = APPLIED
+            self.log(f"Keymap applied: {len(blob)} bytes, {self.apply_us} us")
+            if self.path:
+                try:
+                    with open(self.path, "wb") as f:
+                        f.write(blob)
+                except OSError as e:
+                    self.log(f"Keymap Save Error: {e}", error=True)
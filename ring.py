@@ -0,0 +1,56 @@
+# ring.py - Lock-free single-producer/single-consumer ring of int events
+#
+# Used to hand PS/2 key events from core 1 to the USB task on core 0.
+# Everything lives in preallocated arrays: push/pop never allocate, and with
+# one writer per index no lock is needed (each array store is a single word
+# write, the slot is written before the head index that publishes it).
+# Plain Python apart from array, so it runs under CPython threads too.
+
+from array import array
+
+_HEAD = 0  # Written by the producer only
+_TAIL = 1  # Written by the consumer only
+
+
+class EventRing:
+    def __init__(self, size=64):
+        if size & (size - 1):
+            raise ValueError("Ring size must be a power of two")
+        self.buf = array('I', [0] * size)
+        self.size = size
+        self.mask = size - 1
+        # Indices run modulo 2 * size so a full ring differs from an empty one
+        self.wrap = 2 * size - 1
+        self.idx = array('I', [0, 0])
+        # Producer side statistics
+        self.dropped = 0
+        self.high_water = 0
+
+    def pending(self):
+        return (self.idx[_HEAD] - self.idx[_TAIL]) & self.wrap
+
+    def push(self, ev):
+        """Producer: append ev (0 <= ev < 2**30). False if the ring is full."""
+        head = self.idx[_HEAD]
+        n = (head - self.idx[_TAIL]) & self.wrap
+        if n == self.size:
+            self.dropped += 1
+            return False
+        self.buf[head & self.mask] = ev
+        self.idx[_HEAD] = (head + 1) & self.wrap
+        if n >= self.high_water:
+            self.high_water = n + 1
+        return True
+
+    def pop(self):
+        """Consumer: oldest event, or -1 if the ring is empty"""
+        tail = self.idx[_TAIL]
+        if tail == self.idx[_HEAD]:
+            return -1
+        ev = self.buf[tail & self.mask]
+        self.idx[_TAIL] = (tail + 1) & self.wrap
+        return ev
+
+    def clear(self):
+        """Consumer: drop everything pending"""
+        self.idx[_TAIL] = self.idx[_HEAD]
@@ -4,28 +4,32 @@ Upload ps2_pio.py first, then run this file
 """
 
 import uasyncio as asyncio
-from ps2_pio import PS2Keyboard
+from ps2_pio import PS2Keyboard, STAT_NAMES, EV_PRESSED, EV_EXTENDED
 
 # === UPDATE THESE PINS ===
 CLK_PIN = 0
 DATA_PIN = 1
 # =========================
 
-def on_key(scancode, pressed, extended):
-    """Simple callback - just print the event"""
-    print(f"{'▼' if pressed else '▲'} 0x{scancode:02X} {'[EXT]' if extended else ''}")
+async def print_keys(kb):
+    """Just print every event"""
+    async for ev in kb.events():
+        print(f"{'▼' if ev & EV_PRESSED else '▲'} 0x{ev & 0xFF:02X} {'[EXT]' if ev & EV_EXTENDED else ''}")
 
 async def main():
     print("PS/2 Keyboard Test")
     print(f"CLK=GPIO{CLK_PIN}, DATA=GPIO{DATA_PIN}")
     print("-" * 40)
     
-    kb = PS2Keyboard(CLK_PIN, DATA_PIN, on_key)
+    kb = PS2Keyboard(CLK_PIN, DATA_PIN)
     asyncio.create_task(kb.read_loop())
+    asyncio.create_task(print_keys(kb))
     
     print("Ready - press keys!\n")
     
     while True:
         await asyncio.sleep(60)
+        # Line statistics: errors here point at wiring/level shifting problems
+        print(", ".join(f"{n}={v}" for n, v in zip(STAT_NAMES, kb.stats)))
 
 asyncio.run(main())
@@ -0,0 +1,385 @@
+# store.py - Log-structured record store for logs and settings on flash
+#
+# Fixed 64 byte records are appended to segments (one erase block each) of a
+# block device, oldest segment first when the ring comes round, so every
+# block is erased equally often. A record is a tag, a length, up to
+# MAX_PAYLOAD bytes and a CRC32:
+#   - tags 0-127 are settings (put/get/delete): the newest record of a key
+#     wins, and compaction copies it forward before its segment is erased
+#   - TAG_LOG records are log lines: the oldest are dropped when their
+#     segment is reclaimed, so the log never grows past the store's size
+# Slot 0 of a segment is a header with its sequence number and erase count.
+#
+# Writes are batched in RAM and only reach flash in flush(): run() flushes
+# while the keyboard is idle (flash program/erase stalls the whole chip,
+# ~0.5 ms per page, ~45 ms per erase), mid-typing only once the batch is
+# full. A flush erases at most one block: when the head segment is full, or
+# to reclaim the oldest one after that if the head has room for its
+# settings.
+#
+# Power loss: a torn record fails its CRC and is skipped. Settings from a
+# reclaimed segment are copied to the new head before it is erased, and one
+# erased spare segment is kept, so a cut during compaction loses nothing.
+#
+# The device is anything with the MicroPython block device protocol
+# (readblocks/writeblocks with offset, ioctl 4/5/6): FileDevice keeps the
+# store in a preallocated file on the existing filesystem,
+# tools/store_sim.py uses a simulated NOR flash.
+
+from binascii import crc32
+import time
+import uasyncio as asyncio
+
+REC_LEN = 64
+MAX_PAYLOAD = REC_LEN - 6   # Tag, length, payload, CRC32
+PAGE = 256                  # Flash program granularity
+
+TAG_LOG = 0x80
+TAG_HEADER = 0xFE
+_ERASED = 0xFF
+_DELETED = 0xFD             # Length of a record that deletes its key
+
+MAGIC = b"RSTO"
+VERSION = 1
+
+_BLANK = b"\xff" * REC_LEN
+
+_IOCTL_BLOCK_COUNT = 4
+_IOCTL_BLOCK_SIZE = 5
+_IOCTL_BLOCK_ERASE = 6
+
+
+class FileDevice:
+    """Block device protocol over a preallocated file (erased = 0xFF)"""
+
+    def __init__(self, path, blocks=4, block_size=4096):
+        self.blocks = blocks
+        self.block_size = block_size
+        try:
+            f = open(path, "r+b")
+            f.seek(0, 2)
+            if f.tell() != blocks * block_size:
+                f.close()
+                raise OSError
+        except OSError:
+            f = open(path, "w+b")
+            for _ in range(blocks * block_size // PAGE):
+                f.write(_BLANK * (PAGE // REC_LEN))
+            f.flush()
+        self.f = f
+
+    def readblocks(self, n, buf, offset=0):
+        self.f.seek(n * self.block_size + offset)
+        self.f.readinto(buf)
+
+    def writeblocks(self, n, buf, offset=0):
+        self.f.seek(n * self.block_size + offset)
+        self.f.write(buf)
+        self.f.flush()
+
+    def ioctl(self, op, arg):
+        if op == _IOCTL_BLOCK_COUNT:
+            return self.blocks
+        if op == _IOCTL_BLOCK_SIZE:
+            return self.block_size
+        if op == _IOCTL_BLOCK_ERASE:
+            for o in range(0, self.block_size, PAGE):
+                self.writeblocks(arg, _BLANK * (PAGE // REC_LEN), o)
+        return 0
+
+
+class RecordStore:
+    def __init__(self, dev, batch=16):
+        self.dev = dev
+        self.blocks = dev.ioctl(_IOCTL_BLOCK_COUNT, 0)
+        self.block_size = dev.ioctl(_IOCTL_BLOCK_SIZE, 0)
+        if self.blocks < 3 or self.block_size % PAGE:
+            raise ValueError("Need 3 or more blocks of a multiple of 256 bytes")
+        self.slots = self.block_size // REC_LEN
+        # Settings must fit into half a segment so compaction always has room
+        self.max_keys = self.slots // 2
+        self.seq = [0] * self.blocks      # 0: not a valid segment
+        self.wear = [0] * self.blocks     # Erase count from the segment headers
+        self.clean = [False] * self.blocks  # Erased by us since mount
+        self.head = -1
+        self.next = 0                     # Next free slot in the head segment
+        self.index = {}                   # key -> block * slots + slot
+        # Records waiting for flush(), already encoded
+        self.batch = bytearray(batch * REC_LEN)
+        self.batch_cap = batch
+        self.batch_n = 0
+        self.rec = bytearray(REC_LEN)
+        self.page = bytearray(PAGE)
+        # Statistics
+        self.written = 0      # Records written
+        self.dropped = 0      # Log lines lost to a full batch
+        self.erases = 0       # Erases since mount
+        self.torn = 0         # Records that failed their CRC at mount
+        self.flushes = 0
+        self.flush_us = 0     # Latest flush, including any erase
+        self.max_flush_us = 0
+        self._mount()
+
+    # --- Encoding ---
+
+    def _encode(self, buf, o, tag, data, length):
+        buf[o] = tag
+        buf[o + 1] = length
+        n = length if length <= MAX_PAYLOAD else 0
+        for i in range(MAX_PAYLOAD):
+            buf[o + 2 + i] = data[i] if i < n else _ERASED
+        crc = crc32(memoryview(buf)[o:o + REC_LEN - 4])
+        for i in range(4):
+            buf[o + REC_LEN - 4 + i] = (crc >> (8 * i)) & 0xFF
+
+    def _valid(self, buf):
+        crc = crc32(memoryview(buf)[:REC_LEN - 4])
+        return (buf[REC_LEN - 4] | buf[REC_LEN - 3] << 8 | buf[REC_LEN - 2] << 16
+                | buf[REC_LEN - 1] << 24) == crc
+
+    def _read(self, block, slot):
+        self.dev.readblocks(block, self.rec, slot * REC_LEN)
+        return self.rec
+
+    # --- Mount ---
+
+    def _mount(self):
+        for b in range(self.blocks):
+            r = self._read(b, 0)
+            if r[0] == TAG_HEADER and self._valid(r) and r[2:6] == MAGIC and r[6] == VERSION:
+                self.seq[b] = r[7] | r[8] << 8 | r[9] << 16 | r[10] << 24
+                self.wear[b] = r[11] | r[12] << 8 | r[13] << 16 | r[14] << 24
+        for b in self._order():
+            last = 0
+            for s in range(1, self.slots):
+                r = self._read(b, s)
+                if r == _BLANK:
+                    continue
+                last = s
+                if not self._valid(r):
+                    self.torn += 1
+                elif r[0] < TAG_LOG:
+                    self._index(r[0], r[1], b * self.slots + s)
+            self.head = b
+            self.next = last + 1
+
+    def _order(self):
+        """Valid segments, oldest first"""
+        order = [b for b in range(self.blocks) if self.seq[b]]
+        order.sort(key=lambda b: self.seq[b])
+        return order
+
+    def _index(self, key, length, loc):
+        if length == _DELETED:
+            self.index.pop(key, None)
+        else:
+            self.index[key] = loc
+
+    # --- Segments ---
+
+    def _erase(self, b):
+        self.dev.ioctl(_IOCTL_BLOCK_ERASE, b)
+        self.seq[b] = 0
+        self.wear[b] += 1
+        self.clean[b] = True
+        self.erases += 1
+
+    def _open(self, b):
+        """Make b the head segment: erase if needed, write its header"""
+        if not self.clean[b]:
+            self._erase(b)
+        self.clean[b] = False
+        seq = max(self.seq) + 1
+        h = bytearray(MAX_PAYLOAD)
+        h[0:4] = MAGIC
+        h[4] = VERSION
+        for i in range(4):
+            h[5 + i] = (seq >> (8 * i)) & 0xFF
+            h[9 + i] = (self.wear[b] >> (8 * i)) & 0xFF
+        self._encode(self.rec, 0, TAG_HEADER, h, 13)
+        self.head = b
+        self.next = 0
+        self._program(self.rec, 0, 1)
+        self.seq[b] = seq
+
+    def _rollover(self):
+        """Move on to a new head segment, reclaiming the oldest if needed"""
+        free = [b for b in range(self.blocks) if not self.seq[b]]
+        if not free:
+            # Last resort, flush() normally reclaims a segment before the
+            # head fills up: reclaim the oldest in place, its settings held
+            # in RAM meanwhile
+            victim = self._order()[0]
+            live = self._live(victim)
+            self._erase(victim)
+            self._open(victim)
+            for r in live:
+                self._copy(r)
+            return
+        # Least worn free segment
+        b = free[0]
+        for f in free:
+            if self.wear[f] < self.wear[b]: b = f
+        self._open(b)
+
+    def _reclaim(self):
+        """
+        Copy the settings out of the oldest segment into the head, erase it.
+        False, with nothing written, if they don't fit into the head: it
+        fills up first and _rollover reclaims the oldest in place.
+        """
+        victim = self._order()[0]
+        live = self._live(victim)
+        if len(live) > self.slots - self.next:
+            return False
+        for r in live:
+            self._copy(r)
+        self._erase(victim)
+        return True
+
+    def _live(self, b):
+        """Records of b that are still the newest for their key"""
+        live = []
+        base = b * self.slots
+        for key, loc in self.index.items():
+            if base <= loc < base + self.slots:
+                live.append(bytes(self._read(b, loc - base)))
+        return live
+
+    def _copy(self, r):
+        if self.next >= self.slots:
+            # Callers check the room first: a copy past the end of the head
+            # would program the next block
+            raise ValueError("Head segment full")
+        self._program(r, 0, 1)
+        self._index(r[0], r[1], self.head * self.slots + self.next - 1)
+
+    def _program(self, src, i, n):
+        """Write records i..i+n-1 of src to the head at self.next, page by page"""
+        while n:
+            off = self.next * REC_LEN
+            start = off - off % PAGE
+            k = (start + PAGE - off) // REC_LEN
+            if k > n: k = n
+            # Whole pages: the already written part is programmed again unchanged
+            self.dev.readblocks(self.head, self.page, start)
+            o = off - start
+            self.page[o:o + k * REC_LEN] = memoryview(src)[i * REC_LEN:(i + k) * REC_LEN]
+            self.dev.writeblocks(self.head, self.page, start)
+            self.next += k
+            i += k
+            n -= k
+
+    # --- API ---
+
+    def _add(self, tag, data, length):
+        if self.batch_n == self.batch_cap:
+            if tag == TAG_LOG:
+                self.dropped += 1
+                return False
+            self.flush()  # Settings are never dropped
+        self._encode(self.batch, self.batch_n * REC_LEN, tag, data, length)
+        self.batch_n += 1
+        return True
+
+    def put(self, key, data):
+        """Store up to MAX_PAYLOAD bytes under key (0-127), on flash at the next flush"""
+        if not 0 <= key < TAG_LOG or len(data) > MAX_PAYLOAD:
+            raise ValueError("Key 0-127 and at most 58 bytes")
+        if self.get(key) == bytes(data):
+            return
+        if key not in self.index and len(self.index) >= self.max_keys:
+            raise ValueError("Store full")
+        self._add(key, data, len(data))
+
+    def get(self, key):
+        """Newest value of key (pending ones included), or None"""
+        for i in range(self.batch_n - 1, -1, -1):
+            o = i * REC_LEN
+            if self.batch[o] == key:
+                n = self.batch[o + 1]
+                return None if n == _DELETED else bytes(self.batch[o + 2:o + 2 + n])
+        loc = self.index.get(key)
+        if loc is None:
+            return None
+        r = self._read(loc // self.slots, loc % self.slots)
+        return bytes(r[2:2 + r[1]])
+
+    def delete(self, key):
+        if self.get(key) is not None:
+            self._add(key, b"", _DELETED)
+
+    def log(self, line):
+        """Append a log line (str or bytes, cut to MAX_PAYLOAD bytes)"""
+        if isinstance(line, str):
+            line = line.encode()
+        n = len(line) if len(line) < MAX_PAYLOAD else MAX_PAYLOAD
+        return self._add(TAG_LOG, line, n)
+
+    def logs(self):
+        """Yield the stored log lines, oldest first, then the pending ones"""
+        for b in self._order():
+            end = self.next if b == self.head else self.slots
+            for s in range(1, end):
+                r = self._read(b, s)
+                if r[0] == TAG_LOG and self._valid(r):
+                    yield bytes(r[2:2 + r[1]])
+        for i in range(self.batch_n):
+            o = i * REC_LEN
+            if self.batch[o] == TAG_LOG:
+                yield bytes(self.batch[o + 2:o + 2 + self.batch[o + 1]])
+
+    def pending(self):
+        return self.batch_n
+
+    def flush(self):
+        """Write the pending records. Stalls flash: call while idle."""
+        n = self.batch_n
+        if not n:
+            return 0
+        t = time.ticks_us()
+        if self.head >= 0 and 0 not in self.seq and self.next < self.slots:
+            # The last flush used up the spare segment (or a power cut
+            # interrupted compaction): reclaim the oldest now, one erase per
+            # flush, if the head still has room for the copies
+            self._reclaim()
+        i = 0
+        while i < n:
+            if self.head < 0 or self.next >= self.slots:
+                self._rollover()
+            k = self.slots - self.next
+            if k > n - i: k = n - i
+            first = self.next
+            self._program(self.batch, i, k)
+            for j in range(k):
+                o = (i + j) * REC_LEN
+                if self.batch[o] < TAG_LOG:
+                    self._index(self.batch[o], self.batch[o + 1], self.head * self.slots + first + j)
+            i += k
+        self.batch_n = 0
+        self.written += n
+        self.flushes += 1
+        self.flush_us = time.ticks_diff(time.ticks_us(), t)
+        if self.flush_us > self.max_flush_us:
+            self.max_flush_us = self.flush_us
+        return n
+
+    async def run(self, idle=None, period_ms=100):
+        """
+        Flush while idle() says the keyboard is quiet. Mid-typing only a
+        full batch is flushed: further log lines would be dropped.
+        """
+        while True:
+            await asyncio.sleep_ms(period_ms)
+            n = self.batch_n
+            if n and (n == self.batch_cap or idle is None or idle()):
+                self.flush()
+
+
+def dump(path="store.bin", blocks=4):
+    """Print the log lines and settings of a store file (e.g. over mpremote)"""
+    s = RecordStore(FileDevice(path, blocks))
+    for line in s.logs():
+        print(line.decode())
+    for key in sorted(s.index):
+        print(f"[{key}] {s.get(key)}")
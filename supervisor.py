@@ -0,0 +1,157 @@
+# supervisor.py - Restarts crashed or stuck tasks, feeds the hardware watchdog
+#
+# Every supervised task runs inside a guard that awaits it directly, so a
+# crash is noticed the moment the exception comes out (not at the next
+# polling round) and the task is restarted right away. Repeated crashes
+# back off exponentially, up to max_backoff_ms. A critical task that keeps
+# crashing faster than stable_ms for max_streak times in a row is marked
+# failed; it is still restarted every max_backoff_ms, and once a restart
+# runs for stable_ms the mark is cleared.
+#
+# Tasks can't always crash cleanly: a reader can also get stuck. Each task
+# can have an alive() check, polled every period_ms; if it stays false for
+# stall_ms the task is cancelled and restarted like a crashed one.
+#
+# With a machine.WDT the supervisor feeds it only while every critical task
+# is alive and none is marked failed. A hung event loop (nothing runs any
+# more, including the supervisor) or a crash loop resets the board; without
+# one a crash loop just keeps retrying. Before any restart on_restart() runs (release all keys
+# on the host), so nothing stays held down.
+
+import time
+import uasyncio as asyncio
+
+
+def _print(msg, error=False):
+    # Default log(): same signature as main.log, errors aren't kept anywhere
+    print(msg)
+
+
+class Supervisor:
+    def __init__(self, wdt_ms=0, on_restart=None, log=_print, period_ms=50, stall_ms=250,
+                 backoff_ms=10, max_backoff_ms=1000, stable_ms=5000, max_streak=5):
+        self.on_restart = on_restart
+        self.log = log
+        self.period_ms = period_ms
+        self.stall_ms = stall_ms
+        self.backoff_ms = backoff_ms
+        self.max_backoff_ms = max_backoff_ms
+        self.stable_ms = stable_ms
+        self.max_streak = max_streak
+        self.wdt = None
+        if wdt_ms:
+            from machine import WDT
+            self.wdt = WDT(timeout=wdt_ms)
+        self.names = []
+        self.factories = []
+        self.checks = []
+        self.critical = []
+        self.tasks = []
+        self.bad_since = []   # ticks_ms when alive() turned false, -1 if alive
+        self.stalled = []     # Cancelled by run(), not from outside
+        self.crashes = []     # Per task: exceptions (and returns)
+        self.stalls = []      # Per task: cancelled because alive() stayed false
+        self.streak = []      # Per task: restarts in a row without a stable run
+        self.errors = []      # Per task: latest exception
+        self.restart_us = 0   # Latest crash -> running again, backoff included
+        self.feeds = 0
+        self.started = []     # Per task: ticks_ms of the latest (re)start
+        self.failed = None    # Name of a critical task in a crash loop
+
+    def add(self, name, factory, alive=None, critical=True):
+        """
+        Supervise the coroutine factory() (called again for every restart).
+        alive() returns False while the task is not making progress.
+        """
+        i = len(self.names)
+        self.names.append(name)
+        self.factories.append(factory)
+        self.checks.append(alive)
+        self.critical.append(critical)
+        self.tasks.append(None)
+        self.bad_since.append(-1)
+        self.stalled.append(False)
+        self.crashes.append(0)
+        self.stalls.append(0)
+        self.streak.append(0)
+        self.errors.append(None)
+        self.started.append(0)
+        asyncio.create_task(self._guard(i))
+        return i
+
+    def restarts(self):
+        return sum(self.crashes) + sum(self.stalls)
+
+    async def _guard(self, i):
+        name = self.names[i]
+        while True:
+            started = self.started[i] = time.ticks_ms()
+            task = self.tasks[i] = asyncio.create_task(self.factories[i]())
+            try:
+                await task
+                self.errors[i] = None
+                self.crashes[i] += 1
+                self.log(f"Task {name} returned, restarting", error=True)
+            except asyncio.CancelledError:
+                if not self.stalled[i]:
+                    raise  # Shutdown: the guard itself was cancelled
+                self.stalled[i] = False
+                self.log(f"Task {name} stalled, restarting", error=True)
+            except Exception as e:
+                self.errors[i] = e
+                self.crashes[i] += 1
+                self.log(f"Task {name} crashed: {e}", error=True)
+            t = time.ticks_us()
+            self.tasks[i] = None
+            self.bad_since[i] = -1
+            if self.on_restart is not None:
+                try:
+                    self.on_restart()
+                except Exception as e:
+                    self.log(f"Restart hook failed: {e}", error=True)
+            if time.ticks_diff(time.ticks_ms(), started) >= self.stable_ms:
+                self.streak[i] = 0
+            self.streak[i] += 1
+            if self.streak[i] > self.max_streak and self.critical[i]:
+                self.failed = name  # Keeps crashing: let the watchdog reset the board
+            delay = self.backoff_ms << min(self.streak[i] - 1, 16)
+            await asyncio.sleep_ms(min(delay, self.max_backoff_ms))
+            self.restart_us = time.ticks_diff(time.ticks_us(), t)
+
+    def _crash_looping(self):
+        """Name of a critical task still in a crash loop, or None"""
+        for i in range(len(self.names)):
+            if self.critical[i] and self.streak[i] > self.max_streak:
+                return self.names[i]
+        return None
+
+    async def run(self):
+        """Stall detection and watchdog feeding, every period_ms"""
+        while True:
+            now = time.ticks_ms()
+            healthy = True
+            for i in range(len(self.names)):
+                check = self.checks[i]
+                if self.tasks[i] is None:
+                    continue  # Backing off before a restart
+                if self.streak[i] and time.ticks_diff(now, self.started[i]) >= self.stable_ms:
+                    # Running stably again: the crash loop is over
+                    self.streak[i] = 0
+                    if self.failed == self.names[i]:
+                        self.failed = self._crash_looping()
+                if check is None or check():
+                    self.bad_since[i] = -1
+                    continue
+                if self.bad_since[i] < 0:
+                    self.bad_since[i] = now
+                elif time.ticks_diff(now, self.bad_since[i]) >= self.stall_ms:
+                    if self.critical[i]:
+                        healthy = False
+                    if not self.stalled[i]:
+                        self.stalls[i] += 1
+                        self.stalled[i] = True
+                        self.tasks[i].cancel()
+            if healthy and self.failed is None and self.wdt is not None:
+                self.wdt.feed()
+                self.feeds += 1
+            await asyncio.sleep_ms(self.period_ms)
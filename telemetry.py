@@ -0,0 +1,124 @@
+# telemetry.py - Runtime counters and a vendor HID feature report to read them
+#
+# COUNTERS is a fixed, preallocated block of counters that the converter
+# bumps in place (no allocation, no locks). TelemetryInterface is an extra
+# HID interface that answers a GET_REPORT(Feature) on the control endpoint
+# with a binary snapshot, so reading telemetry never touches the keyboard's
+# interrupt endpoint or waits on the keystroke path. Poll it from the PC
+# with tools/stats.py.
+#
+# Snapshot: 4 byte header (b'T', VERSION, number of values, 0), then every
+# value of NAMES as a little endian u32: the PS/2 line statistics
+# (ps2_pio.STAT_NAMES), the counters below, then the event ring's
+# high-water mark and drops and the uptime in ms.
+
+from array import array
+import time
+import uasyncio as asyncio
+from usb.device.hid import HIDInterface
+from ps2_pio import STAT_NAMES
+
+VERSION = 4
+
+# Indices into COUNTERS
+T_UNKNOWN = 0       # Scancodes without a KEY_MAP entry
+T_REPORTS = 1       # Keyboard reports sent
+T_SEND_FAIL = 2     # Reports not accepted (endpoint still busy after the timeout)
+T_USB_ERR = 3       # Exceptions in the USB path
+T_GC_RUNS = 4       # Idle collections by main.gc_task
+T_LAG_MAX_US = 5    # Worst event loop lag seen by lag_monitor
+T_LAG_US = 6        # Latest event loop lag
+T_RESTARTS = 7      # Tasks restarted by the supervisor
+T_IDLE_MS = 8       # Time spent idle (power.Governor), counted at each wake
+T_WAKES = 9         # Wakes from idle
+T_WAKE_US = 10      # Latest wake: CLK edge -> full clock speed
+T_WAKE_FRAME_US = 11  # Latest wake: CLK edge -> first frame decoded
+T_USB_MS = 12       # Boot: reset -> USB configured by the host
+T_BAT_MS = 13       # Boot: reset -> keyboard self-test passed (0: none seen)
+T_READY_MS = 14     # Boot: reset -> READY, keys typed meanwhile replayed
+T_REPLAYED = 15     # Boot: key events replayed at READY
+COUNTER_NAMES = ("unknown", "reports", "send_fail", "usb_err", "gc_runs", "lag_max_us", "lag_us",
+                 "restarts", "idle_ms", "wakes", "wake_us", "wake_frame_us",
+                 "usb_ms", "bat_ms", "ready_ms", "replayed")
+
+COUNTERS = array('I', [0] * len(COUNTER_NAMES))
+
+NAMES = STAT_NAMES + COUNTER_NAMES + ("ring_high", "ring_dropped", "uptime_ms")
+
+_HEADER_LEN = 4
+SNAPSHOT_LEN = _HEADER_LEN + 4 * len(NAMES)
+
+_STAGE_SETUP = 1
+_REQ_TYPE_CLASS_IN = 0xA1   # Device to host, class, interface
+_REQ_GET_REPORT = 0x01
+_REPORT_TYPE_FEATURE = 0x03
+
+# fmt: off
+_TELEMETRY_REPORT_DESC = (
+    b'\x06\x00\xFF'     # Usage Page (Vendor Defined 0xFF00),
+    b'\x09\x01'         # Usage (1),
+    b'\xA1\x01'         # Collection (Application),
+        b'\x09\x02'         # Usage (2),
+        b'\x15\x00'         # Logical Minimum (0),
+        b'\x26\xFF\x00'     # Logical Maximum (255),
+        b'\x75\x08'         # Report Size (8),
+        b'\x95' + bytes((SNAPSHOT_LEN,)) +  # Report Count (snapshot bytes),
+        b'\xB1\x02'         # Feature (Data, Variable, Absolute),
+    b'\xC0'             # End Collection
+)
+# fmt: on
+
+
+async def lag_monitor(period_ms=10, governor=None):
+    """How late the event loop wakes a task that asked to sleep period_ms"""
+    period_us = period_ms * 1000
+    while True:
+        if governor is not None and governor.idle:
+            await governor.park()
+        t = time.ticks_us()
+        await asyncio.sleep_ms(period_ms)
+        lag = time.ticks_diff(time.ticks_us(), t) - period_us
+        if lag < 0: lag = 0
+        COUNTERS[T_LAG_US] = lag
+        if lag > COUNTERS[T_LAG_MAX_US]:
+            COUNTERS[T_LAG_MAX_US] = lag
+
+
+class TelemetryInterface(HIDInterface):
+    def __init__(self):
+        super().__init__(_TELEMETRY_REPORT_DESC, interface_str="PS/2 Converter Telemetry")
+        self.kb = None  # PS2Keyboard, for its line statistics and event ring
+        self.snapshot = bytearray(SNAPSHOT_LEN)
+        self.snapshot[0] = ord('T')
+        self.snapshot[1] = VERSION
+        self.snapshot[2] = len(NAMES)
+
+    def _put(self, i, value):
+        o = _HEADER_LEN + 4 * i
+        b = self.snapshot
+        b[o] = value & 0xFF
+        b[o + 1] = (value >> 8) & 0xFF
+        b[o + 2] = (value >> 16) & 0xFF
+        b[o + 3] = (value >> 24) & 0xFF
+
+    def fill(self):
+        """Copy every value into the snapshot buffer"""
+        i = 0
+        kb = self.kb
+        for n in range(len(STAT_NAMES)):
+            self._put(i, kb.stats[n] if kb else 0)
+            i += 1
+        for n in range(len(COUNTERS)):
+            self._put(i, COUNTERS[n])
+            i += 1
+        self._put(i, kb.ring.high_water if kb else 0)
+        self._put(i + 1, kb.ring.dropped if kb else 0)
+        self._put(i + 2, time.ticks_ms())
+        return self.snapshot
+
+    def on_interface_control_xfer(self, stage, request):
+        bmRequestType, bRequest, wValue, _, _ = request
+        if (stage == _STAGE_SETUP and bmRequestType == _REQ_TYPE_CLASS_IN
+                and bRequest == _REQ_GET_REPORT and wValue >> 8 == _REPORT_TYPE_FEATURE):
+            return self.fill()
+        return super().on_interface_control_xfer(stage, request)
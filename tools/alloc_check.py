@@ -0,0 +1,212 @@
+"""
+Allocation regression check for the per-keystroke path.
+
+Feeds PS/2 frame words through PS2Keyboard -> event ring ->
+PS2ToUSB.handle_events -> update_key -> flush_keys under tracemalloc and
+fails (exit code 1) if any keystroke allocates. Run from the repo root:
+
+    python3 tools/alloc_check.py
+
+The budget is zero. One pass over every step warms up first-use
+allocations (caches, freelists) outside the measured window; in it, every
+bytecode instruction of the firmware is traced and any growth of the
+traced memory it causes is an allocation. Only what CPython alone puts on
+the heap is told apart, by instruction: boxed ints above 256 from
+arithmetic, subscripts and calls (MicroPython keeps ints up to 2**30
+unboxed) and the range and iterator objects of `for` loops (MicroPython
+compiles range loops to a counter and iterates built-in sequences from a
+stack buffer). Instructions that always allocate on MicroPython (building
+tuples, lists, strings, slices, closures; true division) fail even when
+CPython serves them from a free list. Anything retained fails as well.
+"""
+
+import dis
+import gc
+import os
+from array import array
+import sys
+import tracemalloc
+
+import host
+
+host.install()
+
+from corpus import PAUSE, PRINTSCR_MAKE, PRINTSCR_BREAK, tap
+from ps2_constants import PS2
+from ps2_pio import PS2Keyboard
+from media import MediaInterface
+import main
+
+# Instructions whose result may be a boxed int, and the largest one (2 digits)
+INT_OPS = {dis.opmap[op] for op in ("BINARY_OP", "BINARY_SUBSCR", "UNARY_INVERT",
+                                    "UNARY_NEGATIVE", "CALL")}
+INT_SIZE = 32
+# Instructions that may create an iterator (for loops, unpacking a list),
+# and the largest one
+ITER_OPS = {dis.opmap[op] for op in ("GET_ITER", "UNPACK_SEQUENCE")}
+ITER_SIZE = 48
+
+# Instructions that allocate on MicroPython whatever the size CPython
+# reports: it serves tuples, small lists and floats from free lists
+ALLOC_OPS = {dis.opmap[op] for op in ("BUILD_TUPLE", "BUILD_LIST", "BUILD_MAP", "BUILD_SET",
+                                      "BUILD_STRING", "BUILD_SLICE", "FORMAT_VALUE",
+                                      "MAKE_FUNCTION", "CALL_FUNCTION_EX")}
+BINARY_OP = dis.opmap["BINARY_OP"]
+FLOAT_OPS = {i for i, (name, _) in enumerate(dis._nb_ops)
+             if name in ("NB_TRUE_DIVIDE", "NB_INPLACE_TRUE_DIVIDE")}
+
+FIRMWARE = host.ROOT + os.sep
+TOOLS = os.path.join(host.ROOT, "tools") + os.sep
+
+# Retained memory is only attributed to the firmware, not to this script
+FILTERS = [tracemalloc.Filter(True, os.path.join(host.ROOT, "*.py")),
+           tracemalloc.Filter(False, os.path.join(host.ROOT, "tools", "*"))]
+
+def keystrokes():
+    """One list of PS/2 bytes per keystroke-level step"""
+    steps = [tap(k) for k in (PS2.H, PS2.E, PS2.L, PS2.L, PS2.O, PS2.SPACE)]
+    steps += [tap(PS2.L_SHIFT, PS2.W), tap(PS2.R_CTRL, PS2.LEFT), tap(PS2.KP_ENTER)]
+    steps += [tap(PS2.CAPS_LOCK), tap(PS2.L_GUI)]
+    steps += [tap(PS2.W, PS2.A, PS2.S, PS2.D, PS2.SPACE, PS2.L_SHIFT, PS2.E)]  # > 6 keys
+    steps += [PAUSE, PRINTSCR_MAKE, PRINTSCR_BREAK]
+    steps += [tap(PS2.VOL_UP), tap(PS2.MEDIA_PLAY), tap(PS2.SLEEP)]
+    return [host.encode_bytes(s) for s in steps]
+
+
+def range_calls(code):
+    """Offsets of the CALL instructions in code that call range()"""
+    calls = set()
+    pending = False
+    for ins in dis.get_instructions(code):
+        if ins.opname == "LOAD_GLOBAL" and ins.argval == "range":
+            pending = True
+        elif ins.opname == "CALL" and pending:
+            calls.add(ins.offset)
+            pending = False
+    return calls
+
+
+class Tracer:
+    """
+    sys.settrace hook measuring, for every firmware instruction, how far
+    the traced memory grew while it ran. The hook keeps its state in
+    preallocated slots and leaves nothing alive when it returns, so it
+    adds nothing to the readings.
+    """
+
+    def __init__(self):
+        self.mem = array('q', [0, 0])   # Traced memory at the last event, peak since
+        self.lasti = array('l', [0])
+        self.frame = None
+        self.cpython = {"int": 0, "iter": 0}
+        self.found = []     # (file:line, instruction, bytes)
+        self._ranges = {}
+        self._trace = self._local   # One bound method, not one per event
+
+    def _check(self):
+        # Classifies what the previous instruction did; runs before the
+        # peak is reset, so its own locals never hide an allocation
+        code = self.frame.f_code
+        lasti = self.lasti[0]
+        size = self.mem[1] - self.mem[0]
+        op = code.co_code[lasti]
+        if op in ALLOC_OPS or op == BINARY_OP and code.co_code[lasti + 1] in FLOAT_OPS:
+            pass
+        elif size <= 0:
+            return
+        elif op in INT_OPS and size <= INT_SIZE:
+            self.cpython["int"] += 1
+            return
+        elif (op in ITER_OPS or lasti in self._range_calls(code)) and size <= ITER_SIZE:
+            self.cpython["iter"] += 1
+            return
+        line = list(code.co_positions())[lasti // 2][0]
+        self.found.append((f"{os.path.basename(code.co_filename)}:{line}", dis.opname[op], size))
+
+    def _range_calls(self, code):
+        if code not in self._ranges:
+            self._ranges[code] = range_calls(code)
+        return self._ranges[code]
+
+    def _start(self):
+        self.mem[0] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+    def _local(self, frame, event, arg):
+        # Read once: reading allocates the result tuple, which would raise the peak
+        self.mem[1] = tracemalloc.get_traced_memory()[1]
+        if self.frame is not None:
+            self._check()
+        # Calls are not attributed: the interpreter creates frame objects for the tracer
+        self.frame = frame if event == "opcode" else None
+        self.lasti[0] = frame.f_lasti
+        self._start()
+        return self._trace
+
+    def _call(self, frame, event, arg):
+        self.frame = None
+        name = frame.f_code.co_filename
+        if name.startswith(FIRMWARE) and not name.startswith(TOOLS):
+            frame.f_trace_opcodes = True
+            self._start()
+            return self._trace
+        self._start()
+        return None
+
+    def __enter__(self):
+        self._start()
+        sys.settrace(self._call)
+        return self
+
+    def __exit__(self, *exc):
+        sys.settrace(None)
+
+
+def main_check(rounds=20):
+    usb_kb = main.PS2ToUSB()
+    usb_kb.media = MediaInterface()
+    kb = PS2Keyboard(0, 1)
+    steps = keystrokes()
+    buf = array('I', [0] * kb.ring.size)
+
+    def step():
+        # What read_loop and main.event_pump do per wakeup
+        kb.poll()
+        usb_kb.handle_events(buf, kb.read_events(buf))
+
+    # Warm up: first-use allocations (caches, freelists, the line tables
+    # tracing builds per function) are not per-keystroke
+    with Tracer():
+        for words in steps:
+            kb.sm.feed(words)
+            step()
+    gc.collect()
+
+    tracemalloc.start()
+    start = tracemalloc.take_snapshot().filter_traces(FILTERS)
+    with Tracer() as tracer:
+        for _ in range(rounds):
+            for words in steps:
+                for w in words:
+                    kb.sm.feed((w,))
+                    step()
+    end = tracemalloc.take_snapshot().filter_traces(FILTERS)
+    tracemalloc.stop()
+    retained = sum(d.size_diff for d in end.compare_to(start, "filename"))
+
+    reports = usb_kb.reports_sent
+    cpython = tracer.cpython
+    print(f"steps: {len(steps) * rounds}, reports: {reports}, allocations: {len(tracer.found)}, "
+          f"retained: {retained} B (CPython only: {cpython['int']} boxed ints, "
+          f"{cpython['iter']} loop iterators)")
+    for where, op, size in tracer.found[:10]:
+        print(f"  {where} {op}: {f'{size} B' if size > 0 else 'from a free list'} allocated")
+    if tracer.found or retained:
+        print("FAIL: allocation on the keystroke path")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_check())
@@ -0,0 +1,342 @@
+"""
+Benchmarks for every stage of the PS/2 -> USB pipeline.
+
+Each stage runs over the synthetic typing corpora in tools/corpora
+(generated by corpus.py, not captured) and reports events per second:
+
+    decode      PS2Keyboard._decode_frame, per frame
+    parse       PS2Keyboard._process_scancode without emitting, per byte
+    emit        PS2Keyboard._emit: time stamp and event ring push, per key event
+    lookup      KEY_LUT lookup, per key event
+    update_key  PS2ToUSB.update_key (including flush_keys), per key event
+    send_keys   KeyboardInterface.send_keys report building, per key event
+    pipeline    FIFO word -> USB report end to end, per frame (host only)
+
+On the PC:
+
+    python3 tools/bench.py              # compare with tools/bench_baseline.json
+    python3 tools/bench.py --save       # store the current numbers as baseline
+
+exits with 1 if a stage is more than --threshold (default 25%) slower than
+its baseline. Baselines are per machine, re-save them after switching PCs.
+
+On the Pico: copy bench.py and the corpus files (to a `corpora` folder) next
+to the firmware, then `import bench; bench.run()`. Timings come from ticks_us.
+
+`bench.native()` (or --native on the PC) times each hot function plain and
+as the fastpath.py variant and prints the speedup. On the PC both run as
+bytecode, so expect about 1x there; the numbers that matter are the Pico's.
+
+    decode_frame      per frame
+    process_scancode  per byte
+    handle_frame      decode + parse, per frame
+    handle_events     KEY_LUT lookup + update_key, per key event
+    build_report      per report
+"""
+
+import sys
+import time
+from array import array
+
+try:
+    import host  # Only on the PC
+    host.install()
+    HOST = True
+except ImportError:
+    HOST = False
+
+from ps2_pio import PS2Keyboard, EV_EXTENDED, EV_PRESSED, encode_frame
+from keymap import KEY_LUT
+import main
+
+if HOST:
+    import os
+    CORPORA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpora")
+    BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+    def now_us():
+        return time.perf_counter_ns() // 1000
+
+    def elapsed_us(t0):
+        return now_us() - t0
+else:
+    CORPORA = "corpora"
+    BASELINE = None
+    now_us = time.ticks_us
+
+    def elapsed_us(t0):
+        return time.ticks_diff(time.ticks_us(), t0)
+
+CORPUS_NAMES = ("prose", "code", "gaming", "bursts")
+STAGES = ("decode", "parse", "emit", "lookup", "update_key", "send_keys", "pipeline")
+
+
+def load_corpus(name):
+    data = []
+    with open(CORPORA + "/" + name + ".ps2") as f:
+        for line in f:
+            line = line.split("#")[0]
+            data.extend(int(b, 16) for b in line.split())
+    return data
+
+
+class Corpus:
+    """A corpus with the input of every stage precomputed"""
+
+    def __init__(self, name, kb, usb_kb):
+        self.name = name
+        self.bytes = load_corpus(name)
+        self.frames = [encode_frame(b) for b in self.bytes]
+        self.words = [f << 10 for f in self.frames]
+
+        events = []
+        for b in self.bytes:
+            kb._process_scancode(b)
+            ev = kb.ring.pop()
+            if ev >= 0:
+                events.append((ev & 0xFF, bool(ev & EV_PRESSED), bool(ev & EV_EXTENDED)))
+        self.events = events
+        self.packed = array('I', [sc | pressed * EV_PRESSED | ext * EV_EXTENDED
+                                  for sc, pressed, ext in events])
+        self.indices = [sc | (ext << 8) for sc, _, ext in events]
+        self.actions = [(KEY_LUT[i], pressed) for i, (_, pressed, _) in zip(self.indices, events)
+                        if KEY_LUT[i] is not None]
+
+        # Key list handed to send_keys after each event
+        self.key_lists = []
+        for action, pressed in self.actions:
+            usb_kb.update_key(action, pressed)
+            keys = [-(1 << i) for i in range(8) if usb_kb.mods & (1 << i)]
+            keys += list(usb_kb.down[:usb_kb.n_down])
+            self.key_lists.append(keys)
+        usb_kb.release_all()
+
+
+def stage_decode(kb, usb_kb, c):
+    decode = kb._decode_frame
+    for f in c.frames:
+        decode(f)
+    return len(c.frames)
+
+
+def _no_emit(ev):
+    pass
+
+
+def stage_parse(kb, usb_kb, c):
+    # Parsing alone, as before the event ring: delivery is the emit stage
+    kb._emit = _no_emit
+    process = kb._process_scancode
+    for b in c.bytes:
+        process(b)
+    del kb._emit
+    return len(c.bytes)
+
+
+def stage_emit(kb, usb_kb, c):
+    emit = kb._emit
+    clear = kb.ring.clear
+    evs = c.packed
+    for i in range(0, len(evs), kb.ring.size):
+        for ev in evs[i:i + kb.ring.size]:
+            emit(ev)
+        clear()
+    return len(evs)
+
+
+def stage_lookup(kb, usb_kb, c):
+    lut = KEY_LUT
+    for i in c.indices:
+        lut[i]
+    return len(c.indices)
+
+
+def stage_update_key(kb, usb_kb, c):
+    update = usb_kb.update_key
+    for action, pressed in c.actions:
+        update(action, pressed)
+    usb_kb.release_all()
+    return len(c.actions)
+
+
+def stage_send_keys(kb, usb_kb, c):
+    send = usb_kb.send_keys
+    for keys in c.key_lists:
+        send(keys)
+    return len(c.key_lists)
+
+
+def stage_pipeline(kb, usb_kb, c):
+    feed = kb.sm.feed
+    poll = kb.poll
+    read_events = kb.read_events
+    handle_events = usb_kb.handle_events
+    buf = array('I', [0] * 8)
+    words = c.words
+    for i in range(0, len(words), 8):  # One joined RX FIFO worth per poll
+        feed(words[i:i + 8])
+        poll()
+        handle_events(buf, read_events(buf))
+    usb_kb.release_all()
+    return len(words)
+
+
+def stage_decode_frame(kb, usb_kb, c):
+    decode = kb.decode
+    for f in c.frames:
+        decode(f)
+    return len(c.frames)
+
+
+def stage_process_scancode(kb, usb_kb, c):
+    return stage_parse(kb, usb_kb, c)
+
+
+def stage_handle_frame(kb, usb_kb, c):
+    handle = kb.handle_frame
+    clear = kb.ring.clear
+    fs = c.frames
+    for i in range(0, len(fs), kb.ring.size):
+        for f in fs[i:i + kb.ring.size]:
+            handle(f)
+        clear()
+    return len(fs)
+
+
+def stage_handle_events(kb, usb_kb, c):
+    handle = usb_kb.handle_events
+    buf = c.packed
+    n = len(buf)
+    handle(buf, n)
+    usb_kb.release_all()
+    return n
+
+
+def stage_build_report(kb, usb_kb, c):
+    for code in (-0x02, 0x04, 0x16, 0x1A):
+        usb_kb._press(code)   # Left Shift + A, S, W held
+    build = usb_kb._build_report
+    r = bytearray(8)
+    for _ in c.key_lists:
+        build(r)
+    return len(c.key_lists)
+
+
+# Passes over the corpus per timed round: the PC is fast enough for a single
+# pass to be swamped by timer resolution and scheduling noise
+REPEAT = 20 if HOST else 1
+
+
+def run_stage(stage, kb, usb_kb, corpus, rounds):
+    fn = globals()["stage_" + stage]
+    best = None
+    for _ in range(rounds):
+        t0 = now_us()
+        n = 0
+        for _ in range(REPEAT):
+            n += fn(kb, usb_kb, corpus)
+        t = elapsed_us(t0)
+        if best is None or t < best:
+            best = t
+    return n, max(best, 1)
+
+
+def run(rounds=5, corpora=CORPUS_NAMES):
+    """Benchmark every stage, returns {corpus: {stage: events per second}}"""
+    usb_kb = main.PS2ToUSB()
+    kb = PS2Keyboard(0, 1)
+    results = {}
+    for name in corpora:
+        corpus = Corpus(name, kb, usb_kb)
+        results[name] = {}
+        print(f"{name}: {len(corpus.bytes)} bytes, {len(corpus.events)} key events")
+        for stage in STAGES:
+            if stage == "pipeline" and not HOST:
+                continue  # Needs a FIFO that can be fed
+            n, us = run_stage(stage, kb, usb_kb, corpus, rounds)
+            eps = n * 1_000_000 // us
+            results[name][stage] = eps
+            print(f"  {stage:<11}{us:>9} us {n:>6} ev {us / n:>8.2f} us/ev {eps:>10} ev/s")
+    return results
+
+
+NATIVE_FUNCS = ("decode_frame", "process_scancode", "handle_frame", "handle_events", "build_report")
+
+
+def native(rounds=5, corpora=CORPUS_NAMES):
+    """Plain vs fastpath.py variant of each hot function, returns {function: speedup}"""
+    import fastpath
+
+    class FastKeyboard(PS2Keyboard):
+        decode = staticmethod(fastpath.decode_frame)
+
+    class FastUSB(main.PS2ToUSB):
+        pass
+
+    fastpath.install(FastKeyboard, FastUSB)
+    kbs = (PS2Keyboard(0, 1), FastKeyboard(0, 1))
+    kbs[0].decode = kbs[0]._decode_frame
+    usb_kbs = (main.PS2ToUSB(), FastUSB())
+
+    totals = {f: [0, 0] for f in NATIVE_FUNCS}
+    for name in corpora:
+        corpus = Corpus(name, kbs[0], usb_kbs[0])
+        print(f"{name}:")
+        for func in NATIVE_FUNCS:
+            us = []
+            for kb, usb_kb in zip(kbs, usb_kbs):
+                n, t = run_stage(func, kb, usb_kb, corpus, rounds)
+                us.append(t / n)
+            totals[func][0] += us[0]
+            totals[func][1] += us[1]
+            print(f"  {func:<17}plain {us[0]:>7.2f} us/ev  native {us[1]:>7.2f} us/ev  {us[0] / us[1]:>5.2f}x")
+    speedups = {f: plain / fast for f, (plain, fast) in totals.items()}
+    print("speedup: " + ", ".join(f"{f} {x:.2f}x" for f, x in speedups.items()))
+    return speedups
+
+
+def compare(results, baseline, threshold):
+    regressions = 0
+    for name, stages in results.items():
+        for stage, eps in stages.items():
+            ref = baseline.get(name, {}).get(stage)
+            if not ref:
+                continue
+            change = eps / ref - 1
+            if change < -threshold:
+                regressions += 1
+                print(f"REGRESSION {name}/{stage}: {eps} ev/s vs baseline {ref} ({change:+.0%})")
+    return regressions
+
+
+def cli():
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--save", action="store_true", help="store results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown (0.25 = 25%%)")
+    parser.add_argument("--rounds", type=int, default=5, help="best of N runs per stage")
+    parser.add_argument("--corpus", action="append", choices=CORPUS_NAMES, help="limit to these corpora")
+    parser.add_argument("--native", action="store_true", help="plain vs fastpath.py per function instead")
+    args = parser.parse_args()
+
+    if args.native:
+        native(args.rounds, args.corpus or CORPUS_NAMES)
+        return 0
+    results = run(args.rounds, args.corpus or CORPUS_NAMES)
+    if args.save:
+        with open(BASELINE, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("Baseline saved to " + BASELINE)
+        return 0
+    if not os.path.exists(BASELINE):
+        print("No baseline yet, run with --save")
+        return 0
+    with open(BASELINE) as f:
+        baseline = json.load(f)
+    return 1 if compare(results, baseline, args.threshold) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(cli() if HOST else run())
@@ -0,0 +1,161 @@
+"""
+Boot sequence of main.py on the host: reset -> ready, and keys typed during it.
+
+    python3 tools/boot_sim.py                      # exit 1 on failure
+    python3 tools/boot_sim.py --usb-ms 200 --bat-ms 700 --type-ms 100
+    python3 tools/boot_sim.py --no-bat --type-ms 50
+
+Runs main.main() on the host shims from a simulated reset (ticks_ms = 0).
+The host configures the USB device --usb-ms after usb.device init, the
+keyboard sends its self-test result at --bat-ms and a word is typed from
+--type-ms on, one key every 40 ms, while the converter is still booting.
+Every key must reach the host, in order, once it is ready. --no-bat is a
+keyboard that was already powered and sends no self-test.
+
+The old sequence (a 1 s sleep, then usb.device init, then is_open() polled
+once a second, then PS/2 set up) is computed for the same timings, with
+the keys it would have lost.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import host
+
+host.install()
+
+import usb.device
+from ps2_constants import PS2
+from corpus import make, brk
+from telemetry import COUNTERS, T_USB_MS, T_BAT_MS, T_READY_MS, T_REPLAYED
+import main
+
+WORD = "boot"
+USAGES = {"b": 0x05, "o": 0x12, "t": 0x17}
+
+
+class Rig:
+    def __init__(self, args):
+        self.args = args
+        self.kb = None
+        self.usb_kb = None
+        self.typed_ms = []
+        rig = self
+
+        class Keyboard(main.PS2Keyboard):
+            def __init__(self, *a, **kw):
+                super().__init__(*a, **kw)
+                rig.kb = self
+
+        main.PS2Keyboard = Keyboard
+        device = usb.device.get()
+        init = device.init
+
+        def enumerate_later(*itfs, **kw):
+            init(*itfs, **kw)
+            rig.usb_kb = itfs[0]
+            rig.usb_kb.report_log = []
+            for itf in itfs:
+                itf._open = False
+            loop = asyncio.get_running_loop()
+            for itf in itfs:
+                loop.call_later(args.usb_ms / 1000, itf.on_open)
+
+        device.init = enumerate_later
+
+    async def keyboard(self):
+        a = self.args
+        if not a.no_bat:
+            asyncio.create_task(self.bat(a.bat_ms))
+        t = a.type_ms
+        for ch in WORD:
+            await self.at(t)
+            key = getattr(PS2, ch.upper())
+            self.feed(make(key))
+            self.typed_ms.append(host.ticks_ms())
+            await self.at(t + 20)
+            self.feed(brk(key))
+            t += 40
+
+    async def bat(self, ms):
+        await self.at(ms)
+        self.feed([0xAA])
+
+    async def at(self, ms):
+        await asyncio.sleep(max(ms - host.ticks_ms(), 0) / 1000)
+
+    def feed(self, data):
+        if self.kb:   # Frames before PS/2 capture starts are lost on the line
+            self.kb.sm.feed(host.encode_bytes(data))
+
+    def typed(self):
+        """Characters the host saw, from the report log"""
+        out, down = [], set()
+        names = {v: k for k, v in USAGES.items()}
+        for r in self.usb_kb.report_log if self.usb_kb else []:
+            keys = {k for k in r[2:] if k}
+            out += [names.get(k, "?") for k in sorted(keys - down)]
+            down = keys
+        return "".join(out)
+
+
+def old_sequence(args):
+    """Ready time and keys lost with the 1 s sleep and 1 s polling"""
+    init = 1000
+    ready = init
+    while ready < init + args.usb_ms:
+        ready += 1000
+    typed = [args.type_ms + 40 * i for i in range(len(WORD))]
+    return ready, sum(1 for t in typed if t < ready)
+
+
+async def run(args):
+    rig = Rig(args)
+    main.ZERO_ALLOC = False   # gc.threshold is MicroPython only
+    host._T0 = time.monotonic_ns()   # Reset
+    COUNTERS[T_READY_MS] = 0
+    task = asyncio.create_task(main.main())
+    kb_task = asyncio.create_task(rig.keyboard())
+    t = time.monotonic()
+    while (not COUNTERS[T_READY_MS] or not kb_task.done() or len(rig.typed()) < len(WORD)) \
+            and time.monotonic() - t < 5:
+        await asyncio.sleep(0.005)
+    await asyncio.sleep(0.05)
+    task.cancel()
+    kb_task.cancel()
+
+    typed = rig.typed()
+    ready = COUNTERS[T_READY_MS]
+    expect = max(args.usb_ms, 0 if args.no_bat else args.bat_ms)
+    if args.no_bat and args.type_ms > args.usb_ms:
+        expect = max(expect, main.BAT_WAIT_MS)   # No self-test and no key yet
+    before = sum(1 for t in rig.typed_ms if t < ready)
+    bat = COUNTERS[T_BAT_MS]
+    ok = typed == WORD and ready and abs(ready - expect) < 100
+    ok &= bat == 0 if args.no_bat else abs(bat - args.bat_ms) < 50
+    print(f"usb configured at {COUNTERS[T_USB_MS]} ms, self-test at {COUNTERS[T_BAT_MS]} ms, "
+          f"ready at {ready} ms (expected ~{expect})")
+    print(f"{len(WORD)} keys typed from {args.type_ms} ms ({before} before ready), "
+          f"{COUNTERS[T_REPLAYED]} events replayed, host got {typed!r}: {'ok' if ok else 'FAIL'}")
+    old_ready, lost = old_sequence(args)
+    print(f"old sequence: ready at {old_ready} ms, {lost} of {len(WORD)} keys lost")
+    return ok
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--usb-ms", type=int, default=900, help="init -> configured by the host")
+    parser.add_argument("--bat-ms", type=int, default=500, help="reset -> keyboard self-test")
+    parser.add_argument("--type-ms", type=int, default=550, help="first key pressed")
+    parser.add_argument("--no-bat", action="store_true", help="keyboard was already powered")
+    args = parser.parse_args()
+    os.chdir(tempfile.mkdtemp())   # main() opens its log store in the current directory
+    return 0 if asyncio.run(run(args)) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
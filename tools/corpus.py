@@ -0,0 +1,167 @@
+"""
+Synthetic PS/2 typing corpora: byte streams as a Set 2 keyboard would send
+them, generated here rather than captured from a keyboard.
+
+Corpus files (tools/corpora/*.ps2) hold whitespace separated hex bytes, one
+keystroke group per line, '#' starts a comment. They are generated from the
+text and chord scripts below with scripted key overlap (the next key goes
+down before the previous one is released) and committed, so benchmark runs
+compare like with like. Real typing, with its timing, comes from a trace
+captured on the Pico (ps2_trace.py, tools/replay.py). Regenerate with:
+
+    python3 tools/corpus.py
+"""
+
+import os
+import sys
+
+import host
+
+host.install()
+
+from ps2_constants import PS2
+
+CORPORA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpora")
+
+PAUSE = [0xE1, 0x14, 0x77, 0xE1, 0xF0, 0x14, 0xF0, 0x77]
+PRINTSCR_MAKE = [0xE0, 0x12, 0xE0, 0x7C]
+PRINTSCR_BREAK = [0xE0, 0xF0, 0x7C, 0xE0, 0xF0, 0x12]
+
+
+def make(key):
+    sc, ext = key
+    return [0xE0, sc] if ext else [sc]
+
+
+def brk(key):
+    sc, ext = key
+    return [0xE0, 0xF0, sc] if ext else [0xF0, sc]
+
+
+def tap(*keys):
+    # Press keys in order, release in reverse (chords, modifiers)
+    seq = []
+    for k in keys: seq += make(k)
+    for k in reversed(keys): seq += brk(k)
+    return seq
+
+
+# US layout: character -> (key, shifted)
+_PLAIN = {
+    " ": PS2.SPACE, "\n": PS2.ENTER, "\t": PS2.TAB,
+    "-": PS2.MINUS, "=": PS2.EQUAL, "[": PS2.L_BRACKET, "]": PS2.R_BRACKET,
+    "\\": PS2.BACKSLASH, ";": PS2.SEMICOLON, "'": PS2.QUOTE, "`": PS2.GRAVE,
+    ",": PS2.COMMA, ".": PS2.DOT, "/": PS2.SLASH,
+}
+_SHIFTED = {
+    "_": PS2.MINUS, "+": PS2.EQUAL, "{": PS2.L_BRACKET, "}": PS2.R_BRACKET,
+    "|": PS2.BACKSLASH, ":": PS2.SEMICOLON, '"': PS2.QUOTE, "~": PS2.GRAVE,
+    "<": PS2.COMMA, ">": PS2.DOT, "?": PS2.SLASH,
+    "!": PS2.N1, "@": PS2.N2, "#": PS2.N3, "$": PS2.N4, "%": PS2.N5,
+    "^": PS2.N6, "&": PS2.N7, "*": PS2.N8, "(": PS2.N9, ")": PS2.N0,
+}
+
+
+def char_key(c):
+    if c.isalpha():
+        return getattr(PS2, c.upper()), c.isupper()
+    if c.isdigit():
+        return getattr(PS2, "N" + c), False
+    if c in _SHIFTED:
+        return _SHIFTED[c], True
+    return _PLAIN[c], False
+
+
+def type_text(text):
+    """One group per character, overlapping each key with the next one"""
+    groups = []
+    shift = False
+    held = None
+    for c in text:
+        key, shifted = char_key(c)
+        seq = []
+        if shifted and not shift:
+            seq += make(PS2.L_SHIFT)
+        seq += make(key)
+        if held is not None:
+            seq += brk(held)  # Rollover: previous key released after this press
+        if shift and not shifted:
+            seq += brk(PS2.L_SHIFT)
+        shift = shifted
+        held = key
+        groups.append(seq)
+    if held is not None:
+        groups.append(brk(held) + (brk(PS2.L_SHIFT) if shift else []))
+    return groups
+
+
+PROSE = """The converter reads every frame from the keyboard, decodes it and \
+sends a report to the host. Typing this sentence at eighty words per minute \
+means roughly seven keys a second, with two or three of them held at once. \
+Numbers like 1984, 2024 and 3.14 show up too, as do quotes: "hello", isn't it?
+"""
+
+CODE = """def flush_keys(self):
+\tif not self.is_open(): return
+\tr, s = self._key_reports
+\tself._build_report(r)
+\tif r != s and self.send_report(r):
+\t\tself._key_reports[0] = s  # swap {ping, pong}
+\tlog(f"sent: {r[2]:#x} | mods={self.mods & 0xFF}")
+"""
+
+
+def gaming():
+    groups = []
+    for _ in range(20):
+        groups.append(make(PS2.W))
+        groups.append(make(PS2.L_SHIFT))
+        groups.append(make(PS2.A) + make(PS2.SPACE))
+        groups.append(brk(PS2.SPACE) + brk(PS2.A))
+        groups.append(tap(PS2.E))
+        groups.append(make(PS2.D) + make(PS2.L_CTRL))
+        groups.append(tap(PS2.N1) + tap(PS2.R))
+        groups.append(brk(PS2.L_CTRL) + brk(PS2.D) + brk(PS2.L_SHIFT))
+        groups.append(brk(PS2.W))
+        groups.append(tap(PS2.W, PS2.A, PS2.S, PS2.D, PS2.SPACE, PS2.L_SHIFT, PS2.Q))  # > 6 keys
+    return groups
+
+
+def bursts():
+    groups = []
+    for _ in range(20):
+        groups.append(PAUSE)
+        groups.append(PRINTSCR_MAKE)
+        groups.append(PRINTSCR_BREAK)
+        groups += [tap(k) for k in (PS2.UP, PS2.DOWN, PS2.LEFT, PS2.RIGHT, PS2.HOME, PS2.END)]
+        groups.append(tap(PS2.R_CTRL, PS2.R_ALT, PS2.DELETE))
+        groups.append(tap(PS2.KP_SLASH) + tap(PS2.KP_ENTER))
+    return groups
+
+
+CORPUS_SOURCES = {
+    "prose": lambda: type_text(PROSE * 3),
+    "code": lambda: type_text(CODE * 4),
+    "gaming": gaming,
+    "bursts": bursts,
+}
+
+
+def write(name, groups):
+    path = os.path.join(CORPORA, name + ".ps2")
+    with open(path, "w") as f:
+        f.write(f"# {name}: {sum(map(len, groups))} bytes, synthetic: generated by tools/corpus.py, not captured\n")
+        for g in groups:
+            f.write(" ".join(f"{b:02X}" for b in g) + "\n")
+    return path
+
+
+def main():
+    os.makedirs(CORPORA, exist_ok=True)
+    for name, source in CORPUS_SOURCES.items():
+        print(write(name, source()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
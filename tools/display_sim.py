@@ -0,0 +1,145 @@
+"""
+SSD1306 display update cost, simulated on a fake I2C bus.
+
+    python3 tools/display_sim.py            # dirty spans, 32 byte chunks
+    python3 tools/display_sim.py --full     # naive: whole 1 KB frame per redraw
+
+A StatusDisplay is fed state changes much faster than it redraws (a key
+rate counter, lock flips, an error counter) while a 1 ms task stands in
+for the event pump and records how late it wakes up. The fake bus blocks
+for the real transfer time at --khz and emulates the controller's RAM, so
+the result is checked pixel for pixel against the framebuffer at the end.
+Exits with 1 if the panel content is wrong or a single I2C write (during
+which nothing else can run) takes longer than --max-write-ms. The loop lag
+figures include the PC's own scheduling jitter.
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+import host
+
+host.install()
+
+from machine import I2C
+import display
+
+# Commands followed by one argument byte (0x21/0x22 are handled separately)
+_ONE_ARG = (0x20, 0x81, 0xA8, 0xD3, 0xD5, 0xD9, 0xDA, 0xDB, 0x8D)
+
+
+class FakeSSD1306(I2C):
+    """I2C bus with an SSD1306 in horizontal addressing mode on it"""
+
+    def __init__(self, width=128, height=64, **kwargs):
+        super().__init__(**kwargs)
+        self.width = width
+        self.pages = height // 8
+        self.ram = bytearray(self.pages * width)
+        self.col = (0, width - 1)
+        self.page = (0, self.pages - 1)
+        self.x = self.p = 0
+
+    def on_write(self, data):
+        if data[0] == 0x40:
+            for b in data[1:]:
+                self.ram[self.p * self.width + self.x] = b
+                self.x += 1
+                if self.x > self.col[1]:
+                    self.x = self.col[0]
+                    self.p = self.p + 1 if self.p < self.page[1] else self.page[0]
+            return
+        i = 1
+        while i < len(data):
+            c = data[i]
+            if c == 0x21:
+                self.col = (data[i + 1], data[i + 2])
+                self.x = self.col[0]
+                i += 3
+            elif c == 0x22:
+                self.page = (data[i + 1], data[i + 2])
+                self.p = self.page[0]
+                i += 3
+            else:
+                i += 2 if c in _ONE_ARG else 1
+
+
+async def scenario(args):
+    bus = FakeSSD1306(freq=args.khz * 1000)
+    oled = display.SSD1306(bus)
+    status = display.StatusDisplay(oled, period_ms=args.period)
+    if args.full:
+        # Naive driver: the whole frame in one blocking write per redraw
+        async def show_full(busy=None):
+            bus.writeto(oled.addr, bytes((0x00, 0x21, 0, oled.width - 1, 0x22, 0, oled.pages - 1)))
+            bus.writevto(oled.addr, (b"\x40", oled.buffer))
+            for p in range(oled.pages):
+                oled.x0[p] = 0xFF
+        oled.show = show_full
+    else:
+        show = oled.show
+        oled.show = lambda busy=None: show(chunk=args.chunk, busy=busy)
+    bus.sleep = True
+
+    lags = []
+    updates = 0
+    done = False
+
+    async def pump():
+        # Stand-in for main.event_pump waking up for key events
+        while not done:
+            t = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append((time.perf_counter() - t) * 1000 - 1)
+
+    async def typist():
+        nonlocal updates
+        end = time.monotonic() + args.seconds
+        n = 0
+        while time.monotonic() < end:
+            n += 1
+            status.set(0, "PS2>USB  READY")
+            status.set(1, "NUM CAPS" if n // 50 % 2 else "NUM ----")
+            status.set(2, f"{n % 17 * 7:3} keys/s")
+            status.set(3, f"frames {n * 3}")
+            updates += 1
+            await asyncio.sleep(args.update_ms / 1000)
+
+    tasks = [asyncio.create_task(pump()), asyncio.create_task(status.run())]
+    await typist()
+    await asyncio.sleep(2 * args.period / 1000)  # Let the last redraw finish
+    done = True
+    tasks[1].cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    lags.sort()
+    worst = lags[-1]
+    ok = bus.ram == oled.buffer
+    print(f"{'full frame' if args.full else f'dirty spans, {args.chunk} B chunks'} at {args.khz} kHz")
+    print(f"  {updates} state updates -> {status.redraws} redraws "
+          f"({updates / max(status.redraws, 1):.1f} updates per redraw)")
+    print(f"  {bus.bytes} bytes in {bus.writes} writes, {bus.bytes / max(status.redraws, 1):.0f} B "
+          f"and {bus.bus_us / 1000 / max(status.redraws, 1):.2f} ms bus time per redraw, "
+          f"longest write {bus.max_write_us / 1000:.2f} ms")
+    print(f"  event loop lag: p50 {lags[len(lags) // 2]:.2f}  p99 {lags[len(lags) * 99 // 100]:.2f}  "
+          f"max {worst:.2f} ms")
+    print(f"  panel matches framebuffer: {'yes' if ok else 'NO'}")
+    return 0 if ok and bus.max_write_us <= args.max_write_ms * 1000 else 1
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--full", action="store_true", help="push the whole frame on every redraw")
+    parser.add_argument("--chunk", type=int, default=32, help="bytes per I2C write")
+    parser.add_argument("--khz", type=int, default=400, help="I2C clock")
+    parser.add_argument("--period", type=int, default=100, help="StatusDisplay period (ms)")
+    parser.add_argument("--update-ms", type=float, default=5, help="time between state changes")
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--max-write-ms", type=float, default=1, help="fail above this single write time")
+    return asyncio.run(scenario(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,200 @@
+"""
+Native/viper hot path (fastpath.py) against the plain methods it replaces.
+
+    python3 tools/fastpath_check.py         # exit 1 on any difference
+
+Under CPython the decorators are no-ops (tools/host.py), so this checks the
+rewritten logic, not the compiled code; run `bench.native()` on the Pico
+for the latter's timings. A PS2Keyboard and a PS2ToUSB subclass get the
+fastpath variants installed and run side by side with the plain classes:
+
+decode: every data byte with good and bad parity, start and stop bit
+errors, the timeout word and random words. Same byte, same error counted.
+
+frames: the corpora, Pause and PrintScreen sequences and random byte
+streams with bad frames and self-test results mixed in, frame by frame.
+Same events, stats, resyncs and parser state.
+
+events: the decoded corpora and unknown codes through handle_events. Same
+reports and unknown key count. build_report over random key states.
+"""
+
+import argparse
+import random
+import sys
+from array import array
+
+import host
+
+host.install()
+
+import ps2_pio
+from ps2_pio import PS2Keyboard, encode_frame, STAT_NAMES
+from corpus import CORPORA, PAUSE, PRINTSCR_MAKE, PRINTSCR_BREAK
+from telemetry import COUNTERS, T_UNKNOWN
+import fastpath
+import main
+
+
+class FastKeyboard(PS2Keyboard):
+    pass
+
+
+class FastUSB(main.PS2ToUSB):
+    pass
+
+
+fastpath.install(FastKeyboard, FastUSB)
+
+
+def load(name):
+    data = []
+    with open(f"{CORPORA}/{name}.ps2") as f:
+        for line in f:
+            data.extend(int(b, 16) for b in line.split("#")[0].split())
+    return data
+
+
+def constants():
+    pairs = [
+        ("_START_BIT", ps2_pio._START_BIT), ("_STOP_BIT", ps2_pio._STOP_BIT),
+        ("_TIMEOUT_WORD", ps2_pio._TIMEOUT_WORD), ("_EV_EXTENDED", ps2_pio.EV_EXTENDED),
+        ("_EV_PRESSED", ps2_pio.EV_PRESSED), ("_BAT_OK", ps2_pio.BAT_OK),
+        ("_BAT_FAIL", ps2_pio.BAT_FAIL), ("_REPORT_KEYS", main.REPORT_KEYS),
+        ("_ROLLOVER", main.ROLLOVER),
+        ("_ERR_START", -1 - ps2_pio.STAT_START_ERR), ("_ERR_STOP", -1 - ps2_pio.STAT_STOP_ERR),
+        ("_ERR_PARITY", -1 - ps2_pio.STAT_PARITY_ERR), ("_ERR_TIMEOUT", -1 - ps2_pio.STAT_TIMEOUT),
+    ]
+    bad = [name for name, value in pairs if getattr(fastpath, name) != value]
+    print(f"constants: {len(pairs)} copies match ps2_pio/main: {'ok' if not bad else 'FAIL ' + ', '.join(bad)}")
+    return not bad
+
+
+def decode(rng, n):
+    kb = PS2Keyboard(0, 1)
+    words = [ps2_pio._TIMEOUT_WORD]
+    for b in range(256):
+        f = encode_frame(b)
+        words += [f, encode_frame(b, True), f | ps2_pio._START_BIT, f & ~ps2_pio._STOP_BIT]
+    words += [rng.getrandbits(22) for _ in range(n)]
+    diffs = 0
+    for w in words:
+        before = list(kb.stats)
+        plain = kb._decode_frame(w)
+        fast = fastpath.decode_frame(w)
+        if plain is None:
+            counted = [i for i, (a, b) in enumerate(zip(before, kb.stats)) if a != b]
+            same = counted == [-1 - fast]
+        else:
+            same = fast == plain
+        if not same:
+            diffs += 1
+            if diffs <= 5:
+                print(f"  {w:06x}: plain {plain}, fast {fast}")
+    print(f"decode: {len(words)} words: {'ok' if not diffs else f'FAIL ({diffs} differ)'}")
+    return not diffs
+
+
+def events(kb):
+    out = []
+    while True:
+        ev = kb.ring.pop()
+        if ev < 0:
+            return out
+        out.append(ev & 0x3FF)   # Without the timestamp
+
+
+def state(kb):
+    return (list(kb.stats), kb.bad_frames, kb.pause_state, kb.extended, kb.break_code, kb.bat)
+
+
+def frames(rng, n):
+    streams = {name: load(name) for name in ("prose", "code", "gaming", "bursts")}
+    streams["pause/printscreen"] = (PAUSE + PRINTSCR_MAKE + PRINTSCR_BREAK) * 4 + PAUSE[:5] + PAUSE
+    streams["random"] = [rng.choice((0xE0, 0xE1, 0xF0, 0x12, 0x14, 0x77, 0x7C, 0xAA, rng.randrange(256)))
+                         for _ in range(n)]
+    ok = True
+    for name, data in streams.items():
+        words = []
+        for b in data:
+            words.append(encode_frame(b))
+            if name == "random" and rng.random() < 0.05:
+                # Bad frames, sometimes enough in a row to resync
+                words += [rng.getrandbits(22) | ps2_pio._START_BIT] * rng.randrange(1, 4)
+        plain, fast = PS2Keyboard(0, 1), FastKeyboard(0, 1)
+        plain_evs, fast_evs = [], []
+        same = True
+        for i, w in enumerate(words):
+            plain.handle_frame(w)
+            fast.handle_frame(w)
+            plain_evs += events(plain)
+            fast_evs += events(fast)
+            if state(plain) != state(fast):
+                same = False
+                print(f"  {name}: parser state differs after frame {i}: {state(plain)} vs {state(fast)}")
+                break
+        same &= plain_evs == fast_evs
+        ok &= same
+        resyncs = plain.stats[STAT_NAMES.index("resync")]
+        print(f"frames {name}: {len(words)} frames, {len(plain_evs)} events, {resyncs} resyncs: "
+              f"{'ok' if same else 'FAIL'}")
+    return ok
+
+
+def reports(rng):
+    packed = []
+    kb = PS2Keyboard(0, 1)
+    for name in ("prose", "code", "gaming", "bursts"):
+        for b in load(name):
+            kb._process_scancode(b)
+            packed += events(kb)
+    # Codes without a mapping, pressed and released
+    packed += [0x00 | ps2_pio.EV_PRESSED, 0x00, 0x60 | ps2_pio.EV_EXTENDED | ps2_pio.EV_PRESSED]
+    buf = array('I', packed)
+
+    logs, unknown = [], []
+    for cls in (main.PS2ToUSB, FastUSB):
+        usb_kb = cls()
+        usb_kb.report_log = []
+        n = COUNTERS[T_UNKNOWN]
+        for i in range(0, len(buf), 8):
+            chunk = buf[i:i + 8]
+            usb_kb.handle_events(chunk, len(chunk))
+        unknown.append(COUNTERS[T_UNKNOWN] - n)
+        logs.append(usb_kb.report_log)
+    ok = logs[0] == logs[1] and unknown[0] == unknown[1] == 3
+    print(f"events: {len(buf)} events, {len(logs[0])} reports, {unknown[0]} unknown: "
+          f"{'ok' if ok else 'FAIL'}")
+
+    plain, fast = main.PS2ToUSB(), FastUSB()
+    r, s = bytearray(8), bytearray(8)
+    diffs = 0
+    for _ in range(2000):
+        n = rng.randrange(main.MAX_DOWN + 1)
+        mods = rng.randrange(256)
+        codes = bytes(rng.randrange(4, 232) for _ in range(main.MAX_DOWN))
+        for kb in (plain, fast):
+            kb.mods, kb.n_down, kb.down[:] = mods, n, codes
+        r[:] = s[:] = bytes(rng.randrange(256) for _ in range(8))   # Stale contents
+        plain._build_report(r)
+        fast._build_report(s)
+        diffs += r != s
+    print(f"build_report: 2000 key states: {'ok' if not diffs else f'FAIL ({diffs} differ)'}")
+    return ok and not diffs
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--random", type=int, default=100_000, help="random frame words / bytes")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    ok = constants()
+    ok &= decode(rng, args.random)
+    ok &= frames(rng, args.random // 10)
+    ok &= reports(rng)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,41 @@
+"""
+hidraw helpers shared by the tools that talk to a connected converter
+(stats.py, latency.py, push.py; Linux only).
+
+An interface is found by USB VID:PID and the start of its report
+descriptor, which tells the converter's HID interfaces apart:
+
+    KEYBOARD_RDESC   boot keyboard (05 01 09 06)
+    TELEMETRY_RDESC  telemetry.py vendor page, usage 1
+    REMAP_RDESC      remap.py vendor page, usage 0x10
+"""
+
+import glob
+import os
+
+KEYBOARD_RDESC = b"\x05\x01\x09\x06"
+TELEMETRY_RDESC = b"\x06\x00\xFF\x09\x01"
+REMAP_RDESC = b"\x06\x00\xFF\x09\x10"
+
+
+def HIDIOCSFEATURE(length):
+    return (3 << 30) | (length << 16) | (ord("H") << 8) | 0x06
+
+
+def HIDIOCGFEATURE(length):
+    return (3 << 30) | (length << 16) | (ord("H") << 8) | 0x07
+
+
+def find_device(vid, pid, rdesc):
+    """The /dev/hidrawN node of the interface whose report descriptor starts with rdesc, or None"""
+    for node in sorted(glob.glob("/sys/class/hidraw/hidraw*")):
+        try:
+            with open(node + "/device/uevent") as f:
+                uevent = f.read()
+            with open(node + "/device/report_descriptor", "rb") as f:
+                start = f.read(len(rdesc))
+        except OSError:
+            continue
+        if f"HID_ID=0003:{vid:08X}:{pid:08X}" in uevent and start == rdesc:
+            return "/dev/" + os.path.basename(node)
+    return None
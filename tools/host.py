@@ -0,0 +1,439 @@
+"""
+Host (CPython) stand-ins for the MicroPython modules the firmware imports.
+
+Call install() before importing any firmware module. Only what the converter
+actually touches is provided: enough to run the decoding and report path on
+a PC, not to emulate the board.
+"""
+
+import asyncio
+import builtins
+import importlib.util
+import os
+import sys
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_T0 = time.monotonic_ns()
+_TICKS_PERIOD = 1 << 30
+
+
+# --- time: MicroPython ticks API ---
+
+def ticks_us():
+    return ((time.monotonic_ns() - _T0) // 1000) & (_TICKS_PERIOD - 1)
+
+def ticks_ms():
+    return ((time.monotonic_ns() - _T0) // 1000000) & (_TICKS_PERIOD - 1)
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & (_TICKS_PERIOD - 1)
+
+def ticks_diff(a, b):
+    return ((a - b + _TICKS_PERIOD // 2) & (_TICKS_PERIOD - 1)) - _TICKS_PERIOD // 2
+
+
+# --- micropython ---
+
+def _identity(f):
+    return f
+
+def _make_micropython():
+    m = types.ModuleType("micropython")
+    m.const = _identity
+    m.native = _identity
+    m.viper = _identity
+    m.schedule = lambda f, arg: f(arg)
+    m.alloc_emergency_exception_buf = lambda n: None
+    return m
+
+
+# --- machine ---
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode=-1, pull=-1, value=1):
+        self.id = id
+        self._value = value
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        self._value = v
+
+    def toggle(self):
+        self._value ^= 1
+
+    def irq(self, handler=None, trigger=0, hard=False):
+        self.handler = handler
+
+
+class _Mem32:
+    """Peripheral registers: reads as 0, writes are ignored"""
+
+    def __getitem__(self, addr):
+        return 0
+
+    def __setitem__(self, addr, value):
+        pass
+
+
+class I2C:
+    """
+    Counts bytes and bus time (9 clocks per byte plus the address byte).
+    With sleep=True each write also blocks for that long, like the real
+    bus does, so its effect on the event loop can be measured.
+    """
+
+    def __init__(self, id=0, scl=None, sda=None, freq=400_000):
+        self.freq = freq
+        self.sleep = False
+        self.bytes = 0
+        self.writes = 0
+        self.bus_us = 0
+        self.max_write_us = 0
+
+    def _transfer(self, n):
+        us = (n + 1) * 9 * 1_000_000 // self.freq
+        self.bytes += n
+        self.writes += 1
+        self.bus_us += us
+        self.max_write_us = max(self.max_write_us, us)
+        if self.sleep:
+            time.sleep(us / 1_000_000)
+
+    def writeto(self, addr, buf, stop=True):
+        self._transfer(len(buf))
+        self.on_write(bytes(buf))
+        return 1
+
+    def writevto(self, addr, vector, stop=True):
+        data = b"".join(bytes(b) for b in vector)
+        self._transfer(len(data))
+        self.on_write(data)
+        return 1
+
+    def on_write(self, data):
+        pass  # Override to emulate the device
+
+
+class WDT:
+    """Records feeds; expired() tells whether the real one would have reset"""
+
+    def __init__(self, id=0, timeout=5000):
+        self.timeout = timeout
+        self.feeds = 0
+        self.last = time.monotonic()
+
+    def feed(self):
+        self.feeds += 1
+        self.last = time.monotonic()
+
+    def expired(self):
+        return (time.monotonic() - self.last) * 1000 > self.timeout
+
+
+_FREQ = [125_000_000]
+
+
+def _freq(hz=None):
+    if hz is None:
+        return _FREQ[0]
+    _FREQ[0] = hz
+
+
+def _make_machine():
+    m = types.ModuleType("machine")
+    m.Pin = Pin
+    m.I2C = I2C
+    m.WDT = WDT
+    m.mem32 = _Mem32()
+    m.freq = _freq
+    return m
+
+
+# --- rp2 ---
+
+class PIO:
+    SHIFT_LEFT = 0
+    SHIFT_RIGHT = 1
+    JOIN_NONE = 0
+    JOIN_TX = 1
+    JOIN_RX = 2
+
+
+class StateMachine:
+    """PIO state machine whose RX FIFO is filled from the host with feed()"""
+
+    FIFO_SIZE = 1024  # Preallocated ring, so draining it never allocates
+
+    def __init__(self, id, program=None, freq=-1, **kwargs):
+        self.id = id
+        self.fifo = [0] * self.FIFO_SIZE
+        self.tx = []
+        self.inits = 0
+        self.program = None
+        if program is not None:
+            self.init(program, freq, **kwargs)
+
+    def init(self, program, freq=-1, **kwargs):
+        self.program = program
+        self.freq = freq
+        self.kwargs = kwargs
+        self.head = 0
+        self.count = 0
+        self.tx.clear()
+        self.inits += 1
+
+    def active(self, value=None):
+        return 1
+
+    def restart(self):
+        pass
+
+    def feed(self, words):
+        for w in words:
+            if self.count == self.FIFO_SIZE:
+                raise OverflowError("host RX FIFO full")
+            self.fifo[(self.head + self.count) % self.FIFO_SIZE] = w
+            self.count += 1
+
+    def rx_fifo(self):
+        return self.count
+
+    def get(self, buf=None, shift=0):
+        word = self.fifo[self.head]
+        self.head = (self.head + 1) % self.FIFO_SIZE
+        self.count -= 1
+        return word >> shift
+
+    def put(self, value, shift=0):
+        if getattr(self.program, "config", {}).get("fifo_join") == PIO.JOIN_RX:
+            # No TX FIFO: on the RP2040 put() would block forever
+            raise RuntimeError(f"{self.program.__name__}: put() with JOIN_RX")
+        self.tx.append(value << shift)
+
+
+class PIOProgram:
+    """What rp2.asm_pio returns on the host: the program function and its
+    configuration, assembled on demand by tools/pio_emu.py"""
+
+    def __init__(self, func, config):
+        self.func = func
+        self.config = config
+        self.__name__ = func.__name__
+
+
+def _make_rp2():
+    m = types.ModuleType("rp2")
+
+    m.PIO = PIO
+    m.StateMachine = StateMachine
+    m.asm_pio = lambda **config: lambda func: PIOProgram(func, config)
+    return m
+
+
+# --- uasyncio ---
+
+class ThreadSafeFlag:
+    """uasyncio.ThreadSafeFlag on an asyncio.Event (set() from the loop thread only)"""
+
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    def set(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+
+# --- framebuf ---
+
+class FrameBuffer:
+    """MONO_VLSB only. text() draws a stand-in glyph per character (not the real font)."""
+
+    def __init__(self, buf, width, height, format):
+        self.buf = buf
+        self.width = width
+        self.height = height
+
+    def pixel(self, x, y, c=None):
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return 0 if c is None else None
+        i = (y >> 3) * self.width + x
+        bit = 1 << (y & 7)
+        if c is None:
+            return 1 if self.buf[i] & bit else 0
+        if c:
+            self.buf[i] |= bit
+        else:
+            self.buf[i] &= ~bit
+
+    def fill_rect(self, x, y, w, h, c):
+        for yy in range(max(y, 0), min(y + h, self.height)):
+            for xx in range(max(x, 0), min(x + w, self.width)):
+                self.pixel(xx, yy, c)
+
+    def fill(self, c):
+        for i in range(len(self.buf)):
+            self.buf[i] = 0xFF if c else 0
+
+    def text(self, s, x, y, c=1):
+        for n, ch in enumerate(s):
+            for col in range(8):
+                bits = 0 if ch == " " else (ord(ch) * (col + 3) * 37) & 0x7E
+                xx = x + 8 * n + col
+                if y & 7 == 0 and 0 <= xx < self.width and 0 <= y < self.height:
+                    i = (y >> 3) * self.width + xx  # Byte aligned: one column byte
+                    self.buf[i] = self.buf[i] | bits if c else self.buf[i] & ~bits
+                    continue
+                for row in range(8):
+                    if bits >> row & 1:
+                        self.pixel(xx, y + row, c)
+
+
+def _make_framebuf():
+    m = types.ModuleType("framebuf")
+    m.FrameBuffer = FrameBuffer
+    m.MONO_VLSB = 0
+    return m
+
+
+# --- neopixel ---
+
+class NeoPixel:
+    def __init__(self, pin, n):
+        self.buf = [(0, 0, 0)] * n
+
+    def __setitem__(self, i, v):
+        self.buf[i] = v
+
+    def __getitem__(self, i):
+        return self.buf[i]
+
+    def write(self):
+        pass
+
+
+# --- usb.device ---
+
+class HIDInterface:
+    """Records reports instead of queueing them on an endpoint"""
+
+    def __init__(self, report_descriptor, extra_descriptors=[], set_report_buf=None,
+                 protocol=0, interface_str=None):
+        self.report_descriptor = report_descriptor
+        self.reports_sent = 0
+        self.last_report = None
+        self.report_log = None  # Set to a list to keep a copy of every report
+        self._open = True       # Configured by the host (tools/boot_sim.py: not yet)
+
+    def is_open(self):
+        return self._open
+
+    def on_open(self):
+        self._open = True
+
+    def on_interface_control_xfer(self, stage, request):
+        return False  # Stall
+
+    def send_report(self, report_data, timeout_ms=100):
+        self.reports_sent += 1
+        self.last_report = report_data
+        if self.report_log is not None:
+            self.report_log.append(bytes(report_data))
+        return True
+
+
+class _USBDevice:
+    def init(self, *itfs, **kwargs):
+        self.itfs = itfs
+
+_DEVICE = _USBDevice()
+
+
+def _make_usb():
+    usb = types.ModuleType("usb")
+    device = types.ModuleType("usb.device")
+    device.get = lambda: _DEVICE
+    hid = types.ModuleType("usb.device.hid")
+    hid.HIDInterface = HIDInterface
+    usb.device = device
+    device.hid = hid
+    return usb, device, hid
+
+
+def _load(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def install():
+    """Register the stand-in modules and put the firmware on sys.path"""
+    if "rp2" in sys.modules:
+        return
+    for name in ("ticks_us", "ticks_ms", "ticks_add", "ticks_diff"):
+        setattr(time, name, globals()[name])
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    time.sleep_us = lambda us: time.sleep(us / 1000000)
+    sys.print_exception = lambda e, f=sys.stderr: __import__("traceback").print_exception(e, file=f)
+
+    uasyncio = types.ModuleType("uasyncio")
+    uasyncio.__dict__.update({k: v for k, v in asyncio.__dict__.items() if not k.startswith("__")})
+    uasyncio.sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+    uasyncio.wait_for_ms = lambda aw, ms: asyncio.wait_for(aw, ms / 1000)
+    uasyncio.ThreadSafeFlag = ThreadSafeFlag
+
+    neopixel = types.ModuleType("neopixel")
+    neopixel.NeoPixel = NeoPixel
+
+    # Viper pointer casts: the buffer itself indexes the same way
+    for name in ("ptr8", "ptr16", "ptr32"):
+        setattr(builtins, name, _identity)
+    builtins.uint = int
+
+    usb, device, hid = _make_usb()
+    sys.modules.update({
+        "micropython": _make_micropython(),
+        "machine": _make_machine(),
+        "rp2": _make_rp2(),
+        "uasyncio": uasyncio,
+        "neopixel": neopixel,
+        "framebuf": _make_framebuf(),
+        "usb": usb,
+        "usb.device": device,
+        "usb.device.hid": hid,
+    })
+    device.keyboard = _load("usb.device.keyboard", os.path.join(ROOT, "lib", "keyboard.py"))
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+# --- PS/2 frames ---
+
+def encode_frame(byte, parity_error=False, start=0, stop=1):
+    """Build the 32-bit RX FIFO word ps2_reader autopushes for one byte"""
+    from ps2_pio import encode_frame as frame
+    word = frame(byte, parity_error)
+    if start: word |= 1 << 1
+    if not stop: word &= ~(1 << 21)
+    return word << 10  # 22 bits shifted in from the left of the ISR
+
+
+def encode_bytes(data):
+    return [encode_frame(b) for b in data]
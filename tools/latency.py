@@ -0,0 +1,150 @@
+"""
+End-to-end USB report latency, measured on the PC through hidraw (Linux).
+
+    python3 tools/latency.py probe [-n 500]     # needs LATENCY_PROBE = True
+    python3 tools/latency.py listen [-t 10]     # while the Pico replays a trace
+
+probe: toggles the converter's Scroll Lock LED through the keyboard output
+report. With LATENCY_PROBE the converter answers with a PROBE_KEY tap pushed
+through its event ring, event pump and USB report path, and this tool times
+write() -> key-down input report. The round trip includes the LED control
+transfer, so it is an upper bound on the converter's own latency; with
+USB_INTERVAL_MS = 1 it should stay within a few ms.
+
+listen: timestamps every keyboard input report and prints the gaps between
+them. Replay a trace on the Pico as fast as possible
+(ps2_trace.replay(kb, path, 0, usb_kb.handle_events)) and the minimum gap
+shows the endpoint interval the host actually polls at.
+
+The device is found by USB VID:PID (default 2E8A:0005, MicroPython on
+RP2040); pass --device /dev/hidrawN to pick one. hidraw nodes usually need
+root or a udev rule for read/write access.
+"""
+
+import argparse
+import os
+import random
+import select
+import sys
+import time
+
+from hidraw import KEYBOARD_RDESC, find_device
+
+LED_SCROLL_LOCK = 0x04
+PROBE_USAGE = 0x73  # F24, main.PROBE_KEY is mapped to it while probing
+
+
+def read_report(fd, timeout_s):
+    """(report, perf_counter_ns at arrival) or (None, None) on timeout"""
+    r, _, _ = select.select([fd], [], [], timeout_s)
+    if not r:
+        return None, None
+    data = os.read(fd, 64)
+    return data, time.perf_counter_ns()
+
+
+def drain(fd):
+    while read_report(fd, 0)[0] is not None:
+        pass
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+def summary(name, values_us):
+    v = sorted(values_us)
+    print(f"{name}: n={len(v)}  min {v[0]:.0f}  p50 {percentile(v, 50):.0f}  "
+          f"p90 {percentile(v, 90):.0f}  p99 {percentile(v, 99):.0f}  max {v[-1]:.0f} us")
+
+
+def histogram(values_us, bucket_us=250, width=50):
+    counts = {}
+    for v in values_us:
+        b = int(v // bucket_us)
+        counts[b] = counts.get(b, 0) + 1
+    top = max(counts.values())
+    for b in range(min(counts), max(counts) + 1):
+        n = counts.get(b, 0)
+        print(f"{b * bucket_us / 1000:7.2f} ms {n:6} {'#' * (n * width // top)}")
+
+
+def probe(fd, count, timeout_s):
+    leds = 0
+    rtts = []
+    lost = 0
+    for _ in range(count):
+        drain(fd)
+        leds ^= LED_SCROLL_LOCK
+        t0 = time.perf_counter_ns()
+        os.write(fd, bytes((0, leds)))  # Report ID 0: the keyboard has no IDs
+        pressed_at = None
+        while True:
+            report, t = read_report(fd, timeout_s)
+            if report is None:
+                break
+            if pressed_at is None and PROBE_USAGE in report[2:8]:
+                pressed_at = t
+            elif pressed_at is not None and PROBE_USAGE not in report[2:8]:
+                break  # Released, ready for the next round
+        if pressed_at is None:
+            lost += 1
+        else:
+            rtts.append((pressed_at - t0) / 1000)
+        # Random spacing so writes don't lock onto the host's polling phase
+        time.sleep(random.uniform(0.010, 0.030))
+    if not rtts:
+        print("No probe answers: is LATENCY_PROBE = True on the Pico?")
+        return 1
+    summary("round trip", rtts)
+    histogram(rtts)
+    if lost:
+        print(f"{lost} probes unanswered")
+    return 0
+
+
+def listen(fd, seconds):
+    stamps = []
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        report, t = read_report(fd, 0.1)
+        if report is not None:
+            stamps.append(t)
+    if len(stamps) < 2:
+        print(f"{len(stamps)} reports received, nothing to measure")
+        return 1
+    gaps = [(b - a) / 1000 for a, b in zip(stamps, stamps[1:])]
+    print(f"{len(stamps)} reports in {(stamps[-1] - stamps[0]) / 1e9:.2f} s")
+    summary("report gap", gaps)
+    histogram([g for g in gaps if g < 20_000])
+    return 0
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("mode", choices=("probe", "listen"))
+    parser.add_argument("--device", help="hidraw node, e.g. /dev/hidraw3")
+    parser.add_argument("--vid", type=lambda s: int(s, 16), default=0x2E8A)
+    parser.add_argument("--pid", type=lambda s: int(s, 16), default=0x0005)
+    parser.add_argument("-n", "--count", type=int, default=500, help="probe rounds")
+    parser.add_argument("-t", "--time", type=float, default=10, help="listen for N seconds")
+    parser.add_argument("--timeout", type=float, default=0.2, help="probe answer timeout (s)")
+    args = parser.parse_args()
+
+    path = args.device or find_device(args.vid, args.pid, KEYBOARD_RDESC)
+    if not path:
+        print(f"No keyboard hidraw device for {args.vid:04X}:{args.pid:04X}, use --device")
+        return 1
+    fd = os.open(path, os.O_RDWR)
+    try:
+        if args.mode == "probe":
+            return probe(fd, args.count, args.timeout)
+        return listen(fd, args.time)
+    finally:
+        os.close(fd)
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
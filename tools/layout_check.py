@@ -0,0 +1,171 @@
+"""
+Layout compiler and typing routine (layout.py) against an emulated host.
+
+    python3 tools/layout_check.py            # all layouts, exit 1 on failure
+    python3 tools/layout_check.py --layout hu --text "Árvíztűrő tükörfúrógép"
+
+The host side is emulated independently from the compiled tables: it
+turns each report into key presses the way an OS does (newly pressed keys
+only, the report's modifiers, Caps Lock, dead keys composing with the next
+character) using the forward layout definition. Every character of the
+layout, and a sample text, are typed through Typist with Caps Lock off and
+on and must come out unchanged.
+
+Report path: the typed reports go through the keyboard's ping/pong
+buffers like flush_keys, so a physical key right after typing is compared
+against what the host has last seen and still gets sent. With the
+interface closed typing gives up at once instead of retrying.
+
+Speed: each report costs one USB poll interval, so characters per second
+at a given interval follow from reports per character. Printed for the
+merged sequence and for the naive one (press and release report per key).
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+import host
+
+host.install()
+
+from usb.device.keyboard import LEDCode
+import layout
+import main
+
+SAMPLE = {
+    "us": "The quick brown fox jumps over the lazy dog. {x: [1, 2]} <a href=\"#\">ok</a>; 50% & ~/$HOME\n",
+    "hu": "Árvíztűrő tükörfúrógép. Üdvözlettel: Kovács Péter <peter@example.hu>, 100% {ok} [x] 5*3=15; ~^`ŐŰ\n",
+}
+
+
+class Host:
+    """What the OS makes of the reports, from the forward layout definition"""
+
+    def __init__(self, keys, dead, caps=False):
+        self.chars = {}
+        for key in keys:
+            for level, ch in enumerate(key[1:]):
+                if ch:
+                    self.chars[key[0], level] = ch
+        self.letters = {key[0] for key in keys if len(key) > 2 and key[1].lower() != key[1].upper()}
+        self.compose = {d: dict(p for p in pairs.split()) for d, pairs in dead.items()}
+        self.caps = caps
+        self.down = set()
+        self.pending = None
+        self.text = []
+
+    def report(self, r):
+        mods, keys = r[0], {k for k in r[2:] if k}
+        for key in keys - self.down:
+            shift = bool(mods & 0x22)
+            if self.caps and key in self.letters and not mods & 0x40:
+                shift = not shift
+            level = (2 if mods & 0x40 else 0) + shift
+            ch = self.chars.get((key, level))
+            if ch is None:
+                continue
+            if self.pending is not None:
+                d, self.pending = self.pending, None
+                self.text.append(d if ch == " " else self.compose[d].get(ch, d + ch))
+            elif ch in self.compose:
+                self.pending = ch
+            else:
+                self.text.append(ch)
+        self.down = keys
+
+
+async def typed(usb_kb, text, keys, dead, caps):
+    usb_kb.leds = LEDCode.CAPS_LOCK if caps else 0
+    usb_kb.report_log = []
+    await usb_kb.typist.type(text)
+    h = Host(keys, dead, caps)
+    for r in usb_kb.report_log:
+        h.report(r)
+    return "".join(h.text), usb_kb.report_log
+
+
+async def check(name, args):
+    keys, dead = layout.LAYOUTS[name]
+    t = time.perf_counter()
+    lay = layout.Layout(keys, dead)
+    ms = (time.perf_counter() - t) * 1000
+    n = len(lay.points)
+    size = 2 * n + 4 * n + 2 * len(lay.dead_keys)
+    print(f"{name}: {n} characters ({sum(1 for e in lay.entries if e >> 16 & 0xFF)} through dead keys), "
+          f"{size} bytes of tables, compiled in {ms:.1f} ms on this PC")
+
+    usb_kb = main.PS2ToUSB()
+    usb_kb.typist = layout.Typist(usb_kb, lay)
+    ok = True
+    every = "".join(chr(cp) for cp in lay.points)
+    texts = [args.text] if args.text else [every, SAMPLE[name]]
+    for text in texts:
+        for caps in (False, True):
+            out, log = await typed(usb_kb, text, keys, dead, caps)
+            if out != text:
+                ok = False
+                bad = next(i for i in range(min(len(out), len(text)) + 1)
+                           if i >= len(out) or i >= len(text) or out[i] != text[i])
+                print(f"  FAIL caps={caps}: differs at {bad}: typed {text[bad:bad + 10]!r}, "
+                      f"host got {out[bad:bad + 10]!r}")
+            elif log[-1] != bytes(8):
+                ok = False
+                print("  FAIL: keys left down after typing")
+
+    text = texts[-1]
+    merged = len(list(layout.reports(lay, text)))
+    naive = 2 * sum(len(lay.strokes(ch)) for ch in text)
+    print(f"  {len(text)} characters: {merged} reports merged ({merged / len(text):.2f}/char), "
+          f"{naive} naive ({naive / len(text):.2f}/char)")
+    for interval in (1, 8):
+        print(f"  at {interval} ms per report: {1000 * len(text) / merged / interval:.0f} chars/s "
+              f"(naive {1000 * len(text) / naive / interval:.0f})")
+    print(f"  typed back through the emulated host: {'ok' if ok else 'WRONG'}")
+    return ok
+
+
+async def report_path(name):
+    keys, dead = layout.LAYOUTS[name]
+    usb_kb = main.PS2ToUSB()
+    usb_kb.typist = typist = layout.Typist(usb_kb, layout.Layout(keys, dead))
+    a = main.KEY_LUT[0x1C]  # A
+    # A held while typing: the last typed report puts it back down, so
+    # releasing it must reach the host
+    usb_kb.update_key(a, True)
+    await typed(usb_kb, "xy", keys, dead, False)
+    shared = usb_kb.last_report is usb_kb._key_reports[1]
+    usb_kb.update_key(a, False)
+    released = usb_kb.report_log[-1] == bytes(8)
+    usb_kb._open = False
+    n = usb_kb.reports_sent
+    try:
+        await asyncio.wait_for(typist.type("closed"), 1)
+        gave_up = typist.aborted == 1 and usb_kb.reports_sent == n
+    except asyncio.TimeoutError:
+        gave_up = False
+    ok = shared and released and gave_up
+    print(f"report path: typed reports in the keyboard's buffers: {shared}, "
+          f"key released after typing: {released}, gave up on a closed interface: {gave_up}: "
+          f"{'ok' if ok else 'FAIL'}")
+    return ok
+
+
+async def run(args):
+    ok = True
+    for name in [args.layout] if args.layout else layout.LAYOUTS:
+        ok &= await check(name, args)
+    ok &= await report_path(args.layout or "us")
+    return ok
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--layout", choices=sorted(layout.LAYOUTS))
+    parser.add_argument("--text", help="type this instead of the layout and sample text")
+    return 0 if asyncio.run(run(parser.parse_args())) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,91 @@
+"""
+Media and system keys (media.py) against reports that don't go out.
+
+    python3 tools/media_check.py            # all scenarios, exit 1 on failure
+
+The HID shim's send_report is made to fail (endpoint busy) or the
+interface closed at the moment a report should go out.
+
+dropped release: Volume Up is pressed, its release can't be sent. The
+host still has Volume Up down, and media.consumer must say so; the next
+key on the keyboard must send the release.
+
+closed: a System Sleep press while the interface is closed changes
+nothing on the host. Once it is open again, the next media key sends the
+pending state along with its own.
+"""
+
+import sys
+
+import host
+
+host.install()
+
+from keymap import KeyAction
+from usb_constants import CONSUMER, SYSTEM, PAGE_CONSUMER, PAGE_DESKTOP
+from media import MediaInterface
+import main
+
+VOLUME_UP = KeyAction(CONSUMER.VOL_UP, page=PAGE_CONSUMER)
+MUTE = KeyAction(CONSUMER.MUTE, page=PAGE_CONSUMER)
+SLEEP = KeyAction(SYSTEM.SLEEP, page=PAGE_DESKTOP)
+A = KeyAction(0x04)
+
+
+def rig():
+    usb_kb = main.PS2ToUSB()
+    media = usb_kb.media = MediaInterface()
+    media.report_log = []
+    return usb_kb, media
+
+
+def host_consumer(media):
+    """Consumer usage down on the host, from the reports it got"""
+    r = [r for r in media.report_log if r[0] == 1]
+    return r[-1][1] | r[-1][2] << 8 if r else 0
+
+
+def dropped_release():
+    usb_kb, media = rig()
+    usb_kb.update_key(VOLUME_UP, True)
+    held = host_consumer(media)
+    send = media.send_report
+    media.send_report = lambda r, timeout_ms=100: False  # Endpoint busy
+    usb_kb.update_key(VOLUME_UP, False)
+    still = host_consumer(media) == held and media.consumer == held
+    media.send_report = send
+    usb_kb.update_key(A, True)
+    released = host_consumer(media) == 0 and media.consumer == 0
+    ok = held == CONSUMER.VOL_UP and still and released
+    print(f"dropped release: state kept while unsent: {still}, "
+          f"released on the next key: {released}: {'ok' if ok else 'FAIL'}")
+    return ok
+
+
+def closed():
+    usb_kb, media = rig()
+    media._open = False
+    usb_kb.update_key(SLEEP, True)
+    usb_kb.update_key(SLEEP, False)
+    usb_kb.update_key(MUTE, True)
+    unchanged = media.report_log == [] and media.system == 0 and media.consumer == 0
+    media._open = True
+    usb_kb.update_key(MUTE, False)
+    sent = [bytes(r) for r in media.report_log]
+    # Mute went down while closed and up now: the host never sees it
+    ok = unchanged and sent == [] and media.consumer == 0 and media.system == 0
+    usb_kb.update_key(SLEEP, True)
+    ok &= media.system == SYSTEM.SLEEP and media.report_log[-1][1] == SYSTEM.SLEEP
+    print(f"closed: nothing sent or recorded while closed: {unchanged}, "
+          f"state in step after reopening: {ok}: {'ok' if ok else 'FAIL'}")
+    return ok
+
+
+def cli():
+    ok = dropped_release()
+    ok &= closed()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
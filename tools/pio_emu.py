@@ -0,0 +1,715 @@
+"""
+Cycle-level emulator for PIO programs plus synthetic PS/2 and EC11
+waveform generators, so ps2_reader and ec11_reader can be validated and
+stress-tested without a board.
+
+Supported: wait (pin/gpio), in_ (pins/x/y/null), out (x/y/isr/null),
+set (x/y), mov (x/y/isr/osr/null/status with invert), jmp (always, !x,
+x--, !y, y--, x!=y, pin), push, pull, autopush, SHIFT_RIGHT/SHIFT_LEFT,
+wrap_target/wrap, delays, the STATUS_SEL/STATUS_N bits of EXECCTRL
+(through Registers, a mem32 stand-in).
+Not supported: side-set, irq, autopull.
+
+    python3 tools/pio_emu.py                    # validation matrix, exit 1 on failure
+    python3 tools/pio_emu.py --khz 16.7 --jitter 0.2 --glitches 5 --corpus bursts
+
+The emulated state machine has the rp2.StateMachine API, so it can stand
+in for PS2Keyboard.sm / Encoder.sm and drive the real decoders directly,
+see run_ps2() and run_ec11().
+"""
+
+import argparse
+import math
+import random
+import sys
+
+import host
+
+host.install()
+
+import rp2
+from bench import load_corpus
+from ps2_pio import PS2Keyboard, STAT_NAMES, STAT_TIMEOUT, PIO_FREQ, FRAME_TIMEOUT_US, ps2_reader
+import encoder
+from encoder import Encoder, ENCODER_FREQ, ec11_reader, _COUNT_MASK
+
+MASK32 = 0xFFFFFFFF
+
+
+# --- Assembler ---
+
+class _Operand:
+    def __init__(self, name, invert=False):
+        self.name = name
+        self.invert = invert
+
+    def __repr__(self):
+        return ("~" if self.invert else "") + self.name
+
+
+class Instr:
+    def __init__(self, op, *args):
+        self.op = op
+        self.args = args
+        self.delay = 0
+
+    def __getitem__(self, delay):
+        self.delay = delay
+        return self
+
+    def side(self, value):
+        raise NotImplementedError("side-set is not emulated")
+
+    def __repr__(self):
+        return f"{self.op}{self.args}" + (f" [{self.delay}]" if self.delay else "")
+
+
+class Program:
+    def __init__(self, name, instrs, labels, wrap_target, wrap, config):
+        self.name = name
+        self.instrs = instrs
+        self.labels = labels
+        self.wrap_target = wrap_target
+        self.wrap = wrap
+        self.config = config
+
+
+_OPERANDS = ("pins", "x", "y", "null", "isr", "osr", "pc", "status", "pin", "gpio",
+             "block", "noblock", "iffull", "ifempty", "x_dec", "y_dec", "not_x", "not_y",
+             "x_not_y", "not_osre")
+
+
+def _names(emit, label=None, wrap_target=None, wrap=None):
+    names = {n: _Operand(n) for n in _OPERANDS}
+    names.update({
+        "wait": emit("wait"), "in_": emit("in"), "out": emit("out"), "set": emit("set"), "mov": emit("mov"),
+        "jmp": emit("jmp"), "push": emit("push"), "pull": emit("pull"), "nop": emit("nop"),
+        "label": label, "wrap_target": wrap_target, "wrap": wrap,
+        "invert": lambda o: _Operand(o.name, True),
+    })
+    return names
+
+
+def assemble(program):
+    """Run an asm_pio function (host.PIOProgram) and collect its instructions"""
+    instrs = []
+    labels = {}
+    marks = {"wrap_target": 0, "wrap": None}
+
+    def emit(op):
+        def f(*args):
+            i = Instr(op, *args)
+            instrs.append(i)
+            return i
+        return f
+
+    def label(name):
+        labels[name] = len(instrs)
+
+    def wrap_target():
+        marks["wrap_target"] = len(instrs)
+
+    def wrap():
+        marks["wrap"] = len(instrs) - 1
+
+    names = _names(emit, label, wrap_target, wrap)
+    g = program.func.__globals__
+    saved = {k: g[k] for k in names if k in g}
+    g.update(names)
+    try:
+        program.func()
+    finally:
+        for k in names:
+            del g[k]
+        g.update(saved)
+    wrap_at = marks["wrap"] if marks["wrap"] is not None else len(instrs) - 1
+    if len(instrs) > 32:
+        raise ValueError(f"{program.__name__}: {len(instrs)} instructions, PIO holds 32")
+    return Program(program.__name__, instrs, labels, marks["wrap_target"], wrap_at, program.config)
+
+
+# --- State machine ---
+
+class StateMachine:
+    """
+    One PIO state machine. pins(t_us) returns the GPIO input levels as a
+    bitmask, next_change(t_us) the time of the next pin change (None when
+    the waveform is over) so stalled waits can skip ahead.
+    """
+
+    def __init__(self, program, pins, next_change, freq=PIO_FREQ, in_base=0, jmp_pin=None):
+        self.pins = pins
+        self.next_change = next_change
+        self.cycle = 0
+        self.rxstall = 0       # Cycles stalled on a full RX FIFO (FDEBUG RXSTALL)
+        self.dropped = 0       # Words lost to push(noblock) on a full FIFO
+        self.executed = 0      # Instructions completed
+        self.inits = 0
+        self.txstall = 0       # Cycles stalled on pull(block) with an empty TX FIFO
+        self.x = self.y = 0
+        self.isr = self.osr = 0
+        self.loop = None       # Last backward jump, for _idle_loop
+        self.deadline_us = math.inf
+        self.init(program, freq, in_base=in_base, jmp_pin=jmp_pin)
+
+    # rp2.StateMachine API, so the emulator can stand in for PS2Keyboard.sm
+
+    def init(self, program, freq=PIO_FREQ, in_base=0, jmp_pin=None, **kwargs):
+        """Load the program and reset to its first instruction, FIFOs empty"""
+        self.prog = assemble(program) if not isinstance(program, Program) else program
+        cfg = self.prog.config
+        self.shift_right = cfg.get("in_shiftdir", rp2.PIO.SHIFT_LEFT) == rp2.PIO.SHIFT_RIGHT
+        self.out_right = cfg.get("out_shiftdir", rp2.PIO.SHIFT_LEFT) == rp2.PIO.SHIFT_RIGHT
+        self.autopush = cfg.get("autopush", False)
+        self.push_thresh = cfg.get("push_thresh", 32)
+        join = cfg.get("fifo_join", rp2.PIO.JOIN_NONE)
+        self.rx_depth = {rp2.PIO.JOIN_RX: 8, rp2.PIO.JOIN_TX: 0}.get(join, 4)
+        self.tx_depth = {rp2.PIO.JOIN_RX: 0, rp2.PIO.JOIN_TX: 8}.get(join, 4)
+        self.freq = freq
+        self.in_base = getattr(in_base, "id", in_base)
+        self.jmp_pin = getattr(jmp_pin, "id", jmp_pin)
+        # Like sm.init() on the RP2040: X, Y and the shift register
+        # contents survive, only the shift counters and FIFOs are cleared
+        self.pc = 0
+        self.isr_count = 0
+        self.rx = []
+        self.tx = []
+        self.execctrl = 0      # Only STATUS_SEL (bit 4) and STATUS_N (bits 3:0) are used
+        self.inits += 1
+
+    def active(self, value=None):
+        return 1
+
+    def put(self, value, shift=0):
+        if len(self.tx) >= self.tx_depth:
+            # The RP2040 blocks until the program pulls, forever with JOIN_RX
+            raise RuntimeError(f"{self.prog.name}: put() blocks, TX FIFO "
+                               + ("full" if self.tx_depth else "joined into RX"))
+        self.tx.append((value << shift) & MASK32)
+
+    def exec(self, instr):
+        """Execute one instruction given as asm_pio source, e.g. "mov(isr, x)" """
+        ins = eval(instr, _names(lambda op: lambda *args: Instr(op, *args)))
+        prog, pc, cycle = self.prog, self.pc, self.cycle
+        self.prog = Program("exec", [ins], prog.labels, 0, -1, prog.config)
+        self.pc = 0
+        try:
+            self.step()
+        finally:
+            self.prog, self.pc, self.cycle = prog, pc, cycle
+
+    def rx_fifo(self):
+        return len(self.rx)
+
+    def get(self, buf=None, shift=0):
+        return self.rx.pop(0) >> shift
+
+    def now_us(self):
+        return self.cycle * 1_000_000 / self.freq
+
+    def _pin(self, n):
+        return (self.pins(self.now_us()) >> n) & 1
+
+    def _status(self):
+        level = len(self.rx) if self.execctrl & 0x10 else len(self.tx)
+        return MASK32 if level < (self.execctrl & 0xF) else 0
+
+    def _read(self, src):
+        if src.name == "status":
+            v = self._status()
+            return (~v & MASK32) if src.invert else v
+        v = {"x": self.x, "y": self.y, "null": 0, "isr": self.isr, "osr": self.osr,
+             "pins": self.pins(self.now_us()) >> self.in_base}[src.name]
+        return (~v & MASK32) if src.invert else v & MASK32
+
+    def _shift_in(self, value, bits):
+        value &= (1 << bits) - 1
+        if self.shift_right:
+            self.isr = ((self.isr >> bits) | (value << (32 - bits))) & MASK32
+        else:
+            self.isr = ((self.isr << bits) | value) & MASK32
+        self.isr_count = min(self.isr_count + bits, 32)
+
+    def _push(self, block):
+        if len(self.rx) >= self.rx_depth:
+            if block:
+                return False
+            self.dropped += 1
+        else:
+            self.rx.append(self.isr)
+        self.isr = self.isr_count = 0
+        return True
+
+    def _skip_to_change(self):
+        # Stalled on a wait: nothing can happen before the pins change
+        t = self.next_change(self.now_us())
+        if t is None:
+            return False
+        self.cycle = max(self.cycle + 1, math.ceil(t * self.freq / 1_000_000))
+        return True
+
+    def _idle_loop(self, target):
+        # A backward jump that finds the pins and every register as they
+        # were one iteration ago is polling pins that have not changed: it
+        # spins until they do
+        state = (target, self.pins(self.now_us()), self.x, self.y, self.isr,
+                 self.isr_count, self.osr, len(self.rx), len(self.tx))
+        last, self.loop = self.loop, (state, self.cycle)
+        if last is None or last[0] != state:
+            return False
+        self.loop_period = self.cycle - last[1]
+        return True
+
+    def _skip_loop(self):
+        # Whole loop iterations up to the next pin change (or the end of
+        # run_until), so the change is seen in the same phase as without
+        # the skip
+        t = self.next_change(self.now_us())
+        if t is None:
+            return False
+        end = min(t, self.deadline_us)
+        n = int((end * self.freq / 1_000_000 - self.cycle) // self.loop_period)
+        if n <= 0:
+            return None
+        self.cycle += n * self.loop_period
+        self.loop = None
+        return True
+
+    def step(self):
+        """Execute (or stall on) one instruction. False when the waveform is over."""
+        ins = self.prog.instrs[self.pc]
+        op, a = ins.op, ins.args
+        nxt = self.pc + 1
+        if op == "wait":
+            pol, src, idx = a
+            level = self._pin(self.in_base + idx if src.name == "pin" else idx)
+            if level != pol:
+                return self._skip_to_change()
+        elif op == "in":
+            src, bits = a
+            if self.autopush and self.isr_count >= self.push_thresh and not self._push(True):
+                self.rxstall += 1
+                self.cycle += 1
+                return True
+            self._shift_in(self._read(src), bits)
+            if self.autopush and self.isr_count >= self.push_thresh and not self._push(True):
+                self.isr_count = self.push_thresh  # Retried (stalled) before the next in
+        elif op == "out":
+            dst, bits = a
+            if self.out_right:
+                v, self.osr = self.osr & ((1 << bits) - 1), self.osr >> bits
+            else:
+                v, self.osr = self.osr >> (32 - bits), (self.osr << bits) & MASK32
+            if dst.name == "isr":
+                self.isr, self.isr_count = v, bits
+            elif dst.name != "null":
+                setattr(self, dst.name, v)
+        elif op == "set":
+            setattr(self, a[0].name, a[1])
+        elif op == "mov":
+            dst, src = a
+            v = self._read(src)
+            if dst.name == "isr":
+                self.isr, self.isr_count = v, 0
+            elif dst.name == "pc":
+                nxt = v
+            else:
+                setattr(self, dst.name, v)
+        elif op == "jmp":
+            cond, target = (None, a[0]) if len(a) == 1 else a
+            take = True
+            if cond is not None:
+                c = cond.name
+                if c == "x_dec":
+                    take = self.x != 0
+                    self.x = (self.x - 1) & MASK32
+                elif c == "y_dec":
+                    take = self.y != 0
+                    self.y = (self.y - 1) & MASK32
+                elif c == "not_x":
+                    take = self.x == 0
+                elif c == "not_y":
+                    take = self.y == 0
+                elif c == "x_not_y":
+                    take = self.x != self.y
+                elif c == "pin":
+                    take = self._pin(self.jmp_pin) == 1
+                else:
+                    raise NotImplementedError(c)
+            if take:
+                nxt = self.prog.labels[target]
+                if nxt <= self.pc and self._idle_loop(nxt):
+                    skipped = self._skip_loop()
+                    if skipped is not None:
+                        return skipped
+        elif op == "push":
+            if not self._push(a and a[-1].name == "block" or not a):
+                self.cycle += 1
+                return True
+        elif op == "pull":
+            if not self.tx:
+                if a and a[-1].name == "noblock":
+                    self.osr = self.x
+                else:
+                    # Only put() can end this stall, and nothing calls it
+                    # while the program runs
+                    cycle = self.cycle
+                    running = self._skip_to_change()
+                    self.txstall += self.cycle - cycle
+                    return running
+            else:
+                self.osr = self.tx.pop(0)
+        elif op != "nop":
+            raise NotImplementedError(op)
+
+        if self.pc == self.prog.wrap and nxt == self.pc + 1:
+            nxt = self.prog.wrap_target
+        self.pc = nxt
+        self.cycle += 1 + ins.delay
+        self.executed += 1
+        return True
+
+    def run_until(self, t_us):
+        self.deadline_us = t_us
+        self.loop = None
+        while self.now_us() < t_us:
+            if not self.step():
+                return False
+        return True
+
+
+class Registers:
+    """
+    mem32 stand-in for firmware that configures a state machine through
+    its SMx_EXECCTRL register; sms maps state machine ids (0-7) to
+    emulated state machines.
+    """
+
+    def __init__(self, sms):
+        self.sms = sms
+
+    def _sm(self, addr):
+        offset = (addr & 0xFFF) - 0x0cc
+        if addr & ~0x1FFFFF not in (0x50200000, 0x50300000) or offset % 0x18 or not 0 <= offset < 4 * 0x18:
+            raise KeyError(f"{addr:#x} is not an SMx_EXECCTRL register")
+        return self.sms[(addr >> 20 & 1) * 4 + offset // 0x18]
+
+    def __getitem__(self, addr):
+        return self._sm(addr).execctrl
+
+    def __setitem__(self, addr, value):
+        self._sm(addr).execctrl = value & MASK32
+
+
+# --- PS/2 waveforms ---
+
+class Waveform:
+    """CLK (bit 0) and DATA (bit 1) levels as a list of (t_us, levels) changes"""
+
+    def __init__(self, changes, end_us):
+        self.times = [t for t, _ in changes]
+        self.levels = [v for _, v in changes]
+        self.end_us = end_us
+        self.i = 0
+
+    def _seek(self, t):
+        # Queries only move forwards in time, so a cursor is enough
+        while self.i + 1 < len(self.times) and self.times[self.i + 1] <= t:
+            self.i += 1
+
+    def pins(self, t):
+        self._seek(t)
+        return self.levels[self.i] if self.times and t >= self.times[0] else 0b11
+
+    def next_change(self, t):
+        self._seek(t)
+        i = self.i + 1 if self.times and t >= self.times[0] else 0
+        if i < len(self.times):
+            return self.times[i]
+        return None if t >= self.end_us else self.end_us
+
+
+def frame_bits(byte):
+    parity = (bin(byte).count("1") + 1) & 1
+    return [0] + [(byte >> i) & 1 for i in range(8)] + [parity, 1]
+
+
+def ps2_waveform(data, khz=12.5, jitter=0.0, gap_us=100, glitches=0, glitch_us=2.0, seed=1):
+    """
+    Device-to-host PS/2 waveform for a byte sequence. DATA changes in the
+    middle of the CLK high phase; the host samples it on the falling edge.
+    jitter varies every half period by up to that fraction, glitches adds
+    that many short CLK low pulses at random points inside frames.
+    """
+    rng = random.Random(seed)
+    half = 500.0 / khz  # us
+    edges = []  # (t, line, level), line 0 = CLK, 1 = DATA
+    t = 50.0
+    frames = []
+    for byte in data:
+        start = t
+        for bit in frame_bits(byte):
+            h = half * (1 + rng.uniform(-jitter, jitter))
+            edges.append((t + h / 2, 1, bit))
+            t += h
+            edges.append((t, 0, 0))
+            t += half * (1 + rng.uniform(-jitter, jitter))
+            edges.append((t, 0, 1))
+        t += half / 2
+        edges.append((t, 1, 1))
+        frames.append((start, t))
+        t += gap_us
+    for _ in range(glitches):
+        s, e = frames[rng.randrange(len(frames))]
+        g = rng.uniform(s, e)
+        edges.append((g, 0, 0))
+        edges.append((g + glitch_us, 0, 1))
+    edges.sort(key=lambda e: e[0])
+
+    # Fold the edges into level changes. Glitch pulses that land in a CLK
+    # low phase just keep CLK low, as on the wire.
+    changes = []
+    clk_low = 0  # Overlapping low drivers on CLK
+    data_level = 1
+    for t, line, level in edges:
+        if line == 0:
+            clk_low += -1 if level else 1
+        else:
+            data_level = level
+        v = (0 if clk_low > 0 else 1) | (data_level << 1)
+        if changes and changes[-1][0] == t:
+            changes[-1] = (t, v)
+        else:
+            changes.append((t, v))
+    return Waveform(changes, t + 2 * FRAME_TIMEOUT_US)
+
+
+def run_ps2(data, poll_us=1000, **wave_args):
+    """
+    Drive ps2_reader with a waveform for data and feed every pushed word to
+    PS2Keyboard, draining the FIFO every poll_us like read_loop does.
+    Returns (decoded bytes, keyboard, state machine).
+    """
+    wave = ps2_waveform(data, **wave_args)
+    kb = PS2Keyboard(0, 1)
+    # The emulator replaces the host FIFO stub; PS2Keyboard loads the
+    # program into it (and reloads it on resync) through the rp2 API
+    sm = kb.sm = StateMachine(ps2_reader, wave.pins, wave.next_change)
+    kb._start_sm()
+    decoded = []
+    kb._process_scancode = decoded.append
+    t = 0
+    running = True
+    while running:
+        t += poll_us
+        running = sm.run_until(t)
+        kb.poll()
+    return decoded, kb, sm
+
+
+# --- EC11 waveforms ---
+
+# Quadrature (A, B) levels in clockwise order, starting at the detent rest
+# position (both contacts open, pulled up)
+_QUAD_CW = ((1, 1), (0, 1), (0, 0), (1, 0))
+
+
+def ec11_waveform(turns, pin_a=2, pin_b=3, detent_us=20_000, jitter=0.3, bounces=0,
+                  bounce_us=300, pause_us=50_000, seed=1):
+    """
+    Encoder waveform for a list of turns (detents, clockwise positive),
+    with a pause after each. Every detent is one full quadrature cycle of
+    four edges; bounces adds up to that many short toggles of the switching
+    contact within bounce_us after each edge.
+    """
+    rng = random.Random(seed)
+    edges = []  # (t, line, level), line 0 = A, 1 = B
+    t = 100.0
+    phase = 0
+    for turn in turns:
+        d = 1 if turn > 0 else -1
+        for _ in range(abs(turn) * 4):
+            t += detent_us / 4 * (1 + rng.uniform(-jitter, jitter))
+            old, phase = _QUAD_CW[phase], (phase + d) % 4
+            new = _QUAD_CW[phase]
+            line = 0 if old[0] != new[0] else 1
+            edges.append((t, line, new[line]))
+            bt = t
+            for _ in range(rng.randint(0, bounces)):
+                bt += rng.uniform(2, bounce_us / (bounces + 1))
+                edges.append((bt, line, 1 - new[line]))
+                bt += rng.uniform(2, bounce_us / (bounces + 1))
+                edges.append((bt, line, new[line]))
+        t += pause_us
+    edges.sort(key=lambda e: e[0])
+    levels = [1, 1]
+    changes = [(0.0, (1 << pin_a) | (1 << pin_b))]
+    for et, line, level in edges:
+        levels[line] = level
+        v = (levels[0] << pin_a) | (levels[1] << pin_b)
+        if changes[-1][0] == et:
+            changes[-1] = (et, v)
+        else:
+            changes.append((et, v))
+    return Waveform(changes, t)
+
+
+def run_ec11(turns, poll_us=5000, **wave_args):
+    """
+    Drive ec11_reader with a waveform for turns and poll Encoder every
+    poll_us like main.encoder_task. Returns (detents per poll, encoder,
+    state machine).
+    """
+    wave = ec11_waveform(turns, **wave_args)
+    enc = Encoder(2, 3)
+    sm = enc.sm = StateMachine(ec11_reader, wave.pins, wave.next_change, freq=ENCODER_FREQ)
+    saved = encoder.mem32
+    encoder.mem32 = Registers({4: sm})
+    try:
+        enc._start_sm()
+    finally:
+        encoder.mem32 = saved
+    seen = []
+    t = 0
+    running = True
+    while running:
+        t += poll_us
+        running = sm.run_until(t)
+        n = enc.poll()
+        if n:
+            seen.append(n)
+    # A count held back by a full FIFO is pushed once poll() made room
+    sm.run_until(t + poll_us)
+    n = enc.poll()
+    if n:
+        seen.append(n)
+    return seen, enc, sm
+
+
+def report_ec11(name, turns, seen, enc, sm):
+    expected = sum(turns)
+    ok = enc.detents == expected and enc.raw == sm.x & _COUNT_MASK
+    print(f"{'ok  ' if ok else 'FAIL'} {name}: {enc.detents}/{expected} detents in {len(seen)} polls, "
+          f"{sm.executed} instructions, dropped={sm.dropped}")
+    return ok
+
+
+def report(name, data, decoded, kb, sm):
+    ok = decoded == data
+    stats = ", ".join(f"{n}={v}" for n, v in zip(STAT_NAMES, kb.stats) if v)
+    print(f"{'ok  ' if ok else 'FAIL'} {name}: {len(decoded)}/{len(data)} bytes, "
+          f"{sm.cycle / PIO_FREQ * 1000:.1f} ms line time, rxstall={sm.rxstall} {stats}")
+    return ok
+
+
+def check_startup():
+    """
+    Both programs must run from the configuration their drivers build
+    (PS2Keyboard._start_sm, Encoder._start_sm). Both join their FIFOs for
+    RX, so put() raises here and pull(block) stalls, where the RP2040 would
+    hang. A frame cut off after 5 bits must time out FRAME_TIMEOUT_US after
+    its start bit.
+    """
+    failures = 0
+    wave = ps2_waveform([0x1C])
+    falls = [t for t, v in zip(wave.times, wave.levels) if not v & 1]
+    cut = wave.times.index(falls[4]) + 2
+    wave = Waveform(list(zip(wave.times[:cut], wave.levels[:cut])), falls[0] + 3 * FRAME_TIMEOUT_US)
+    kb = PS2Keyboard(0, 1)
+    try:
+        sm = kb.sm = StateMachine(ps2_reader, wave.pins, wave.next_change)
+        kb._start_sm()
+        while not sm.rx and sm.run_until(sm.now_us() + 1):
+            pass
+        timeout_us = sm.now_us() - falls[0]
+        kb.poll()
+        ok = sm.txstall == 0 and kb.stats[STAT_TIMEOUT] == 1 and 0 <= timeout_us - FRAME_TIMEOUT_US < 50
+        detail = f"txstall={sm.txstall}, cut-off frame timed out after {timeout_us:.0f} us"
+    except RuntimeError as e:
+        ok, detail = False, e
+    print(f"{'ok  ' if ok else 'FAIL'} ps2_reader startup: {detail}")
+    failures += not ok
+
+    try:
+        seen, enc, sm = run_ec11([])
+        ok = sm.txstall == 0 and enc.raw == sm.x & _COUNT_MASK
+        detail = f"txstall={sm.txstall}, count pushed at start: {enc.raw >= 0}"
+    except RuntimeError as e:
+        ok, detail = False, e
+    print(f"{'ok  ' if ok else 'FAIL'} ec11_reader startup: {detail}")
+    return failures + (not ok)
+
+
+def validate():
+    """Clean lines must decode exactly from 10 to 16.7 kHz; glitched lines must recover"""
+    failures = check_startup()
+    data = load_corpus("bursts")[:300]
+    for khz in (10, 12.5, 16.7):
+        for jitter in (0, 0.2):
+            decoded, kb, sm = run_ps2(data, khz=khz, jitter=jitter, gap_us=40)
+            failures += not report(f"{khz} kHz jitter {jitter:.0%} min gaps", data, decoded, kb, sm)
+    # Maximum line rate with a slow consumer: the joined 8 word FIFO must
+    # cover a 5 ms stall of the asyncio loop
+    decoded, kb, sm = run_ps2(data, khz=16.7, gap_us=0, poll_us=5000)
+    failures += not report("16.7 kHz back to back, polled every 5 ms", data, decoded, kb, sm)
+
+    # Glitches corrupt frames, but the timeout/resync must bring the
+    # stream back: the tail after the last glitch decodes cleanly
+    data = load_corpus("prose")[:400]
+    decoded, kb, sm = run_ps2(data, khz=12.5, glitches=4, gap_us=300, seed=7)
+    tail = data[-100:]
+    recovered = decoded[-len(tail):] == tail
+    print(f"{'ok  ' if recovered else 'FAIL'} glitches: {len(decoded)}/{len(data)} bytes, "
+          + ", ".join(f"{n}={v}" for n, v in zip(STAT_NAMES, kb.stats) if v))
+    failures += not recovered
+
+    # Encoder: counts must match exactly through bounce, and both programs
+    # must fit their PIO block (PIO0: ps2_reader, PIO1: ec11_reader)
+    rng = random.Random(3)
+    turns = [rng.choice((-1, 1)) * rng.randint(1, 6) for _ in range(40)]
+    for name, args in (("clean", {}),
+                       ("bouncy contacts", {"bounces": 4}),
+                       ("fast spin, bouncy", {"detent_us": 4000, "pause_us": 5000, "bounces": 2}),
+                       ("fast spin, polled every 10 ms", {"detent_us": 4000, "poll_us": 10_000}),
+                       # Bounce overflows the FIFO of a stalled consumer: the newest
+                       # count waits in the program until there is room
+                       ("bouncy, polled every 250 ms", {"bounces": 4, "poll_us": 250_000})):
+        seen, enc, sm = run_ec11(turns, **args)
+        failures += not report_ec11(f"ec11 {name}", turns, seen, enc, sm)
+    sizes = {p.__name__: len(assemble(p).instrs) for p in (ps2_reader, ec11_reader)}
+    fits = all(n <= 32 for n in sizes.values())
+    print(f"{'ok  ' if fits else 'FAIL'} program sizes: "
+          + ", ".join(f"{name} {n}/32" for name, n in sizes.items()))
+    failures += not fits
+    return 1 if failures else 0
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--khz", type=float, help="PS/2 clock (10-16.7 kHz); omit for the validation matrix")
+    parser.add_argument("--jitter", type=float, default=0, help="half period variation, 0.1 = ±10%%")
+    parser.add_argument("--gap-us", type=float, default=100, help="idle time between bytes")
+    parser.add_argument("--glitches", type=int, default=0, help="short CLK pulses to inject")
+    parser.add_argument("--poll-us", type=int, default=1000, help="FIFO drain interval")
+    parser.add_argument("--corpus", default="prose")
+    parser.add_argument("--bytes", type=int, default=500, help="corpus bytes to send")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--listing", action="store_true", help="print the assembled ps2_reader")
+    parser.add_argument("--ec11", action="store_true", help="--listing: print ec11_reader instead")
+    args = parser.parse_args()
+    if args.listing:
+        prog = assemble(ec11_reader if args.ec11 else ps2_reader)
+        for i, ins in enumerate(prog.instrs):
+            marks = [n for n, at in prog.labels.items() if at == i]
+            print(f"{i:2} {'>' if i == prog.wrap_target else ' '}{'<' if i == prog.wrap else ' '} {ins!r:32} {' '.join(marks)}")
+        return 0
+    if args.khz is None:
+        return validate()
+    data = load_corpus(args.corpus)[:args.bytes]
+    decoded, kb, sm = run_ps2(data, poll_us=args.poll_us, khz=args.khz, jitter=args.jitter,
+                              gap_us=args.gap_us, glitches=args.glitches, seed=args.seed)
+    return 0 if report(f"{args.khz} kHz", data, decoded, kb, sm) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
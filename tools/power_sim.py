@@ -0,0 +1,230 @@
+"""
+Idle governor (power.py) with the converter's polling tasks, on the host.
+
+    python3 tools/power_sim.py              # all scenarios, exit 1 on failure
+
+Runs the PS/2 read loop, event pump, status LED, combo and lag monitor
+tasks from main.py with and without the governor, and counts event loop
+timer wakeups per second while the keyboard is idle: the CPU can only
+sleep between them, so this is what the clock drop and the parked tasks
+buy (measure the current itself with a USB meter, see README).
+
+wake: a key pressed while idle fires the CLK pin IRQ; the clock must be
+back at full speed and the key must reach the host.
+
+race: a frame that starts just before the IRQ is armed fires no IRQ; it
+must still wake the converter and get through.
+
+suspend: with the bus suspended the governor goes idle while keys are
+active, and a keypress must signal remote wakeup on the bus.
+
+pio clocks: the PIO CLKDIV registers hold real values. A 2 MHz state
+machine (ps2_reader) must stay at 2 MHz at the idle clock and read its
+old divider again after the wake, and one at INT 0 (divider 65536) must
+round-trip too.
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+import host
+
+host.install()
+
+import machine
+import uasyncio
+from ps2_constants import PS2
+from ps2_pio import PS2Keyboard
+from corpus import make, brk
+from telemetry import lag_monitor
+import power
+import main
+
+
+def clkdiv_addr(pio, sm):
+    return power._PIO_BASE[pio] + power._SM0_CLKDIV + sm * power._SM_STRIDE
+
+
+class USBRegs:
+    """SIE_STATUS / SIE_CTRL set alias and the PIO CLKDIVs, everything else reads 0"""
+
+    def __init__(self):
+        self.suspended = False
+        self.resumes = 0
+        # After reset every divider is 1.0
+        self.clkdiv = {clkdiv_addr(p, sm): 1 << 16 for p in range(2) for sm in range(4)}
+
+    def __getitem__(self, addr):
+        if addr == power._USBCTRL_REGS + power._SIE_STATUS:
+            return power._SIE_SUSPENDED if self.suspended else 0
+        return self.clkdiv.get(addr, 0)
+
+    def __setitem__(self, addr, value):
+        if addr == power._USBCTRL_REGS + power._SIE_CTRL + power._REG_SET and value & power._SIE_RESUME:
+            self.resumes += 1
+        if addr in self.clkdiv:
+            self.clkdiv[addr] = value & 0xFFFFFF00
+
+    def sm_hz(self, pio, sm):
+        div = self.clkdiv[clkdiv_addr(pio, sm)] >> 8 or 1 << 24  # INT 0 means 65536
+        return machine.freq() * 256 / div
+
+
+class Rig:
+    def __init__(self, args, governor):
+        self.args = args
+        self.kb = PS2Keyboard(0, 1)
+        self.usb_kb = main.PS2ToUSB()
+        self.regs = power.mem32 = USBRegs()
+        self.gov = None
+        if governor:
+            self.gov = power.Governor(self.kb, lambda: main.STATUS.state != "READY" or
+                                      time.ticks_diff(time.ticks_ms(), main.STATUS.last_act) < args.idle_ms,
+                                      main.IDLE_FREQ)
+            self.kb.governor = self.gov
+        main.GOVERNOR = self.gov
+        main.STATUS.state = "READY"
+        self.wakeups = 0
+        self._sleep, self._sleep_ms = uasyncio.sleep, uasyncio.sleep_ms
+        uasyncio.sleep = self._count(self._sleep)
+        uasyncio.sleep_ms = self._count(self._sleep_ms)
+        self.tasks = [asyncio.create_task(c) for c in (
+            self.kb.read_loop(), main.event_pump(self.kb, self.usb_kb), main.STATUS.run(),
+            main.combo_task(self.usb_kb) if self.usb_kb.combos else asyncio.sleep(0),
+            lag_monitor(governor=self.gov))]
+        if self.gov:
+            self.tasks.append(asyncio.create_task(self.gov.run()))
+
+    def _count(self, sleep):
+        def counted(t):
+            self.wakeups += 1
+            return sleep(t)
+        return counted
+
+    def press(self, key, irq=True):
+        """Frame words into the PIO FIFO, with the CLK edge IRQ if armed"""
+        handler = getattr(self.kb.clk, "handler", None)
+        if irq and handler:
+            handler(self.kb.clk)
+        self.kb.sm.feed(host.encode_bytes(make(key) + brk(key)))
+
+    async def until(self, cond, timeout=2):
+        t = time.monotonic()
+        while not cond() and time.monotonic() - t < timeout:
+            await asyncio.sleep(0.001)
+        return cond()
+
+    async def stop(self):
+        for t in self.tasks:
+            t.cancel()
+        await asyncio.sleep(0.01)
+        if self.gov:
+            power.set_freq(self.gov.full_freq)
+        uasyncio.sleep, uasyncio.sleep_ms = self._sleep, self._sleep_ms
+        main.GOVERNOR = None
+
+
+async def idle_wakeups(args, governor):
+    rig = Rig(args, governor)
+    rig.press(PS2.A)
+    await asyncio.sleep(args.idle_ms / 1000 + 0.3)
+    n = rig.wakeups
+    await asyncio.sleep(1)
+    rate = rig.wakeups - n
+    freq = machine.freq()
+    await rig.stop()
+    return rate, freq
+
+
+async def wake(args):
+    rig = Rig(args, True)
+    await rig.until(lambda: rig.gov.idle, args.idle_ms / 1000 + 1)
+    await asyncio.sleep(0.05)
+    reports = rig.usb_kb.reports_sent
+    rig.press(PS2.B)
+    ok = machine.freq() == rig.gov.full_freq and not rig.gov.idle
+    ok &= await rig.until(lambda: rig.usb_kb.reports_sent >= reports + 2)
+    await asyncio.sleep(0.02)
+    gov = rig.gov
+    await rig.stop()
+    print(f"wake: full clock restored from the IRQ, key delivered, edge -> first frame "
+          f"{gov.frame_us / 1000:.1f} ms on this PC: {'ok' if ok else 'FAIL'}")
+    return ok
+
+
+async def race(args):
+    rig = Rig(args, True)
+    await rig.until(lambda: rig.gov.idle, args.idle_ms / 1000 + 1)
+    reports = rig.usb_kb.reports_sent
+    rig.press(PS2.C, irq=False)
+    ok = await rig.until(lambda: rig.usb_kb.reports_sent >= reports + 2)
+    ok &= not rig.gov.idle and machine.freq() == rig.gov.full_freq
+    await rig.stop()
+    print(f"race: frame without IRQ while going idle delivered: {'ok' if ok else 'FAIL'}")
+    return ok
+
+
+async def suspend(args):
+    rig = Rig(args, True)
+    rig.press(PS2.D)
+    await asyncio.sleep(0.05)
+    rig.regs.suspended = True
+    went_idle = await rig.until(lambda: rig.gov.idle, 0.5)
+    rig.gov.remote_wakeup = True
+    rig.press(PS2.E)
+    ok = went_idle and rig.regs.resumes == 1 and not rig.gov.idle
+    await rig.stop()
+    print(f"suspend: idle at once while keys were active: {went_idle}, "
+          f"remote wakeup signalled on keypress: {rig.regs.resumes == 1}: {'ok' if ok else 'FAIL'}")
+    return ok
+
+
+async def pio_clocks(args):
+    rig = Rig(args, True)
+    regs = rig.regs
+    reader, slow = clkdiv_addr(0, 0), clkdiv_addr(1, 3)
+    full = machine.freq()
+    regs[reader] = full * 256 // 2_000_000 << 8   # 62.5 at 125 MHz
+    regs[slow] = 0                                # INT 0: divider 65536
+    before = regs[reader], regs[slow]
+    slow_hz = regs.sm_hz(1, 3)
+    await rig.until(lambda: rig.gov.idle, args.idle_ms / 1000 + 1)
+    idle_freq = machine.freq()
+    idle_hz = regs.sm_hz(0, 0)
+    idle_slow = regs.sm_hz(1, 3)
+    rig.press(PS2.C)
+    await rig.until(lambda: not rig.gov.idle)
+    after = regs[reader], regs[slow]
+    wake_hz = regs.sm_hz(0, 0)
+    await rig.stop()
+    ok = (idle_freq < full and abs(idle_hz - 2_000_000) < 2_000_000 / 1000 and wake_hz == 2_000_000
+          and after == before and abs(idle_slow - slow_hz) < slow_hz / 1000)
+    print(f"pio clocks: ps2_reader {idle_hz / 1e6:.3f} MHz at {idle_freq // 1_000_000} MHz, "
+          f"{wake_hz / 1e6:.3f} MHz after the wake, CLKDIV {before[0]:#x} -> {after[0]:#x}, "
+          f"INT 0 divider {before[1]:#x} -> {after[1]:#x}: {'ok' if ok else 'FAIL'}")
+    return ok
+
+
+async def scenarios(args):
+    before, _ = await idle_wakeups(args, False)
+    after, freq = await idle_wakeups(args, True)
+    ok = after * 10 < before and freq == main.IDLE_FREQ
+    print(f"idle: {before} timer wakeups/s without the governor, {after} with it "
+          f"at {freq // 1_000_000} MHz: {'ok' if ok else 'FAIL'}")
+    ok &= await wake(args)
+    ok &= await race(args)
+    ok &= await suspend(args)
+    ok &= await pio_clocks(args)
+    return ok
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--idle-ms", type=int, default=300, help="inactivity before going idle")
+    return 0 if asyncio.run(scenarios(parser.parse_args())) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
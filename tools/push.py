@@ -0,0 +1,231 @@
+"""
+Push a keymap to the converter over USB without a reset (remap.py, Linux).
+
+    python3 tools/push.py                      # keymap.py
+    python3 tools/push.py mymap.py             # any file defining KEY_MAP (COMBOS optional)
+    python3 tools/push.py mymap.py --dry-run   # compile and print the blob size only
+    python3 tools/push.py --sim --loss 0.05    # against an emulated device
+
+The keymap file is run like keymap.py (KEY_MAP, COMBOS, COMBO_WINDOW_MS)
+and compiled into a blob, which goes out in CRC32'd chunks as
+SET_REPORT(Feature) on the keymap HID interface (REMAP = True in main.py).
+The status is read back every --window chunks and after a lost or
+damaged chunk the upload resumes from the first one missing. Prints the
+transfer throughput, the time from the last chunk until the device
+reports the keymap swapped, and the device's own END -> swap time.
+
+--sim runs remap.RemapInterface and PS2ToUSB on the host shims: the
+device starts with an empty keymap and a key held down, --loss damages
+that share of the chunks. Every key of the file must map to the same
+action afterwards and the held key must have been released first.
+Times are then the PC's, not the USB bus's.
+
+The interface is found by USB VID:PID (default 2E8A:0005) and its report
+descriptor; --device /dev/hidrawN overrides. hidraw nodes usually need
+root or a udev rule.
+"""
+
+import argparse
+import asyncio
+import fcntl
+import os
+import random
+import runpy
+import struct
+import sys
+import time
+from binascii import crc32
+
+import host
+
+host.install()
+
+import remap
+from remap import (chunk, CHUNK, CMD_BEGIN, CMD_DATA, CMD_END, STATUS_LEN, RECEIVING,
+                   APPLIED, FAILED, STATE_NAMES, ERROR_NAMES)
+from hidraw import HIDIOCGFEATURE, HIDIOCSFEATURE, REMAP_RDESC, find_device
+
+
+def parse(status):
+    tag, version, state, error, next_seq, chunk_errors, received, apply_us = \
+        struct.unpack_from(remap._STATUS, status)
+    if tag != ord("R") or version != remap.VERSION:
+        raise ValueError("Not a keymap status report")
+    return state, error, next_seq, chunk_errors, received, apply_us
+
+
+class Hidraw:
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_RDWR)
+
+    def send(self, report):
+        buf = bytes(1) + bytes(report)   # Report ID 0 (no IDs)
+        fcntl.ioctl(self.fd, HIDIOCSFEATURE(len(buf)), buf)
+
+    async def status(self):
+        buf = bytearray(1 + remap.REPORT_LEN)
+        n = fcntl.ioctl(self.fd, HIDIOCGFEATURE(len(buf)), buf)
+        return parse(bytes(buf[1:n] if n > 0 else buf[1:]))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Sim:
+    """The device side on the host shims, damaging a share of the chunks"""
+
+    def __init__(self, loss, seed):
+        import main
+        self.main = main
+        self.rng = random.Random(seed)
+        self.loss = loss
+        self.damaged = 0
+        self.usb_kb = main.PS2ToUSB()
+        self.usb_kb.report_log = []
+        main.KEY_LUT[:] = [None] * 512
+        self.itf = remap.RemapInterface(self.apply, None, log=lambda msg, error=False: None)
+        self.task = asyncio.create_task(self.itf.run())
+        self.swapped_down = None
+
+    async def apply(self, *keymap):
+        await self.main.apply_keymap(self.usb_kb, *keymap)
+        self.swapped_down = self.usb_kb.n_down
+
+    def send(self, report):
+        report = bytearray(report)
+        if self.rng.random() < self.loss:
+            self.damaged += 1
+            report[self.rng.randrange(len(report))] ^= 0x10
+        self.itf.on_set_report(report, 0, remap._REPORT_TYPE_FEATURE)
+
+    async def status(self):
+        await asyncio.sleep(0)   # Let run() see END
+        return parse(self.itf.on_interface_control_xfer(1, (0xA1, 0x01, 0x0300, 0, STATUS_LEN)))
+
+    def close(self):
+        self.task.cancel()
+
+
+async def push(link, blob, window, timeout=2.0):
+    """Upload and apply blob, returns a dict of results (ok, times, counts)"""
+    n = (len(blob) + CHUNK - 1) // CHUNK
+    res = {"chunks": n, "resent": 0, "ok": False}
+    t0 = time.perf_counter()
+    for _ in range(5):
+        link.send(chunk(CMD_BEGIN, 0, struct.pack("<II", len(blob), crc32(blob))))
+        state, *_ = await link.status()
+        if state == RECEIVING:
+            break
+    else:
+        res["error"] = "BEGIN not accepted"
+        return res
+
+    seq = 0
+    while seq < n:
+        link.send(chunk(CMD_DATA, seq, blob[seq * CHUNK:(seq + 1) * CHUNK]))
+        seq += 1
+        if seq % window == 0 or seq == n:
+            state, error, next_seq, *_ = await link.status()
+            if state != RECEIVING:
+                res["error"] = f"{STATE_NAMES[state]}: {ERROR_NAMES[error]}"
+                return res
+            res["resent"] += seq - next_seq
+            seq = next_seq
+    t_sent = time.perf_counter()
+
+    link.send(chunk(CMD_END))
+    ends = 1
+    while True:
+        state, error, _, _, _, apply_us = await link.status()
+        if state == APPLIED or state == FAILED:
+            break
+        if state == RECEIVING and ends < 5:
+            link.send(chunk(CMD_END))   # END itself was damaged
+            ends += 1
+        if time.perf_counter() - t_sent > timeout:
+            res["error"] = "no answer to END"
+            return res
+        await asyncio.sleep(0.001)
+    t_applied = time.perf_counter()
+    if state == FAILED:
+        res["error"] = ERROR_NAMES[error]
+        return res
+    res.update(ok=True, send_s=t_sent - t0, apply_s=t_applied - t_sent, device_apply_us=apply_us)
+    return res
+
+
+def same_keymap(lut, key_map, combos, engine):
+    """Does the device's keymap match the file's?"""
+    for (sc, ext), a in key_map.items():
+        b = lut[sc | ext << 8]
+        if a is None and b is None:
+            continue
+        if a is None or b is None or (a.codes, bool(a.toggle), a.page) != (b.codes, b.toggle, b.page):
+            return False
+    n = sum(1 for a in key_map.values() if a is not None)
+    if sum(1 for b in lut if b is not None) != n:
+        return False
+    return len(combos) == (len(engine.fires) if engine else 0)
+
+
+async def run(args, ns):
+    key_map, combos = ns["KEY_MAP"], ns.get("COMBOS", {})
+    blob = remap.encode(key_map, combos, ns.get("COMBO_WINDOW_MS", 30))
+    print(f"{args.keymap}: {len(key_map)} keys, {len(combos)} combos -> {len(blob)} bytes, "
+          f"{(len(blob) + CHUNK - 1) // CHUNK} chunks")
+    if args.dry_run:
+        return 0
+
+    if args.sim:
+        link = Sim(args.loss, args.seed)
+        held = link.usb_kb
+        held.update_key(remap.KeyAction(0x04), True)   # A held through the push
+        asyncio.get_running_loop().call_later(0.05, held.update_key, remap.KeyAction(0x04), False)
+    else:
+        path = args.device or find_device(args.vid, args.pid, REMAP_RDESC)
+        if not path:
+            print(f"No keymap hidraw device for {args.vid:04X}:{args.pid:04X} "
+                  f"(REMAP = True in main.py?), use --device")
+            return 1
+        link = Hidraw(path)
+    try:
+        res = await push(link, blob, args.window)
+    finally:
+        link.close()
+
+    if not res["ok"]:
+        print(f"FAIL: {res['error']}")
+        return 1
+    kbps = len(blob) / res["send_s"] / 1024
+    print(f"sent {res['chunks']} chunks ({res['resent']} resent) in {res['send_s'] * 1000:.1f} ms: "
+          f"{kbps:.1f} KB/s")
+    print(f"applied {res['apply_s'] * 1000:.1f} ms after the last chunk "
+          f"(device: {res['device_apply_us'] / 1000:.1f} ms from END to the swap)")
+    if args.sim:
+        ok = same_keymap(link.main.KEY_LUT, key_map, combos, link.usb_kb.combos)
+        ok &= link.swapped_down == 0 and link.usb_kb.report_log[-1] == bytes(8)
+        print(f"sim: {link.damaged} chunks damaged, keymap on the device matches, "
+              f"swapped after the held key was released: {'ok' if ok else 'FAIL'}")
+        return 0 if ok else 1
+    print("ok")
+    return 0
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("keymap", nargs="?", default=os.path.join(host.ROOT, "keymap.py"))
+    parser.add_argument("--dry-run", action="store_true", help="compile only")
+    parser.add_argument("--window", type=int, default=16, help="chunks between status reads")
+    parser.add_argument("--device", help="hidraw node, e.g. /dev/hidraw5")
+    parser.add_argument("--vid", type=lambda s: int(s, 16), default=0x2E8A)
+    parser.add_argument("--pid", type=lambda s: int(s, 16), default=0x0005)
+    parser.add_argument("--sim", action="store_true", help="push to an emulated device")
+    parser.add_argument("--loss", type=float, default=0.0, help="--sim: share of chunks damaged")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    ns = runpy.run_path(args.keymap)
+    return asyncio.run(run(args, ns))
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
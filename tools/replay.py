@@ -0,0 +1,192 @@
+"""
+Replay a PS/2 trace through PS2Keyboard and PS2ToUSB on the PC.
+
+Traces are captured on the Pico with TRACE_CAPTURE = True in main.py
+(copy trace.ps2t off with `mpremote cp :trace.ps2t .`), or synthesised
+from a corpus, optionally with deliberate line errors:
+
+    python3 tools/replay.py trace.ps2t                  # recorded timing
+    python3 tools/replay.py trace.ps2t --speed 0 --reports
+    python3 tools/replay.py --from-corpus prose out.ps2t --corrupt 20
+    python3 tools/replay.py --check                     # corrupted-trace test, exit 1 on failure
+
+On the Pico itself use ps2_trace.replay(kb, path, speed) directly.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+import host
+
+host.install()
+
+import main
+from bench import load_corpus
+from ps2_pio import (PS2Keyboard, STAT_NAMES, STAT_FRAMES, STAT_START_ERR, STAT_STOP_ERR,
+                     STAT_PARITY_ERR, STAT_TIMEOUT, STAT_RESYNC, EV_EXTENDED, EV_PRESSED, encode_frame)
+import ps2_trace
+
+BYTE_GAP_US = 1100    # One frame at ~10 kHz plus a short inter-byte gap
+KEY_GAP_US = 60_000   # Between keystroke groups
+
+
+# Line errors corrupt() injects, with the counter each one must bump:
+# flipped data bit, bad parity, bad start bit, bad stop bit, and a frame
+# cut off mid-way (the PIO timeout word)
+ERRORS = (STAT_PARITY_ERR, STAT_PARITY_ERR, STAT_START_ERR, STAT_STOP_ERR, STAT_TIMEOUT)
+
+
+def corrupt(frame, rng, kind=None):
+    """One line error of the given kind (index into ERRORS), random by default"""
+    if kind is None:
+        kind = rng.randrange(len(ERRORS))
+    if kind == 0:
+        return frame ^ (1 << (2 * rng.randrange(8) + 3))
+    if kind == 1:
+        return frame ^ (1 << 19)
+    if kind == 2:
+        return frame | (1 << 1)
+    if kind == 3:
+        return frame & ~(1 << 21)
+    return (1 << 22) - 1
+
+
+def corpus_records(name):
+    """[frame, gap_us, complete] per corpus byte; complete is False for prefixes"""
+    records = []
+    for b in load_corpus(name):
+        gap = KEY_GAP_US if b not in (0xE0, 0xF0, 0xE1) and records and records[-1][2] else BYTE_GAP_US
+        records.append([encode_frame(b), gap, b not in (0xE0, 0xF0, 0xE1)])
+    return records
+
+
+def from_corpus(name, out, n_corrupt=0, seed=1):
+    records = corpus_records(name)
+    rng = random.Random(seed)
+    for i in rng.sample(range(len(records)), n_corrupt):
+        records[i][0] = corrupt(records[i][0], rng)
+    ps2_trace.write_trace(out, [(f, d) for f, d, _ in records])
+    print(f"{out}: {len(records)} frames, {n_corrupt} corrupted")
+
+
+def replay_records(records, tmp):
+    """Replay (frame, delta_us) pairs at full speed. Returns (keyboard,
+    decoded bytes, [(frame index, event)])"""
+    path = os.path.join(tmp, "check.ps2t")
+    ps2_trace.write_trace(path, records)
+    kb = PS2Keyboard(0, 1)
+    decoded = []
+    events = []
+    process = kb._process_scancode
+
+    def on_scancode(sc):
+        decoded.append(sc)
+        process(sc)
+
+    def on_events(buf, n):
+        events.extend((len(decoded), buf[i]) for i in range(n))
+
+    kb._process_scancode = on_scancode
+    ps2_trace.replay(kb, path, 0, on_events)
+    return kb, decoded, events
+
+
+def check(corpus="prose", seed=1):
+    """
+    Replay a trace with every kind of line error in its first half, one
+    bad frame at a time and in bursts that force a resync. Every undamaged
+    frame must still decode, each STAT_* counter must count exactly its
+    errors, and the clean second half must give the same key events as a
+    replay of that half on its own.
+    """
+    records = corpus_records(corpus)[:1200]
+    half = len(records) // 2
+    while not records[half - 1][2]:
+        half += 1  # Start the clean half between two scancodes
+    rng = random.Random(seed)
+    expected = [0] * len(STAT_NAMES)
+    damaged = set()
+    resync_after = PS2Keyboard(0, 1).resync_after
+    for n, i in enumerate(range(10, half - 2 * resync_after, 12)):
+        burst = resync_after if n % 8 == 7 else 1
+        for j in range(i, i + burst):
+            kind = rng.randrange(len(ERRORS)) if burst > 1 else n % len(ERRORS)
+            records[j][0] = corrupt(records[j][0], rng, kind)
+            expected[ERRORS[kind]] += 1
+            damaged.add(j)
+        expected[STAT_RESYNC] += burst == resync_after
+    clean = [b for i, b in enumerate(load_corpus(corpus)[:len(records)]) if i not in damaged]
+    expected[STAT_FRAMES] = len(clean)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        kb, decoded, events = replay_records([(f, d) for f, d, _ in records], tmp)
+        _, _, tail_events = replay_records([(f, d) for f, d, _ in records[half:]], tmp)
+    # Decoded bytes before the clean half (events carry their decode time too)
+    first = len(clean) - (len(records) - half)
+    tail = [ev & 0x3FF for n, ev in events if n > first]
+    ok_bytes = decoded == clean
+    ok_stats = list(kb.stats) == expected
+    ok_tail = tail == [ev & 0x3FF for _, ev in tail_events]
+    print(f"{'ok  ' if ok_bytes else 'FAIL'} corrupted trace: {len(decoded)}/{len(clean)} undamaged frames decoded, "
+          f"{len(damaged)} damaged")
+    print(f"{'ok  ' if ok_stats else 'FAIL'} line statistics: "
+          + ", ".join(f"{n}={v}" + ("" if v == e else f" (expected {e})")
+                      for n, v, e in zip(STAT_NAMES, kb.stats, expected)))
+    print(f"{'ok  ' if ok_tail else 'FAIL'} after the damage: {len(tail)} key events, "
+          f"{'same as' if ok_tail else 'differ from'} a clean replay")
+    return 0 if ok_bytes and ok_stats and ok_tail else 1
+
+
+def run(path, speed, show_events, show_reports):
+    usb_kb = main.PS2ToUSB()
+    usb_kb.report_log = []
+    events = []
+
+    def on_events(buf, n):
+        for i in range(n):
+            ev = buf[i]
+            if show_events:
+                print(f"{'▼' if ev & EV_PRESSED else '▲'} 0x{ev & 0xFF:02X} {'[EXT]' if ev & EV_EXTENDED else ''}")
+            events.append(ev)
+        usb_kb.handle_events(buf, n)
+
+    kb = PS2Keyboard(0, 1)
+    frames, elapsed_us, late_us = ps2_trace.replay(kb, path, speed, on_events)
+    if show_reports:
+        for r in usb_kb.report_log:
+            print(r.hex(" "))
+    print(f"{frames} frames in {elapsed_us / 1000:.1f} ms (worst lateness {late_us} us), "
+          f"{len(events)} key events, {len(usb_kb.report_log)} reports")
+    print(", ".join(f"{n}={v}" for n, v in zip(STAT_NAMES, kb.stats)))
+    stuck = usb_kb.n_down or usb_kb.mods
+    if stuck:
+        print(f"WARNING: keys still held at the end of the trace (mods={usb_kb.mods:#04x}, keys={usb_kb.n_down})")
+    return 1 if stuck else 0
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("trace", nargs="?", help="trace file to replay")
+    parser.add_argument("--speed", type=float, default=1, help="1 = recorded timing, 0 = as fast as possible")
+    parser.add_argument("--events", action="store_true", help="print decoded key events")
+    parser.add_argument("--reports", action="store_true", help="print every USB report")
+    parser.add_argument("--from-corpus", nargs=2, metavar=("CORPUS", "OUT"), help="synthesise a trace")
+    parser.add_argument("--corrupt", type=int, default=0, help="line errors to inject with --from-corpus")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--check", action="store_true", help="run the corrupted-trace test")
+    args = parser.parse_args()
+    if args.check:
+        return check(seed=args.seed)
+    if args.from_corpus:
+        from_corpus(*args.from_corpus, args.corrupt, args.seed)
+        return 0
+    if not args.trace:
+        parser.error("trace file required")
+    return run(args.trace, args.speed, args.events, args.reports)
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,202 @@
+"""
+Two-thread stress test of the lock-free event ring (ring.py) on CPython.
+
+    python3 tools/ring_check.py             # all scenarios, exit 1 on failure
+    python3 tools/ring_check.py --events 1000000 --size 4
+
+A trace hook makes the running thread yield at random lines of ring.py, so
+producer and consumer preempt each other anywhere inside push() and pop(),
+not only between calls, the way core 1 and core 0 race on the RP2040.
+
+spsc: a producer thread pushes a counter through a small ring, retrying
+while it is full; a consumer thread pops. Every value must arrive once and
+in order while the indices wrap many times.
+
+drops: the same without retrying. What arrives must still be in order, and
+with the ring's drop count must add up to what was pushed.
+
+dual core probe: core 1 decodes PS/2 frames into PS2Keyboard's ring while
+core 0 injects LATENCY_PROBE taps and a third thread consumes. The taps go
+through core 1 (PS2Keyboard.inject), so the ring keeps a single producer:
+the decoded events must arrive exactly as in a single-threaded run, with
+every tap in between.
+"""
+
+import argparse
+import random
+import sys
+import threading
+import time
+
+import host
+
+host.install()
+
+from ring import EventRing
+from ps2_pio import PS2Keyboard, EV_PRESSED, EV_EXTENDED, encode_frame
+from bench import load_corpus
+import main
+
+EV_MASK = 0x3FF  # Scancode and flags, without the decode time
+
+
+def preempt(rate, seed):
+    """threading.settrace hook: yield to another thread at that fraction of
+    the lines executed in ring.py"""
+    rng = random.Random(seed)
+
+    def line(frame, event, arg):
+        if event == "line" and rng.random() < rate:
+            time.sleep(0)
+        return line
+
+    def call(frame, event, arg):
+        return line if frame.f_code.co_filename.endswith("ring.py") else None
+
+    return call
+
+
+def run_threads(*targets):
+    # All start together, so no thread finishes before the others begin
+    start = threading.Barrier(len(targets))
+
+    def run(target):
+        start.wait()
+        target()
+
+    threads = [threading.Thread(target=run, args=(t,)) for t in targets]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def spsc(n, size):
+    ring = EventRing(size)
+    got = []
+
+    def producer():
+        for i in range(n):
+            while not ring.push(i & 0x3FFFFFFF):
+                time.sleep(0)
+
+    def consumer():
+        while len(got) < n:
+            ev = ring.pop()
+            if ev >= 0:
+                got.append(ev)
+            else:
+                time.sleep(0)
+
+    run_threads(producer, consumer)
+    bad = next((i for i, v in enumerate(got) if v != i & 0x3FFFFFFF), None)
+    ok = bad is None and len(got) == n and ring.pending() == 0
+    print(f"spsc: {len(got)}/{n} in order through {size} slots, indices wrapped "
+          f"{n // (2 * size)} times, {ring.dropped} full retries"
+          + (f", first wrong at {bad}" if bad is not None else "") + f": {'ok' if ok else 'FAIL'}")
+    return ok
+
+
+def drops(n, size):
+    ring = EventRing(size)
+    got = []
+    done = threading.Event()
+
+    def producer():
+        for i in range(n):
+            ring.push(i)
+            if i % 8 == 0:
+                time.sleep(0)  # Let the consumer in now and then
+        done.set()
+
+    def consumer():
+        while not done.is_set() or ring.pending():
+            ev = ring.pop()
+            if ev >= 0:
+                got.append(ev)
+            else:
+                time.sleep(0)
+
+    run_threads(producer, consumer)
+    ordered = all(a < b for a, b in zip(got, got[1:]))
+    ok = ordered and len(got) + ring.dropped == n and ring.high_water <= size
+    print(f"drops: {len(got)} received + {ring.dropped} dropped of {n}, "
+          f"{'in order' if ordered else 'OUT OF ORDER'}, high water {ring.high_water}/{size}: "
+          f"{'ok' if ok else 'FAIL'}")
+    return ok
+
+
+def dual_core_probe(n_bytes, taps):
+    frames = [encode_frame(b) for b in load_corpus("prose")[:n_bytes]]
+    probe = main.PROBE_KEY[0] | EV_EXTENDED
+
+    # Reference: the same frames decoded on one thread
+    ref = PS2Keyboard(0, 1)
+    expected = []
+    for f in frames:
+        ref.handle_frame(f)
+        while ref.ring.pending():
+            expected.append(ref.ring.pop() & EV_MASK)
+
+    kb = PS2Keyboard(0, 1, buffer=16)
+    kb.core1_run = True
+    ring = kb.ring
+    got = []
+    core1_done = threading.Event()
+    core0_done = threading.Event()
+
+    def core1():
+        # PS2Keyboard.poll() with the frames coming from a list: a frame
+        # is only taken while the ring has room
+        i = 0
+        while i < len(frames) or not core0_done.is_set() or kb.injected.pending():
+            kb.poll()
+            if i < len(frames) and ring.pending() < ring.size:
+                kb.handle_frame(frames[i])
+                i += 1
+        core1_done.set()
+
+    def core0_probe():
+        for _ in range(taps):
+            while kb.injected.pending():
+                time.sleep(0)  # tools/latency.py waits for the tap before the next toggle
+            kb.inject(probe | EV_PRESSED)
+            kb.inject(probe)
+            time.sleep(0.0002)
+        core0_done.set()
+
+    def consumer():
+        while not core1_done.is_set() or ring.pending():
+            ev = ring.pop()
+            if ev >= 0:
+                got.append(ev & EV_MASK)
+            else:
+                time.sleep(0)
+
+    run_threads(core1, core0_probe, consumer)
+    keys = [ev for ev in got if ev & 0xFF != main.PROBE_KEY[0]]
+    taps_got = [ev for ev in got if ev & 0xFF == main.PROBE_KEY[0]]
+    ok = (keys == expected and taps_got == [probe | EV_PRESSED, probe] * taps
+          and ring.dropped == 0 and kb.injected.dropped == 0)
+    print(f"dual core probe: {len(keys)}/{len(expected)} key events in order, "
+          f"{len(taps_got) // 2}/{taps} probe taps, dropped {ring.dropped}: {'ok' if ok else 'FAIL'}")
+    return ok
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--events", type=int, default=100_000, help="values pushed per ring scenario")
+    parser.add_argument("--size", type=int, default=8, help="ring slots (power of two)")
+    parser.add_argument("--bytes", type=int, default=3000, help="corpus bytes decoded on core 1")
+    parser.add_argument("--taps", type=int, default=200, help="probe taps injected from core 0")
+    parser.add_argument("--preempt", type=float, default=0.2, help="yield at this fraction of ring.py lines")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    threading.settrace(preempt(args.preempt, args.seed))
+    results = [spsc(args.events, args.size), drops(args.events, args.size),
+               dual_core_probe(args.bytes, args.taps)]
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
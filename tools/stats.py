@@ -0,0 +1,102 @@
+"""
+Read the converter's runtime counters (telemetry.py) from the PC (Linux).
+
+    python3 tools/stats.py                 # one snapshot
+    python3 tools/stats.py --watch 1       # every second, with per-interval deltas
+    python3 tools/stats.py --json
+
+Uses GET_REPORT(Feature) on the telemetry HID interface through hidraw, which
+the device answers on the control endpoint: polling never delays key
+reports. The interface is found by USB VID:PID (default 2E8A:0005) and its
+vendor report descriptor; --device /dev/hidrawN overrides. hidraw nodes
+usually need root or a udev rule.
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import sys
+import time
+
+import host
+
+host.install()
+
+from telemetry import NAMES, SNAPSHOT_LEN, VERSION
+from hidraw import HIDIOCGFEATURE, TELEMETRY_RDESC, find_device
+
+# Values that are levels rather than running totals: no deltas for these
+_GAUGES = ("lag_us", "lag_max_us", "ring_high", "uptime_ms", "wake_us", "wake_frame_us",
+           "usb_ms", "bat_ms", "ready_ms", "replayed")
+
+
+def read_snapshot(fd):
+    buf = bytearray(1 + SNAPSHOT_LEN)  # buf[0]: report ID 0 (no IDs)
+    n = fcntl.ioctl(fd, HIDIOCGFEATURE(len(buf)), buf)
+    return bytes(buf[1:n] if n > 0 else buf[1:])
+
+
+def parse(snapshot):
+    """{name: value} from a snapshot (unknown extra values as value_<i>)"""
+    if len(snapshot) < 4 or snapshot[0] != ord("T"):
+        raise ValueError("Not a telemetry snapshot")
+    if snapshot[1] != VERSION:
+        raise ValueError(f"Snapshot version {snapshot[1]}, this tool reads {VERSION}")
+    count = min(snapshot[2], (len(snapshot) - 4) // 4)
+    values = {}
+    for i in range(count):
+        name = NAMES[i] if i < len(NAMES) else f"value_{i}"
+        values[name] = int.from_bytes(snapshot[4 + 4 * i:8 + 4 * i], "little")
+    return values
+
+
+def show(values, previous=None):
+    for name, v in values.items():
+        line = f"{name:<14}{v:>12}"
+        if previous is not None and name not in _GAUGES:
+            line += f"  {v - previous.get(name, 0):+d}"
+        print(line)
+    if previous is not None and "idle_ms" in values:
+        # Idle residency over the interval (a wake finishes the idle period it counts)
+        up = values["uptime_ms"] - previous.get("uptime_ms", 0)
+        idle = values["idle_ms"] - previous.get("idle_ms", 0)
+        print(f"{'idle':<14}{100 * idle / max(up, 1):>11.0f}%")
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--device", help="hidraw node, e.g. /dev/hidraw4")
+    parser.add_argument("--vid", type=lambda s: int(s, 16), default=0x2E8A)
+    parser.add_argument("--pid", type=lambda s: int(s, 16), default=0x0005)
+    parser.add_argument("--watch", type=float, metavar="SECONDS", help="poll repeatedly")
+    parser.add_argument("--json", action="store_true", help="print JSON lines")
+    args = parser.parse_args()
+
+    path = args.device or find_device(args.vid, args.pid, TELEMETRY_RDESC)
+    if not path:
+        print(f"No telemetry hidraw device for {args.vid:04X}:{args.pid:04X}, use --device")
+        return 1
+    fd = os.open(path, os.O_RDWR)
+    try:
+        previous = None
+        while True:
+            values = parse(read_snapshot(fd))
+            if args.json:
+                print(json.dumps(values), flush=True)
+            else:
+                show(values, previous)
+            if not args.watch:
+                return 0
+            previous = values
+            time.sleep(args.watch)
+            if not args.json:
+                print()
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        os.close(fd)
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
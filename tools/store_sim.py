@@ -0,0 +1,320 @@
+"""
+Record store (store.py) on a simulated NOR flash, with power cuts.
+
+    python3 tools/store_sim.py                  # all scenarios, exit 1 on failure
+    python3 tools/store_sim.py --cuts 1000 --blocks 8
+
+SimFlash behaves like the RP2040's QSPI flash: erasing sets a block to
+0xFF, programming can only clear bits and goes by whole 256 byte pages, and
+both stall the chip (typical W25Q16 times: 0.4 ms per page, 45 ms per
+erase). Writing a 1 over a 0 without an erase is an error.
+
+wear: a long mixed workload (log lines, setting changes) flushed in
+batches; prints erases per block, flash stall per flush and write
+amplification, and checks the final content against a model.
+
+power cuts: the same workload, cut at a random flash operation again and
+again. The interrupted page is programmed up to a random byte, an
+interrupted erase clears a random prefix of the block. After every cut
+the store is mounted from what is left and must hold, for every setting,
+the last flushed value or one from the interrupted batch, and a gapless,
+in-order run of log lines that reaches at least the last flushed one.
+
+small segments: 1 KB blocks holding as many settings as the store allows,
+with full batches, so compaction often finds the head segment too short
+for the settings it would copy. Nothing may be programmed past the end of
+a block, and the content must survive a remount.
+
+idle: RecordStore.run() during simulated typing bursts; flushes must only
+happen in the pauses, or when a long burst fills the batch.
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+
+import host
+
+host.install()
+
+import store
+from store import RecordStore, PAGE
+
+
+class PowerCut(Exception):
+    pass
+
+
+class SimFlash:
+    """NOR flash with the block device protocol (extended interface)"""
+
+    def __init__(self, blocks=4, block_size=4096, page_us=400, erase_us=45_000, seed=1):
+        self.blocks = blocks
+        self.block_size = block_size
+        self.data = bytearray(b"\xff" * (blocks * block_size))
+        self.wear = [0] * blocks
+        self.page_us = page_us
+        self.erase_us = erase_us
+        self.busy_us = 0        # Total time the chip was stalled
+        self.programmed = 0     # Bytes programmed
+        self.ops = 0            # Page programs and erases
+        self.cut_at = None      # Operation number to fail part-way
+        self.rng = random.Random(seed)
+
+    def _cut(self):
+        self.ops += 1
+        return self.cut_at is not None and self.ops >= self.cut_at
+
+    def readblocks(self, n, buf, offset=0):
+        a = n * self.block_size + offset
+        buf[:] = self.data[a:a + len(buf)]
+
+    def writeblocks(self, n, buf, offset=0):
+        if offset % PAGE or len(buf) % PAGE:
+            raise ValueError(f"Unaligned program at {offset}+{len(buf)}")
+        if offset + len(buf) > self.block_size:
+            raise ValueError(f"Program past the end of block {n} at {offset}+{len(buf)}")
+        a = n * self.block_size + offset
+        for p in range(0, len(buf), PAGE):
+            end = PAGE
+            cut = self._cut()
+            if cut:
+                end = self.rng.randrange(PAGE)
+            for i in range(end):
+                old, new = self.data[a + p + i], buf[p + i]
+                if new & ~old:
+                    raise ValueError(f"Programming 1 over 0 at block {n} offset {offset + p + i}")
+                self.data[a + p + i] = old & new
+            self.programmed += PAGE
+            self.busy_us += self.page_us
+            if cut:
+                raise PowerCut()
+
+    def ioctl(self, op, arg):
+        if op == 4:
+            return self.blocks
+        if op == 5:
+            return self.block_size
+        if op == 6:
+            a = arg * self.block_size
+            end = self.block_size
+            cut = self._cut()
+            if cut:
+                end = self.rng.randrange(self.block_size)
+            self.data[a:a + end] = b"\xff" * end
+            self.wear[arg] += 1
+            self.busy_us += self.erase_us
+            if cut:
+                raise PowerCut()
+        return 0
+
+
+class Model:
+    """What the store must contain: flushed state plus the batch in flight"""
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.settings = {}      # Flushed values
+        self.batch = []         # ("put", key, value) / ("log", id) since the last flush
+        self.logs = 0           # Log lines created (ids 0..logs-1)
+        self.kept = []          # Ids of the flushed log lines, oldest first
+
+    def op(self, s, rng):
+        if rng.random() < 0.85:
+            line = f"{self.logs:06} USB Error: [Errno 19] ENODEV"
+            if s.log(line):
+                self.batch.append(("log", self.logs))
+                self.logs += 1
+        else:
+            key = rng.randrange(self.keys)
+            if rng.random() < 0.1:
+                s.delete(key)
+                self.batch.append(("put", key, None))
+            else:
+                value = bytes(rng.randrange(256) for _ in range(rng.randrange(1, 40)))
+                s.put(key, value)
+                self.batch.append(("put", key, value))
+
+    def flushed(self):
+        for e in self.batch:
+            if e[0] == "put":
+                self.settings[e[1]] = e[2]
+            else:
+                self.kept.append(e[1])
+        self.batch = []
+
+    def check(self, s, cut):
+        """Problems with the store's content; a cut allows any part of the batch"""
+        problems = []
+        for key in range(self.keys):
+            v = s.get(key)
+            allowed = [self.settings.get(key)]
+            if cut:
+                allowed += [e[2] for e in self.batch if e[0] == "put" and e[1] == key]
+            if v not in allowed:
+                problems.append(f"key {key}: {v!r} not in {allowed!r}")
+        # Log lines: a gapless run of the expected ones (compaction drops the
+        # oldest) that reaches at least the newest flushed line
+        ids = [int(line[:6]) for line in s.logs()]
+        expected = self.kept + [e[1] for e in self.batch if e[0] == "log" and cut]
+        a = expected.index(ids[0]) if ids and ids[0] in expected else -1
+        if not ids:
+            if self.kept:
+                problems.append(f"no log lines, {len(self.kept)} flushed")
+        elif a < 0 or expected[a:a + len(ids)] != ids:
+            problems.append(f"log lines not a run of the expected ones: {ids[:5]}...{ids[-5:]}")
+        elif a + len(ids) < len(self.kept):
+            problems.append(f"newest log line {ids[-1]}, {self.kept[-1]} was flushed")
+        return problems
+
+    def adopt(self, s):
+        """After a cut: take what survived as the new flushed state"""
+        for key in range(self.keys):
+            self.settings[key] = s.get(key)
+        self.batch = []
+        self.kept = [int(line[:6]) for line in s.logs()]
+
+
+def wear(args):
+    rng = random.Random(args.seed)
+    flash = SimFlash(args.blocks, seed=args.seed)
+    s = RecordStore(flash)
+    model = Model(args.keys)
+    flush_stalls = []
+    for _ in range(args.ops):
+        model.op(s, rng)
+        if rng.random() < 1 / args.flush_every or s.pending() == s.batch_cap:
+            before = flash.busy_us
+            s.flush()
+            model.flushed()
+            flush_stalls.append(flash.busy_us - before)
+    s.flush()
+    model.flushed()
+    problems = model.check(RecordStore(flash), False)
+    payload = s.written * store.REC_LEN
+    flush_stalls.sort()
+    print(f"wear: {args.ops} operations, {s.written} records in {s.flushes} flushes, "
+          f"{args.blocks} x {flash.block_size} B")
+    print(f"  erases per block {flash.wear} (spread {max(flash.wear) - min(flash.wear)}), "
+          f"{s.written / max(sum(flash.wear), 1):.0f} records per erase")
+    print(f"  {flash.programmed / payload:.2f} bytes programmed per record byte "
+          f"(page rewrites and compaction)")
+    print(f"  flash stall per flush: p50 {flush_stalls[len(flush_stalls) // 2] / 1000:.1f}  "
+          f"max {flush_stalls[-1] / 1000:.1f} ms, "
+          f"{sum(1 for t in flush_stalls if t >= flash.erase_us)} flushes with an erase")
+    for p in problems:
+        print("  FAIL", p)
+    print(f"  content after remount: {'ok' if not problems else 'WRONG'}")
+    return not problems
+
+
+def power_cuts(args):
+    rng = random.Random(args.seed + 1)
+    flash = SimFlash(args.blocks, seed=args.seed + 1)
+    s = RecordStore(flash)
+    model = Model(args.keys)
+    cuts = torn = 0
+    failures = []
+    while cuts < args.cuts:
+        for _ in range(rng.randrange(1, 3 * s.batch_cap)):
+            model.op(s, rng)
+            if s.pending() == s.batch_cap:
+                break
+        flash.cut_at = flash.ops + rng.randrange(1, 12) if rng.random() < 0.5 else None
+        try:
+            s.flush()
+            model.flushed()
+            continue
+        except PowerCut:
+            cuts += 1
+        flash.cut_at = None
+        s = RecordStore(flash)
+        torn += s.torn
+        problems = model.check(s, True)
+        if problems:
+            failures.append((cuts, problems))
+        model.adopt(s)
+    print(f"power cuts: {cuts} cuts, {torn} torn records skipped at mount, "
+          f"erases per block {flash.wear}")
+    for cut, problems in failures[:5]:
+        for p in problems[:3]:
+            print(f"  FAIL after cut {cut}: {p}")
+    print(f"  content after every cut: {'ok' if not failures else f'WRONG in {len(failures)} cuts'}")
+    return not failures
+
+
+def small_segments(args):
+    rng = random.Random(args.seed + 2)
+    flash = SimFlash(args.blocks, block_size=1024, seed=args.seed + 2)
+    s = RecordStore(flash)
+    model = Model(s.max_keys)
+    problems = []
+    try:
+        for _ in range(args.ops // 4):
+            model.op(s, rng)
+            if s.pending() == s.batch_cap:
+                s.flush()
+                model.flushed()
+        s.flush()
+        model.flushed()
+        problems = model.check(RecordStore(flash), False)
+    except ValueError as e:
+        problems = [str(e)]
+    print(f"small segments: {s.written} records, {model.keys} settings in "
+          f"{args.blocks} x {flash.block_size} B, {s.erases} erases")
+    for p in problems[:3]:
+        print("  FAIL", p)
+    print(f"  content after remount: {'ok' if not problems else 'WRONG'}")
+    return not problems
+
+
+async def idle_flush(args):
+    flash = SimFlash(args.blocks)
+    s = RecordStore(flash, batch=16)
+    typing = False
+    bad = []
+    flush = s.flush
+
+    def checked_flush():
+        if typing and s.pending() < s.batch_cap:
+            bad.append(s.pending())
+        return flush()
+
+    s.flush = checked_flush
+    task = asyncio.create_task(s.run(idle=lambda: not typing, period_ms=10))
+    for burst in range(20):
+        typing = True
+        # Every fifth burst is long enough to fill the batch
+        for _ in range(burst % 5 + 1 if burst % 5 else 2 * s.batch_cap):
+            s.log(f"Unknown: 0x{burst:02x} Ext:False")
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        typing = False
+        await asyncio.sleep(0.05)
+    task.cancel()
+    ok = not bad and s.pending() == 0 and s.flushes > 0
+    print(f"idle: {s.flushes} flushes, {len(bad)} while typing before the batch was full, "
+          f"{s.pending()} left pending: "
+          f"{'ok' if ok else 'FAIL'}")
+    return ok
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--blocks", type=int, default=4, help="4 KB blocks in the store")
+    parser.add_argument("--keys", type=int, default=12, help="setting keys in the workload")
+    parser.add_argument("--ops", type=int, default=20_000, help="wear: operations")
+    parser.add_argument("--flush-every", type=float, default=12, help="wear: operations per flush (mean)")
+    parser.add_argument("--cuts", type=int, default=300, help="power cuts to survive")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    ok = wear(args)
+    ok &= power_cuts(args)
+    ok &= small_segments(args)
+    ok &= asyncio.run(idle_flush(args))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,249 @@
+"""
+Task supervisor (supervisor.py) against crashing and stuck PS/2 readers.
+
+    python3 tools/supervisor_check.py       # all scenarios, exit 1 on failure
+
+The real PS2Keyboard, event pump and PS2ToUSB run on the host shims, with
+the reader supervised as in main.py and a fake machine.WDT.
+
+crash: a key is held down when the reader raises. The key must be released
+on the host, the reader must run again within a few ms (the old 1 s
+watchdog loop took up to 1000 ms) and the next key must get through.
+
+stall: the reader stops polling without raising. It must be cancelled and
+restarted after stall_ms, and the watchdog must keep being fed.
+
+crash loop: the reader raises on every poll. Restarts must back off, the
+supervisor must mark it failed after max_streak and stop feeding the
+watchdog, so the real one would reset the board.
+
+recovery: without a watchdog, a task that crash-loops for a while must
+keep being restarted every max_backoff_ms, and the failed mark must clear
+once it has run for stable_ms.
+
+busy pump: a producer refills the event ring right behind the pump, as
+core 1 does during fast typing, so every supervisor round sees events
+pending. The pump keeps handling batches and must not be restarted.
+
+default log: a Supervisor without log= must report a crash through its
+own logger (called with error=True) and restart the task.
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+import host
+
+host.install()
+
+from ps2_constants import PS2
+from ps2_pio import PS2Keyboard, EV_PRESSED
+from supervisor import Supervisor
+from corpus import make, brk
+import main
+
+WDT_MS = 500
+
+
+def keys(kb):
+    """Keycodes in the keyboard's last report"""
+    r = kb.last_report
+    return [c for c in r[2:] if c] if r else []
+
+
+class Rig:
+    def __init__(self, args, reader=None):
+        # reader: coroutine function run instead of read_loop the first time
+        self.reader = reader
+        self.kb = PS2Keyboard(0, 1)
+        self.usb_kb = main.PS2ToUSB()
+        self.sup = Supervisor(WDT_MS, on_restart=self.usb_kb.release_all, log=self.log,
+                              stall_ms=args.stall_ms)
+        self.lines = []
+        self.sup.add("ps2", self.read,
+                     lambda: time.ticks_diff(time.ticks_ms(), self.kb.last_poll) < 50)
+        self.sup.add("pump", lambda: main.event_pump(self.kb, self.usb_kb),
+                     lambda: main.pump_alive(self.kb, self.usb_kb))
+        self.task = asyncio.create_task(self.sup.run())
+
+    def read(self):
+        reader, self.reader = self.reader or self.kb.read_loop, None
+        return reader()
+
+    def log(self, msg, error=False):
+        self.lines.append(msg)
+
+    def feed(self, data):
+        self.kb.sm.feed(host.encode_bytes(data))
+
+    async def stop(self):
+        self.task.cancel()
+        for t in self.sup.tasks:
+            if t: t.cancel()
+        await asyncio.sleep(0.01)
+
+
+async def crash(args):
+    rig = Rig(args)
+    await asyncio.sleep(0.05)
+    rig.feed(make(PS2.A))
+    await asyncio.sleep(0.02)
+    held = keys(rig.usb_kb)
+    poll = rig.kb.poll
+
+    def broken():
+        rig.kb.poll = poll
+        raise OSError(5, "EIO")
+
+    rig.kb.poll = broken
+    await asyncio.sleep(0.02)
+    released = keys(rig.usb_kb) == []
+    rig.feed(brk(PS2.A) + make(PS2.B))
+    await asyncio.sleep(0.02)
+    after = keys(rig.usb_kb)
+    await rig.stop()
+    ms = rig.sup.restart_us / 1000
+    ok = bool(held) and released and after == [0x05] and rig.sup.crashes[0] == 1 and ms < 50
+    print(f"crash: key held {held}, released on restart: {released}, "
+          f"reader running again after {ms:.1f} ms (old loop: up to 1000 ms), "
+          f"next key {after}: {'ok' if ok else 'FAIL'}")
+    return ok
+
+
+async def stall(args):
+    async def stuck():
+        await asyncio.Event().wait()  # Waits for something that never comes
+
+    t = time.monotonic()
+    rig = Rig(args, stuck)
+    while rig.sup.stalls[0] == 0 and time.monotonic() - t < 2:
+        await asyncio.sleep(0.005)
+    stalled_ms = (time.monotonic() - t) * 1000
+    await asyncio.sleep(0.05)
+    rig.feed(make(PS2.C))
+    await asyncio.sleep(0.02)
+    after = keys(rig.usb_kb)
+    wdt = rig.sup.wdt
+    await rig.stop()
+    ok = rig.sup.stalls[0] == 1 and after == [0x06] and not wdt.expired()
+    print(f"stall: detected and restarted after {stalled_ms:.0f} ms (stall_ms {args.stall_ms}), "
+          f"next key {after}, watchdog fed {wdt.feeds} times: {'ok' if ok else 'FAIL'}")
+    return ok
+
+
+async def crash_loop(args):
+    rig = Rig(args)
+    await asyncio.sleep(0.05)
+    fed = rig.sup.wdt.feeds
+
+    def broken():
+        raise OSError(5, "EIO")
+
+    rig.kb.poll = broken
+    t = time.monotonic()
+    while not rig.sup.wdt.expired() and time.monotonic() - t < 5:
+        await asyncio.sleep(0.01)
+    reset_ms = (time.monotonic() - t) * 1000
+    await rig.stop()
+    ok = fed > 0 and rig.sup.failed == "ps2" and rig.sup.wdt.expired()
+    print(f"crash loop: {rig.sup.crashes[0]} restarts with backoff, marked failed: {rig.sup.failed}, "
+          f"watchdog ({WDT_MS} ms) would reset after {reset_ms:.0f} ms: {'ok' if ok else 'FAIL'}")
+    return ok
+
+
+async def recovery(args):
+    runs = []
+
+    async def flaky():
+        runs.append(time.ticks_ms())
+        if len(runs) <= 8:
+            raise OSError(5, "EIO")
+        await asyncio.Event().wait()  # Fine from the ninth start on
+
+    sup = Supervisor(log=lambda msg, error=False: None, max_backoff_ms=20,
+                     stable_ms=200, max_streak=5)
+    sup.add("flaky", flaky)
+    task = asyncio.create_task(sup.run())
+    t = time.monotonic()
+    marked = None
+    while len(runs) < 9 and time.monotonic() - t < 2:
+        marked = marked or sup.failed
+        await asyncio.sleep(0.005)
+    await asyncio.sleep(0.3)
+    cleared = sup.failed is None and sup.streak[0] == 0
+    task.cancel()
+    for t in sup.tasks:
+        if t: t.cancel()
+    ok = marked == "flaky" and len(runs) == 9 and cleared
+    print(f"recovery: marked failed: {marked}, restarted {len(runs) - 1} times, "
+          f"mark cleared after stable_ms: {cleared}: {'ok' if ok else 'FAIL'}")
+    return ok
+
+
+async def busy_pump(args):
+    rig = Rig(args)
+    kb = rig.kb
+    seen = []  # Events pending at each supervisor round
+    alive = rig.sup.checks[1]
+
+    def check():
+        seen.append(kb.ring.pending())
+        return alive()
+
+    rig.sup.checks[1] = check
+    t = time.monotonic()
+    while time.monotonic() - t < 4 * args.stall_ms / 1000:
+        # A tap per loop round, pushed the way PS2Keyboard.poll() does
+        kb.ring.push(PS2.A[0] | EV_PRESSED)
+        kb.ring.push(PS2.A[0])
+        kb.flag.set()
+        await asyncio.sleep(0)
+    beat_ms = time.ticks_diff(time.ticks_ms(), rig.usb_kb.pump_beat)
+    await rig.stop()
+    busy = sum(1 for n in seen if n)
+    ok = rig.sup.stalls[1] == 0 and busy > len(seen) // 2 and beat_ms < 50
+    print(f"busy pump: events pending in {busy}/{len(seen)} supervisor rounds, "
+          f"pump restarted {rig.sup.stalls[1]} times: {'ok' if ok else 'FAIL'}")
+    return ok
+
+
+async def default_log(args):
+    runs = []
+
+    async def flaky():
+        runs.append(time.ticks_ms())
+        if len(runs) == 1:
+            raise OSError(5, "EIO")
+        await asyncio.Event().wait()
+
+    sup = Supervisor(stall_ms=args.stall_ms)
+    sup.add("flaky", flaky)
+    await asyncio.sleep(0.05)
+    guard_ok = sup.tasks[0] is not None
+    for t in sup.tasks:
+        if t: t.cancel()
+    ok = len(runs) == 2 and sup.crashes[0] == 1 and guard_ok
+    print(f"default log: crash logged, task run {len(runs)} times: {'ok' if ok else 'FAIL'}")
+    return ok
+
+
+async def scenarios(args):
+    ok = await crash(args)
+    ok &= await stall(args)
+    ok &= await crash_loop(args)
+    ok &= await recovery(args)
+    ok &= await busy_pump(args)
+    ok &= await default_log(args)
+    return ok
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--stall-ms", type=int, default=main.STALL_MS, help="Supervisor stall_ms")
+    return 0 if asyncio.run(scenarios(parser.parse_args())) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -137,3 +137,36 @@ class USB:
     APP = getattr(KeyCode, 'APPLICATION', 0x65)
     ISO_SLASH = getattr(KeyCode, 'NON_US_BACKSLASH', getattr(KeyCode, 'ISO_BACKSLASH', 0x64))
     ISO_HASH = getattr(KeyCode, 'HASH', getattr(KeyCode, 'NON_US_HASH', 0x32))
+
+# HID usage pages of the key actions
+PAGE_DESKTOP = 0x01   # System Control
+PAGE_KEYBOARD = 0x07
+PAGE_CONSUMER = 0x0C
+PAGE_TEXT = 0x00      # Not sent as a usage: the action types a string (layout.py)
+
+class CONSUMER:
+    """USB HID Consumer Control Usage IDs (Page 0x0C)"""
+    MEDIA_NEXT = 0xB5
+    MEDIA_PREV = 0xB6
+    MEDIA_STOP = 0xB7
+    MEDIA_PLAY = 0xCD
+    MUTE = 0xE2
+    VOL_UP = 0xE9
+    VOL_DOWN = 0xEA
+    MEDIA_SELECT = 0x183
+    MAIL = 0x18A
+    CALC = 0x192
+    MY_COMPUTER = 0x194
+    WWW_SEARCH = 0x221
+    WWW_HOME = 0x223
+    WWW_BACK = 0x224
+    WWW_FORWARD = 0x225
+    WWW_STOP = 0x226
+    WWW_REFRESH = 0x227
+    WWW_FAVORITES = 0x22A
+
+class SYSTEM:
+    """USB HID System Control Usage IDs (Page 0x01)"""
+    POWER = 0x81
+    SLEEP = 0x82
+    WAKE = 0x83
@@ -0,0 +1,23 @@
+# usb_interval.py - Polling interval of HID interrupt endpoints
+#
+# HIDInterface.desc_cfg always asks for the micropython-lib default interval
+# (8 ms), so the host collects at most one report per 8 ms from each
+# interface. set_interval rewrites bInterval in the descriptors an interface
+# has just written; at full speed it counts 1 ms frames (1-255).
+
+_DESC_ENDPOINT = 0x05
+_EP_INTERRUPT = 0x03
+
+
+def set_interval(desc, start, interval_ms):
+    """Patch every interrupt endpoint descriptor in desc.b[start:desc.o]"""
+    b = desc.b
+    if b is None:
+        return  # First pass only measures the descriptor length
+    if not 1 <= interval_ms <= 255:
+        raise ValueError("Endpoint interval must be 1-255 ms")
+    i = start
+    while i < desc.o and b[i]:
+        if b[i + 1] == _DESC_ENDPOINT and b[i + 3] & 0x03 == _EP_INTERRUPT:
+            b[i + 6] = interval_ms
+        i += b[i]